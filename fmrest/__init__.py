@@ -2,3 +2,8 @@ u"""python-fmrest is a wrapper around the FileMaker Data API"""
 from __future__ import absolute_import
 from .server import Server
 from .cloudserver import CloudServer
+from .sessionpool import SessionPool
+from .tokenstore import FileTokenStore
+from .responsecache import ResponseCache
+from .recordcache import RecordCache
+from .mirror import SQLiteMirror
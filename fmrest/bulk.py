@@ -0,0 +1,168 @@
+u"""Result type and unit of work for bulk write operations"""
+from __future__ import with_statement
+from __future__ import absolute_import
+from collections import namedtuple, OrderedDict
+from .const import FMSErrorCode
+from .exceptions import FMRestException, FileMakerError
+from .utils import concurrent_map
+
+class WriteResult(namedtuple(u'WriteResult', [u'record_id', u'mod_id', u'error'])):
+    u"""Outcome of writing a single record as part of a bulk operation.
+
+    record_id and mod_id are the ids reported by FMS after a successful write (mod_id may be None
+    for operations that don't return one). error holds the FMRestException (e.g. FileMakerError or
+    RequestException) raised for this record, or None on success.
+    """
+    __slots__ = ()
+
+    @property
+    def ok(self):
+        u"""Returns True if the record was written successfully."""
+        return self.error is None
+
+class UnitOfWork(object):
+    u"""Collects edits of records and writes them back to FileMaker in one go.
+
+    Instead of sending a PATCH request for every Server.edit() call, edits are buffered per
+    record id. Repeated edits of the same record are merged into one request. On commit(), all
+    buffered edits are sent concurrently and a WriteResult is kept for every record.
+
+    Get an instance via Server.unit_of_work(). Used as with statement, the edits are committed
+    when the block is left without an exception and discarded otherwise.
+    """
+
+    def __init__(self, server, concurrency = 4,
+                 validate_mod_id = False,
+                 session_pool = None):
+        u"""Initialize the UnitOfWork class.
+
+        Parameters
+        ----------
+        server : Server
+            Server instance to write the edits through
+        concurrency : int, optional
+            Maximum number of edit requests in flight on commit. Defaults to 4
+        validate_mod_id : bool, optional
+            If True, the modification id of the first registered version of each record is sent
+            with the edit, so that records changed on the server in the meantime are not
+            overwritten but reported as conflicts. Defaults to False.
+        session_pool : SessionPool, optional
+            Pool to take sessions from on commit. Without a pool, all edits are sent through the
+            given server.
+        """
+        self.concurrency = concurrency
+        self.validate_mod_id = validate_mod_id
+
+        self._server = server
+        self._session_pool = session_pool
+        self._pending = OrderedDict() # record_id: [field_data, mod_id]
+        self.results = OrderedDict() # record_id: WriteResult
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_traceback):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.discard()
+
+    def __repr__(self):
+        return u'<UnitOfWork pending={} committed={}>'.format(len(self._pending), len(self.results))
+
+    def edit(self, record):
+        u"""Registers the modifications of the given Record instance."""
+        mod_id = record.modification_id if self.validate_mod_id else None
+        self.edit_record(record.record_id, record.modifications(), mod_id)
+
+    def edit_record(self, record_id, field_data,
+                    mod_id = None):
+        u"""Registers an edit of field_data for the record with the given record_id.
+
+        If the record already has pending edits, field_data is merged into them (later values
+        win). The mod_id registered first is kept.
+        """
+        record_id = int(record_id)
+        pending = self._pending.get(record_id)
+
+        if pending is None:
+            self._pending[record_id] = [dict(field_data), mod_id]
+        else:
+            pending[0].update(field_data)
+            if pending[1] is None:
+                pending[1] = mod_id
+
+    @property
+    def pending(self):
+        u"""Returns the number of records with edits waiting to be committed."""
+        return len(self._pending)
+
+    @property
+    def conflicts(self):
+        u"""Returns the record ids that were not written because their modification id changed."""
+        return [
+            record_id for record_id, result in self.results.items()
+            if isinstance(result.error, FileMakerError) and
+            result.error.error_code == FMSErrorCode.MOD_ID_MISMATCH.value
+        ]
+
+    @property
+    def failed(self):
+        u"""Returns a dict of record id: FMRestException for all records that were not written."""
+        return dict(
+            (record_id, result.error) for record_id, result in self.results.items()
+            if result.error is not None
+        )
+
+    def commit(self):
+        u"""Sends all pending edits concurrently. Returns a dict of record_id: WriteResult.
+
+        Failing edits don't stop the others; their error is reported in the WriteResult. If
+        commit() is interrupted by an unexpected exception, the edits written so far are kept in
+        results and only the remaining ones stay pending.
+        """
+        def write(item):
+            record_id, (field_data, mod_id) = item
+            try:
+                if self._session_pool is None:
+                    response = self._server._edit_record(record_id, field_data, mod_id)
+                else:
+                    with self._session_pool.session() as server:
+                        response = server._edit_record(record_id, field_data, mod_id)
+            except FMRestException, ex:
+                return record_id, WriteResult(record_id, None, ex)
+
+            new_mod_id = response.get(u'modId')
+            return record_id, WriteResult(
+                record_id, int(new_mod_id) if new_mod_id is not None else None, None)
+
+        results = OrderedDict()
+        for record_id, result in concurrent_map(write, self._pending.items(), self.concurrency):
+            results[record_id] = result
+            self.results[record_id] = result
+            self._pending.pop(record_id, None)
+        return results
+
+    def discard(self):
+        u"""Drops all pending edits without writing them."""
+        self._pending = OrderedDict()
+
+class BulkProgress(object):
+    u"""Counters of a bulk operation like Server.delete_where(), updated while it runs."""
+
+    def __init__(self):
+        self.matched = 0
+        self.processed = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.errors = OrderedDict() # record_id: FMRestException
+
+    def __repr__(self):
+        return u'<BulkProgress matched={} processed={} succeeded={} failed={}>'.format(
+            self.matched, self.processed, self.succeeded, self.failed
+        )
+
+    @property
+    def is_complete(self):
+        u"""Returns True if all matched records have been processed."""
+        return self.processed >= self.matched
@@ -37,7 +37,8 @@ class CloudServer(Server):
                  data_sources = None,
                  verify_ssl = True,
                  type_conversion = False,
-                 auto_relogin = False
+                 auto_relogin = False,
+                 **kwargs
                  ):
         u"""Initialize the CloudServer class.
 
@@ -79,12 +80,16 @@ class CloudServer(Server):
 
             Be cautious with this parameter, as results may be different from what you expect!
 
-            Values will be converted into int, float, datetime, timedelta, string. This happens
-            on a record level, not on a foundset level.
+            Values will be converted into int, float, datetime, timedelta, string. The type of
+            each field is decided once per foundset, values not matching it are converted
+            individually, so the result is the same as converting each value on its own.
         auto_relogin : bool, optional
             If True, tries to automatically get a new token (re-login) when a
             request comes back with a 952 (invalid token) error. Defaults to
             False.
+        **kwargs
+            Further keyword arguments are passed on to Server, e.g. proxies or the connection
+            pool settings pool_connections, pool_maxsize, keep_alive and session.
         """
 
         if not _has_pycognito:
@@ -101,11 +106,11 @@ class CloudServer(Server):
                          data_sources=data_sources,
                          verify_ssl=verify_ssl,
                          type_conversion=type_conversion,
-                         auto_relogin=auto_relogin)
+                         auto_relogin=auto_relogin,
+                         **kwargs)
 
         self.cognito_userpool_id = cognito_userpool_id
         self.cognito_client_id = cognito_client_id
-        self._fmid_token = None
 
     def _get_cognito_token(self):
         u"""Use Pycognito library to authenticate with Amazon Cognito and retrieve FMID token."""
@@ -116,30 +121,22 @@ class CloudServer(Server):
         user.authenticate(self.password)
         return user.id_token
 
-    def _get_bearer_token(self):
-        u"""Retrieve the bearer token needed to authenticate FileMaker Data API calls."""
+    def _get_bearer_token(self, fmid_token):
+        u"""Retrieve the bearer token needed to authenticate FileMaker Data API calls.
+
+        The FMID token is only sent with this request, so that concurrent requests of other
+        threads keep using the current bearer token.
+        """
 
         path = API_PATH[u'auth'].format(database=self.database, token=u'')
         data = {u'fmDataSource': self.data_sources}
 
-        response = self._call_filemaker(u'POST', path, data=data)
+        response = self._call_filemaker(u'POST', path, data=data,
+                                        authorization=u'FMID ' + fmid_token)
         return response.get(u'token', None)
 
-    def _update_token_header(self):
-        u"""Override token header update method to use FMID token if set."""
-
-        if self._fmid_token:
-            self._headers[u'Authorization'] = u'FMID ' + self._fmid_token
-        elif self._token:
-            self._headers[u'Authorization'] = u'Bearer ' + self._token
-        else:
-            self._headers.pop(u'Authorization', None)
-        return self._headers
-
-    def login(self):
-        u"""Override Server login so we obtain FMID token from Cognito first"""
+    def _request_token(self):
+        u"""Override Server token request so we obtain FMID token from Cognito first. Server.login()
+        still handles the token_store and token bookkeeping."""
 
-        self._fmid_token = self._get_cognito_token()
-        self._token = self._get_bearer_token()
-        self._fmid_token = None  # Reset FMID token so auth headers are set appropriately for data api calls
-        return self._token
+        return self._get_bearer_token(self._get_cognito_token())
@@ -13,7 +13,9 @@ API_PATH = {
     u'record_action':    u'/fmi/data/v1/databases/{database}/layouts/{layout}/records/{record_id}',
     u'find':             u'/fmi/data/v1/databases/{database}/layouts/{layout}/_find',
     u'script':           u'/fmi/data/v1/databases/{database}/layouts/{layout}/script/{script_name}',
-    u'global':           u'/fmi/data/v1/databases/{database}/globals'
+    u'global':           u'/fmi/data/v1/databases/{database}/globals',
+    u'layout':           u'/fmi/data/v1/databases/{database}/layouts/{layout}',
+    u'validate_session': u'/fmi/data/v1/validateSession'
 }
 
 
@@ -21,6 +23,8 @@ class FMSErrorCode(Enum):
     u"""FMS error codes that are being referenced in the code"""
     SUCCESS = 0
     RECORD_MISSING = 101
+    NO_RECORDS_MATCH = 401
     INVALID_USER_PASSWORD = 212
+    MOD_ID_MISMATCH = 306
     INVALID_DAPI_TOKEN = 952
 FMSErrorCode = unique(FMSErrorCode)
@@ -0,0 +1,315 @@
+u"""Classes for converting Data API values into Python types"""
+from __future__ import absolute_import
+import datetime
+from itertools import izip
+from .utils import convert_string_type, parse_datetime, parse_duration
+
+try:
+    import numpy as np
+except ImportError:
+    _has_numpy = False
+else:
+    _has_numpy = True
+
+STRING = u'string'
+INT = u'int'
+NUMBER = u'number'
+DATETIME = u'datetime'
+TIMEDELTA = u'timedelta'
+MIXED = u'mixed'
+
+def _converters(date_order):
+    u"""Returns a dict of kind to function converting a single value of a field of that kind.
+
+    Values not matching the kind are converted like in Record(type_conversion=True). None means
+    that values are kept as they are.
+    """
+    def convert_value(value):
+        return convert_string_type(value, date_order) if type(value) is unicode and value else value
+
+    def convert_text(value):
+        # a value starting with a letter can't be a number (apart from inf and nan), date or time,
+        # which skips convert_string_type() for most values of text fields
+        if type(value) is not unicode or not value or \
+                (value[0].isalpha() and value[0] not in u'iInN'):
+            return value
+        return convert_string_type(value, date_order)
+
+    def convert_int(value):
+        if type(value) is not unicode:
+            return value
+        try:
+            return int(value)
+        except ValueError:
+            return convert_value(value)
+
+    def convert_number(value):
+        if type(value) is not unicode:
+            return value
+        try:
+            return int(value)
+        except ValueError:
+            pass
+        try:
+            return float(value)
+        except ValueError:
+            return convert_value(value)
+
+    def convert_datetime(value):
+        if type(value) is not unicode:
+            return value
+        try:
+            return parse_datetime(value, date_order)
+        except ValueError:
+            return convert_value(value)
+
+    def convert_timedelta(value):
+        if type(value) is not unicode:
+            return value
+        try:
+            return parse_duration(value)
+        except ValueError:
+            return convert_value(value)
+
+    return {
+        STRING: convert_text,
+        INT: convert_int,
+        NUMBER: convert_number,
+        DATETIME: convert_datetime,
+        TIMEDELTA: convert_timedelta,
+        MIXED: convert_value
+    }
+
+class TypeInference(object):
+    u"""Decides once per field which type its values have and converts them accordingly.
+
+    convert_string_type() tries every conversion for every value. TypeInference instead looks at
+    the first sample_size values of a field, remembers the winning type and then converts the
+    remaining values of the field with that type only:
+
+        inference = TypeInference()
+        names = inference.convert_column('name', names)
+        rows = [inference.convert_row(keys, row) for row in rows]
+
+    The result types are the ones of Record(type_conversion=True): int, float, datetime,
+    timedelta or string. Values not matching the type decided for their field are converted like
+    in a Record, so the results are the same as with Record, only faster. Use one instance per
+    foundset (or layout), as decisions are kept by field name.
+    """
+
+    def __init__(self, sample_size = 100,
+                 date_order = u'MDY'):
+        u"""Initialize the TypeInference class.
+
+        Parameters
+        ----------
+        sample_size : int, optional
+            Number of values of a field that are converted individually before the type of the
+            field is decided. Defaults to 100.
+        date_order : str, optional
+            Order of month, day and year in dates, see fmrest.utils.parse_datetime(). Defaults to
+            'MDY'.
+        """
+        self.sample_size = sample_size
+        self.date_order = date_order
+        self._convert = _converters(date_order)
+
+        self._kinds = {} # field name -> decided kind
+        self._samples = {} # field name -> [number of values sampled, set of resulting types]
+        self._row_converters = (None, None) # keys and converters of the last row
+
+    def kind(self, key):
+        u"""Returns the type decided for field key (e.g. 'int' or 'string'), or None if not decided
+        yet."""
+        return self._kinds.get(key)
+
+    def convert_column(self, key, values,
+                       as_array = False):
+        u"""Returns the converted values of field key.
+
+        Parameters
+        ----------
+        key : str
+            Field name
+        values : list
+            All values of the field
+        as_array : bool, optional
+            If True and NumPy is installed, int and number columns are converted by NumPy and
+            returned as int64/float64 arrays where possible. Meant for building DataFrames.
+        """
+        if key not in self._kinds:
+            sample = []
+            for value in values:
+                if type(value) is unicode and value:
+                    sample.append(value)
+                    if len(sample) == self.sample_size:
+                        break
+            if not sample:
+                return values
+            self._learn(key, [convert_string_type(value, self.date_order) for value in sample],
+                        force=True)
+
+        kind = self._kinds[key]
+        if kind in (INT, NUMBER) and set(map(type, values)) == set([unicode]):
+            try:
+                if as_array and _has_numpy:
+                    return np.array(values).astype(np.int64 if kind == INT else np.float64)
+                if kind == INT:
+                    return map(int, values)
+            except (ValueError, TypeError, OverflowError):
+                pass
+
+        converter = self._convert[kind]
+        return [converter(value) for value in values]
+
+    def convert_row(self, keys, values):
+        u"""Returns the converted values of a row with the given keys (field names).
+
+        Values of fields that are not decided yet are converted individually and used as
+        sample. Passing the same keys object (e.g. a RecordSchema) for consecutive rows is
+        fastest.
+        """
+        row_keys, converters = self._row_converters
+        if keys is not row_keys:
+            converters = self._converters(keys)
+
+        if converters is not None:
+            return [value if converter is None else converter(value)
+                    for converter, value in izip(converters, values)]
+
+        converted = []
+        for key, value in izip(keys, values):
+            kind = self._kinds.get(key)
+            if kind is not None:
+                converter = self._convert[kind]
+                converted.append(value if converter is None else converter(value))
+            elif type(value) is unicode and value:
+                value = convert_string_type(value, self.date_order)
+                self._learn(key, [value])
+                converted.append(value)
+            else:
+                # empty values count towards the sample, so that empty fields get decided, too
+                self._learn(key, [])
+                converted.append(value)
+
+        self._converters(keys)
+        return converted
+
+    def _converters(self, keys):
+        u"""Caches and returns the converters for keys, or None if not all fields are decided."""
+        try:
+            converters = [self._convert[self._kinds[key]] for key in keys]
+        except KeyError:
+            converters = None
+
+        self._row_converters = (keys, converters) if converters is not None else (None, None)
+        return converters
+
+    def _learn(self, key, converted, force = False):
+        u"""Adds the converted sample values of field key (or an empty value, if converted is
+        empty) and decides the kind once enough values (or with force, any values) were seen."""
+        sample = self._samples.setdefault(key, [0, set()])
+        sample[0] += len(converted) or 1
+        sample[1].update(type(value) for value in converted)
+
+        if force or sample[0] >= self.sample_size:
+            self._kinds[key] = _decide(sample[1])
+            del self._samples[key]
+
+def _decide(types):
+    u"""Returns the kind for a field whose sampled values were converted into the given types."""
+    if not types:
+        # only empty values seen, so convert any other value individually
+        return MIXED
+    if types == set([unicode]):
+        return STRING
+    if types <= set([int, long]):
+        return INT
+    if types <= set([int, long, float]):
+        return NUMBER
+    if types == set([datetime.datetime]):
+        return DATETIME
+    if types == set([datetime.timedelta]):
+        return TIMEDELTA
+    return MIXED
+
+class MetadataConversion(object):
+    u"""Converts values according to the field result types declared in the layout metadata.
+
+    Unlike TypeInference, nothing is guessed: number fields become int or float, date fields
+    date, time fields timedelta and timestamp fields datetime. Text and container fields (e.g. zip
+    codes) as well as fields missing in the metadata (e.g. recordId) are not converted. Values
+    that can't be parsed as their declared type (e.g. an invalid date) are kept as strings.
+    """
+
+    def __init__(self, metadata, date_order = u'MDY'):
+        u"""Initialize the MetadataConversion class.
+
+        Parameters
+        ----------
+        metadata : dict
+            Layout metadata as returned by Server.get_layout_metadata(). The fields of
+            fieldMetaData and of all portals in portalMetaData are used.
+        date_order : str, optional
+            Order of month, day and year in dates, see fmrest.utils.parse_datetime(). Defaults to
+            'MDY'.
+        """
+        self.date_order = date_order
+
+        convert = _result_converters(date_order)
+        fields = list(metadata.get(u'fieldMetaData', []))
+        for portal_fields in metadata.get(u'portalMetaData', {}).itervalues():
+            fields.extend(portal_fields)
+
+        self._converters = dict(
+            (field[u'name'], convert.get(field.get(u'result'))) for field in fields
+        )
+        self._row_converters = (None, None) # keys and converters of the last row
+
+    def result_converter(self, key):
+        u"""Returns the function converting values of field key, or None if they are kept."""
+        return self._converters.get(key)
+
+    def convert_column(self, key, values,
+                       as_array = False):
+        u"""Returns the converted values of field key. as_array is accepted for compatibility with
+        TypeInference, numeric columns are left to pandas' dtype inference."""
+        converter = self._converters.get(key)
+        if converter is None:
+            return values
+        return [converter(value) for value in values]
+
+    def convert_row(self, keys, values):
+        u"""Returns the converted values of a row with the given keys (field names)."""
+        row_keys, converters = self._row_converters
+        if keys is not row_keys:
+            converters = [self._converters.get(key) for key in keys]
+            self._row_converters = (keys, converters)
+
+        return [value if converter is None else converter(value)
+                for converter, value in izip(converters, values)]
+
+def _result_converters(date_order):
+    u"""Returns a dict of FileMaker field result type to function converting a single value."""
+    def converter(parse):
+        def convert(value):
+            if type(value) is not unicode or not value:
+                return value
+            try:
+                return parse(value)
+            except ValueError:
+                return value
+        return convert
+
+    def parse_number(value):
+        try:
+            return int(value)
+        except ValueError:
+            return float(value)
+
+    return {
+        u'number': converter(parse_number),
+        u'date': converter(lambda value: parse_datetime(value, date_order).date()),
+        u'time': converter(parse_duration),
+        u'timeStamp': converter(lambda value: parse_datetime(value, date_order))
+    }
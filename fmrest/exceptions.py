@@ -55,6 +55,7 @@ class FileMakerError(FMRestException):
     u"""Error raised by FileMaker Data API"""
 
     def __init__(self, error_code, error_message):
+        self.error_code = int(error_code)
         super(FileMakerError, self).__init__(u'FileMaker Server returned error {}, {}'.format(error_code, error_message))
 
 class RecordError(FMRestException):
@@ -1,19 +1,42 @@
 u"""Foundset class for collections of Records"""
 
 from __future__ import absolute_import
+import array
+import collections
+import functools
 import itertools
-from .utils import cache_generator
-from .record import Record
+import operator
+import tempfile
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+from .utils import cache_generator, import_pandas
+from .conversion import TypeInference
+from .record import Record, RecordSchema
+from .const import PORTAL_PREFIX
 
 class Foundset(object):
     u"""A set of Record instances
 
     Foundsets are used for both find results and portal data (related records)
     """
-    def __init__(self, records, info = {}):
+    def __init__(self, records, info = {},
+                 data = None, conversion = None,
+                 cache = u'all'):
         u"""Initialize the Foundset class.
 
         The foundset is cached while being consumed, so that subsequent iterations are possible.
+        How many of the consumed records are kept is decided by the cache policy:
+
+            Foundset(records)                       # 'all': keep every record in memory
+            Foundset(records, cache='none')         # keep nothing, for a single pass
+            Foundset(records, cache=window(100))    # keep the last 100 records
+            Foundset(records, cache=spill(2 ** 26)) # page older records to a temp file
+
+        Iterating again yields the records the policy still holds, followed by the ones not
+        consumed yet. Indexing works for all held records and raises IndexError for records that
+        were dropped.
 
         Parameters
         ----------
@@ -23,14 +46,29 @@ class Foundset(object):
         info : dictionary
             Dictionary of information about the foundset. This is 1:1 the dictionary that
             is delivered by FMS for any foundset.
+        data : list of dicts, optional
+            The records of the FMS response (its data key) that records are built from. Lets
+            to_df() read the values from the response instead of building Records. The reference
+            is dropped as soon as the first record is consumed. Ignored unless cache is 'all'.
+        conversion : TypeInference or MetadataConversion, optional
+            Converts the columns built from data (if records are built with type conversion).
+        cache : str or callable, optional
+            Cache policy: 'all' (default), 'none', or the result of window() or spill().
         """
-        self._records = records
         self._consumed = False
         self._info = info
+        self._conversion = conversion
+
+        # data is only useful for to_df() until a record is handed out (and possibly changed), so
+        # it is held in a list that is emptied then, instead of keeping the response alive
+        if cache != u'all':
+            data = None
+        self._data = [data]
+        self._records = _release_data(records, self._data) if data is not None else records
 
         # We hold the list of cached values and the state of completion in a list
         # idea: https://codereview.stackexchange.com/a/178780/151724
-        self._cache = [[], False]
+        self._cache = [_record_store(cache), False]
 
         # cache_generator will yield the values and handle the caching
         self._iter = cache_generator(self._records, self._cache)
@@ -65,6 +103,17 @@ class Foundset(object):
 
         return self._cache[0][index]
 
+    def __reduce__(self):
+        u"""Pickles the foundset (e.g. a portal of a spilled Record) as list of its records. Not
+        consumed records are consumed. Raises TypeError if records were already dropped by the
+        cache policy, as they can't be restored."""
+        store = self._cache[0]
+        if isinstance(store, _WindowStore) and len(store._records) < len(store):
+            dropped = len(store) - len(store._records)
+            raise TypeError(u'Foundset dropped {} records due to its cache policy and can not be '
+                            u'pickled.'.format(dropped))
+        return (Foundset, (list(self), self._info))
+
     def __repr__(self):
         return u'<Foundset consumed_records={} is_complete={}>'.format(
             len(self._cache[0]), self.is_complete
@@ -85,14 +134,447 @@ class Foundset(object):
 
         Note that portal data is not returned as part of the DataFrame.
         """
-        try:
-            import pandas as pd
-        except ImportError, ex:
-            raise Exception(
-                u"You need to have Pandas installed to use this feature. "
-                u"You can install it like this: 'pip install pandas'"
-            )
+        pd = import_pandas()
+
+        data = self._data[0]
+        if data is not None:
+            # no Record has been handed out (and possibly changed) yet, so the columns can be
+            # built from the response directly
+            columns = collections.OrderedDict()
+            append_columns(columns, data, 0)
+            return columns_to_df(columns, self._conversion)
 
         return pd.DataFrame(
             [r.to_dict(ignore_portals=True) for r in self]
         )
+
+def _release_data(records, data):
+    u"""Yields the records, emptying the list data (see Foundset) before the first one."""
+    for record in records:
+        data[0] = None
+        yield record
+
+def window(size):
+    u"""Returns a Foundset cache policy keeping only the last size consumed records."""
+    if size < 0:
+        raise ValueError(u'size must not be negative.')
+    return functools.partial(_WindowStore, size)
+
+def spill(max_bytes = 64 * 1024 * 1024,
+          directory = None):
+    u"""Returns a Foundset cache policy keeping all consumed records, but only the most recent
+    ones up to max_bytes (estimated pickled size) in memory. Older records are pickled into an
+    anonymous temporary file in directory (defaults to the system's temp directory).
+
+    Records read back from the file are copies, so changes made to them are not kept.
+    """
+    if max_bytes < 0:
+        raise ValueError(u'max_bytes must not be negative.')
+    return functools.partial(_SpillStore, max_bytes, directory)
+
+def _record_store(cache):
+    u"""Returns the list-like object holding the consumed records of a Foundset for the policy
+    cache."""
+    if cache == u'all':
+        return []
+    if cache == u'none':
+        return _WindowStore(0)
+    if callable(cache):
+        return cache()
+    raise ValueError(u'Unknown cache policy {!r}.'.format(cache))
+
+class _WindowStore(object):
+    u"""Record store keeping the last size records. Indexes count all appended records."""
+    __slots__ = (u'_records', u'_count')
+
+    def __init__(self, size):
+        self._records = collections.deque(maxlen=size)
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        return iter(list(self._records))
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self._count
+        first = self._count - len(self._records)
+        if not first <= index < self._count:
+            raise IndexError(u'Record {} is not held by the Foundset cache.'.format(index))
+        return self._records[index - first]
+
+    def append(self, record):
+        self._records.append(record)
+        self._count += 1
+
+class _SpillStore(object):
+    u"""Record store keeping the most recent records up to max_bytes in memory and older ones
+    pickled in a temporary file."""
+
+    def __init__(self, max_bytes, directory = None):
+        self.max_bytes = max_bytes
+        self.directory = directory
+
+        self._memory = collections.deque() # (record, pickled size) not spilled yet, oldest first
+        self._memory_bytes = 0
+        self._file = None
+        self._offsets = array.array(str(u'd')) # file offset of each spilled record
+        self._end = 0 # end of the file
+
+    def __len__(self):
+        return len(self._offsets) + len(self._memory)
+
+    def __iter__(self):
+        return (self[index] for index in xrange(len(self)))
+
+    def __getitem__(self, index):
+        length = len(self)
+        if index < 0:
+            index += length
+        if not 0 <= index < length:
+            raise IndexError(u'Foundset index out of range')
+
+        spilled = len(self._offsets)
+        if index >= spilled:
+            return self._memory[index - spilled][0]
+
+        start = int(self._offsets[index])
+        end = int(self._offsets[index + 1]) if index + 1 < spilled else self._end
+        self._file.seek(start)
+        return pickle.loads(self._file.read(end - start))
+
+    def append(self, record):
+        size = _estimated_size(record)
+        self._memory.append((record, size))
+        self._memory_bytes += size
+
+        while self._memory_bytes > self.max_bytes and self._memory:
+            self._spill()
+
+    def _spill(self):
+        u"""Moves the oldest record in memory to the file."""
+        record, size = self._memory.popleft()
+        self._memory_bytes -= size
+
+        if self._file is None:
+            self._file = tempfile.TemporaryFile(dir=self.directory)
+        blob = pickle.dumps(record, pickle.HIGHEST_PROTOCOL)
+        self._file.seek(self._end)
+        self._file.write(blob)
+        self._offsets.append(self._end)
+        self._end += len(blob)
+
+def _estimated_size(record):
+    u"""Returns an estimate of the pickled size of record from the lengths of its field names
+    and text values, without pickling it. Portals are estimated from their records."""
+    size = 64
+    for key, value in itertools.izip(record.keys(), record.values()):
+        if isinstance(value, basestring):
+            size += len(key) + len(value) + 8
+        elif isinstance(value, Foundset):
+            size += len(key) + sum(_estimated_size(portal_record) for portal_record in value)
+        else:
+            size += len(key) + 24
+    return size
+
+def append_columns(columns, data, length):
+    u"""Appends the field values of the records in data (the data key of an FMS response) to
+    columns, a dict of field name to list of values. Returns the new number of rows.
+
+    Columns are built one field at a time without building Records. Portal data is left out.
+    Fields missing in some records are filled up with None.
+
+    Parameters
+    ----------
+    columns : dict
+        Dict of field name to list of values, usually an OrderedDict. Modified in place.
+    data : list of dicts
+        Records as returned by FMS
+    length : int
+        Number of rows already in columns
+    """
+    if not data:
+        return length
+
+    # records of a layout have the same fields, so only records with a different number of fields
+    # are checked for additional ones
+    field_count = len(data[0][u'fieldData'])
+    keys = [key for key in data[0][u'fieldData'] if key != u'recordId' and key != u'modId']
+    for record in data:
+        if len(record[u'fieldData']) != field_count:
+            for key in record[u'fieldData']:
+                if key not in keys and key != u'recordId' and key != u'modId':
+                    keys.append(key)
+
+    field_data = [record[u'fieldData'] for record in data]
+    for key in keys:
+        column = columns.get(key)
+        if column is None:
+            column = columns[key] = [None] * length
+        try:
+            column.extend(map(operator.itemgetter(key), field_data))
+        except KeyError:
+            column.extend([fields.get(key) for fields in field_data])
+
+    for key in (u'recordId', u'modId'):
+        column = columns.get(key)
+        if column is None:
+            column = columns[key] = [None] * length
+        column.extend([record.get(key) for record in data])
+
+    length += len(data)
+    for column in columns.itervalues():
+        if len(column) < length:
+            column.extend([None] * (length - len(column)))
+    return length
+
+def columns_to_df(columns, conversion = None):
+    u"""Returns a Pandas DataFrame of columns, a dict of field name to list of values as built by
+    append_columns(). The dtype of each column is inferred once for the whole column.
+
+    If conversion (a TypeInference or MetadataConversion) is given, each column is converted as a
+    whole by it."""
+    pd = import_pandas()
+
+    if conversion is not None:
+        for key, column in columns.iteritems():
+            columns[key] = conversion.convert_column(key, column, as_array=True)
+
+    return pd.DataFrame(columns, columns=list(columns))
+
+_MISSING = object() # value of a field that a row doesn't have
+
+class _DictColumn(object):
+    u"""Dictionary-encoded column: each distinct value is stored once, rows hold its code."""
+    __slots__ = (u'codes', u'categories', u'_lookup')
+
+    def __init__(self, typecode):
+        self.codes = array.array(str(typecode))
+        self.categories = []
+        self._lookup = {}
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, index):
+        return self.categories[self.codes[index]]
+
+    def append(self, value):
+        u"""Appends value. Returns False (without appending) if value cannot be encoded."""
+        code = self._lookup.get(value)
+        if code is None:
+            code = len(self.categories)
+            try:
+                self.codes.append(code)
+            except OverflowError:
+                return False
+            self._lookup[value] = code
+            self.categories.append(value)
+        else:
+            self.codes.append(code)
+        return True
+
+    def decode(self):
+        u"""Returns the values as a plain list."""
+        categories = self.categories
+        return [categories[code] for code in self.codes]
+
+class ColumnarFoundset(Foundset):
+    u"""A Foundset storing each field as one column instead of holding one Record per row.
+
+    Meant for large result sets: memory is dominated by the values themselves instead of a Record
+    with a list of values per row. Text columns with few distinct values (up to max_categories)
+    are dictionary-encoded, i.e. each distinct value is held once and rows store a small integer
+    code.
+
+    Records are only created when rows are accessed (by iterating or indexing) and are not kept.
+    Changes made to such a Record are therefore not visible when accessing the row again.
+
+        foundset = ColumnarFoundset(fms.iter_records(page_size=1000))
+        foundset.column('name')
+        foundset[0].name
+    """
+
+    def __init__(self, records = (), info = {},
+                 max_categories = 256):
+        u"""Initialize the ColumnarFoundset class.
+
+        Parameters
+        ----------
+        records : iterable, optional
+            Records to store, e.g. a Foundset or the generator returned by Server.iter_records().
+            Records are consumed immediately and not referenced afterwards.
+        info : dictionary
+            Dictionary of information about the foundset, as delivered by FMS.
+        max_categories : int, optional
+            Maximum number of distinct values for a text column to be dictionary-encoded. Columns
+            exceeding it are stored as plain lists. Use 0 to disable encoding. Defaults to 256.
+        """
+        self._info = info
+        self.max_categories = max_categories
+
+        self._schema = RecordSchema([])
+        self._last_keys = None
+        self._inference = None
+        self._columns = []
+        self._length = 0
+        self._in_portal = False
+
+        self.extend(records)
+
+    def __len__(self):
+        return self._length
+
+    def __iter__(self):
+        u"""Iterates over Records built for each row."""
+        return (self._row(index) for index in xrange(self._length))
+
+    def __getitem__(self, index):
+        u"""Returns a Record built for the row at index."""
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError(u'ColumnarFoundset index out of range')
+        return self._row(index)
+
+    def __repr__(self):
+        return u'<ColumnarFoundset records={} columns={}>'.format(
+            self._length, len(self._columns)
+        )
+
+    @property
+    def is_complete(self):
+        u"""Returns True, as all records are stored on creation."""
+        return True
+
+    def keys(self):
+        u"""Returns the names of all columns."""
+        return list(self._schema)
+
+    def column(self, key):
+        u"""Returns a list of the values of field key for all rows. Rows without the field have
+        None."""
+        try:
+            column = self._columns[self._schema.index(key)]
+        except ValueError:
+            raise KeyError(u'No column named {}.'.format(key))
+
+        values = column.decode() if isinstance(column, _DictColumn) else list(column)
+        return [None if value is _MISSING else value for value in values]
+
+    def extend(self, records):
+        u"""Appends the given Records as rows."""
+        for record in records:
+            self._in_portal = self._in_portal or record._in_portal
+            # the schema of a Record is shared with the other records of its response
+            keys = record._keys if type(record) is Record else record.keys()
+            self.append_row(keys, record.values())
+
+    def append_row(self, keys, values,
+                   type_conversion = False):
+        u"""Appends a row given as keys and corresponding values.
+
+        Parameters
+        ----------
+        keys : list or RecordSchema
+            Field names of the row. Passing the same RecordSchema for consecutive rows is fastest.
+        values : list
+            Values corresponding to keys
+        type_conversion : bool, optional
+            If True, convert string values like a Record with type_conversion does. The type of
+            each field is decided once for the foundset, see TypeInference.
+        """
+        same_keys = keys is self._last_keys or tuple(keys) == self._schema
+        if not same_keys:
+            self._add_columns(keys)
+            same_keys = tuple(keys) == self._schema
+        # consecutive rows usually share their keys, so remember them to skip the comparison
+        self._last_keys = keys if same_keys else None
+
+        if type_conversion:
+            if self._inference is None:
+                self._inference = TypeInference()
+            values = self._inference.convert_row(keys, values)
+
+        if same_keys:
+            for index, value in enumerate(values):
+                self._append_value(index, value)
+        else:
+            row = dict(itertools.izip(keys, values))
+            for index, key in enumerate(self._schema):
+                self._append_value(index, row.get(key, _MISSING))
+
+        self._length += 1
+
+    def to_df(self):
+        u"""Returns a Pandas DataFrame of the Foundset. Must have Pandas installed.
+
+        Dictionary-encoded columns become categorical columns. Note that portal data is not
+        returned as part of the DataFrame.
+        """
+        pd = import_pandas()
+
+        data = {}
+        for key, column in itertools.izip(self._schema, self._columns):
+            if key.startswith(PORTAL_PREFIX):
+                continue
+            if isinstance(column, _DictColumn) and _MISSING not in column.categories:
+                data[key] = pd.Categorical.from_codes(column.codes, column.categories)
+            else:
+                data[key] = self.column(key)
+
+        return pd.DataFrame(data, columns=[key for key in self._schema if key in data])
+
+    def _row(self, index):
+        u"""Returns a Record for the row at index."""
+        values = [column[index] for column in self._columns]
+        schema = self._schema
+
+        if _MISSING in values:
+            schema = RecordSchema(key for key, value in itertools.izip(schema, values)
+                                  if value is not _MISSING)
+            values = [value for value in values if value is not _MISSING]
+
+        return Record(schema, values, in_portal=self._in_portal)
+
+    def _add_columns(self, keys):
+        u"""Adds columns for keys that are not in the schema yet."""
+        new_keys = [key for key in keys if key not in self._schema]
+        if not new_keys:
+            return
+
+        self._schema = RecordSchema(list(self._schema) + new_keys)
+        for _ in new_keys:
+            column = self._new_column()
+            for _ in xrange(self._length):
+                self._append_to(column, _MISSING)
+            self._columns.append(column)
+
+    def _new_column(self):
+        u"""Returns an empty column, dictionary-encoded if enabled."""
+        if not self.max_categories:
+            return []
+        return _DictColumn(u'B' if self.max_categories <= 256 else u'H'
+                           if self.max_categories <= 65536 else u'l')
+
+    def _append_value(self, index, value):
+        u"""Appends value to the column at index, switching to a plain list if needed."""
+        column = self._columns[index]
+        if not self._append_to(column, value):
+            column = column.decode()
+            column.append(value)
+            self._columns[index] = column
+
+    def _append_to(self, column, value):
+        u"""Appends value to column. Returns False if a dictionary-encoded column can't take it."""
+        if isinstance(column, _DictColumn):
+            if not (value is _MISSING or isinstance(value, basestring)):
+                return False
+            if len(column.categories) >= self.max_categories and value not in column._lookup:
+                return False
+            return column.append(value)
+
+        column.append(value)
+        return True
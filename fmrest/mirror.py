@@ -0,0 +1,266 @@
+u"""SQLiteMirror class for keeping a local copy of a layout up to date"""
+from __future__ import absolute_import
+import datetime
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+
+from .const import PORTAL_PREFIX
+from .utils import parse_datetime
+
+_QUERY_FORMATS = {
+    u'MDY': u'%m/%d/%Y %H:%M:%S',
+    u'DMY': u'%d/%m/%Y %H:%M:%S',
+    u'YMD': u'%Y-%m-%d %H:%M:%S'
+}
+
+_SYNC_TABLE = u'_fmrest_sync'
+
+class SyncResult(namedtuple(u'SyncResult',
+                            [u'inserted', u'updated', u'unchanged', u'deleted', u'full'])):
+    u"""Outcome of SQLiteMirror.sync(): the number of rows inserted, updated (modId changed),
+    left unchanged (pulled, but same modId) and deleted, and whether it was a full pull."""
+
+def _quote(name):
+    u"""Returns name quoted as SQLite identifier."""
+    return u'"{}"'.format(name.replace(u'"', u'""'))
+
+_INT64_MIN = -2 ** 63
+_INT64_MAX = 2 ** 63 - 1
+
+def _sql_value(value):
+    u"""Returns value in a type SQLite can store. Dates, times and timestamps (from type
+    conversion) are stored as ISO 8601 text, as are integers beyond SQLite's 64 bit range."""
+    if isinstance(value, (int, long)) and not _INT64_MIN <= value <= _INT64_MAX:
+        return unicode(value)
+    if value is None or isinstance(value, (unicode, int, long, float)):
+        return value
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    return unicode(value)
+
+class SQLiteMirror(object):
+    u"""A local SQLite copy of the records of a layout, kept up to date incrementally.
+
+    The first sync() pulls all records. Later syncs only find the records whose modification
+    timestamp is at least the latest one seen before, and write those whose modId changed.
+    Records deleted in FileMaker are detected by comparing the record ids of the layout with the
+    local ones, which is cheap with a slim id_layout:
+
+        mirror = fmrest.SQLiteMirror(fms, 'contacts.db', modification_field='ModifiedAt',
+                                     id_layout='Contacts_ids')
+        mirror.sync()
+        mirror.execute('SELECT city, count(*) FROM Contacts GROUP BY city').fetchall()
+
+    Each layout is mirrored into a table (named after the layout by default) with the columns
+    recordId (primary key), modId and one column per field. Columns for new fields are added on
+    the fly, portals are not mirrored. Values are stored as returned by the server (dates,
+    times and timestamps from type conversion as ISO 8601 text, integers beyond 64 bit as text).
+
+    The modification field should be an auto-entered modification timestamp on the server's
+    layout. As its values are compared with themselves only, the clocks of client and server
+    don't matter. Records with an empty or malformed modification timestamp are mirrored, but
+    ignored for the latest timestamp seen.
+    """
+
+    def __init__(self, server, path,
+                 modification_field,
+                 table = None,
+                 id_layout = None,
+                 page_size = 1000):
+        u"""Initialize the SQLiteMirror class.
+
+        Parameters
+        ----------
+        server : Server
+            Logged-in Server instance. Records are pulled from its current layout.
+        path : str
+            Path of the SQLite database file (created if missing), or ':memory:'
+        modification_field : str
+            Name of the modification timestamp field used for incremental pulls
+        table : str, optional
+            Name of the local table. Defaults to None (the name of the server's layout).
+        id_layout : str, optional
+            Response layout used for requesting all record ids when detecting deletions, ideally
+            with only one small field on it. Defaults to None (the server's layout).
+        page_size : int, optional
+            Number of records requested per call. Defaults to 1000.
+        """
+        self.server = server
+        self.path = path
+        self.modification_field = modification_field
+        self.table = table or server.layout
+        self.id_layout = id_layout
+        self.page_size = page_size
+
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.RLock()
+        self._columns = None
+
+        with self.connection:
+            self.connection.execute(
+                u'CREATE TABLE IF NOT EXISTS {} (tbl TEXT PRIMARY KEY, high_water TEXT, '
+                u'synced_at REAL)'.format(_quote(_SYNC_TABLE))
+            )
+            self.connection.execute(
+                u'CREATE TABLE IF NOT EXISTS {} (recordId INTEGER PRIMARY KEY, '
+                u'modId INTEGER)'.format(_quote(self.table))
+            )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_traceback):
+        self.close()
+
+    def __repr__(self):
+        return u'<SQLiteMirror path={} table={}>'.format(self.path, self.table)
+
+    @property
+    def high_water(self):
+        u"""Returns the latest modification timestamp seen as datetime, or None before the first
+        sync."""
+        row = self.connection.execute(
+            u'SELECT high_water FROM {} WHERE tbl = ?'.format(_quote(_SYNC_TABLE)), (self.table,)
+        ).fetchone()
+        if row is None or row[0] is None:
+            return None
+        return datetime.datetime.strptime(row[0], u'%Y-%m-%dT%H:%M:%S')
+
+    def sync(self, full = False,
+             detect_deletions = True):
+        u"""Brings the local table up to date and returns a SyncResult.
+
+        Parameters
+        ----------
+        full : bool, optional
+            If True, all records are pulled even if the table was synced before. Defaults to
+            False, i.e. a full pull only on the first sync.
+        detect_deletions : bool, optional
+            If True, the record ids of the layout are requested to remove deleted records from the
+            table. A full pull always removes them. Defaults to True.
+        """
+        with self._lock:
+            high_water = self.high_water
+            full = full or high_water is None
+
+            if full:
+                records = self.server.iter_records(page_size=self.page_size)
+            else:
+                query = [{self.modification_field: u'>=' + high_water.strftime(
+                    _QUERY_FORMATS[self.server.date_order])}]
+                records = self.server.iter_find(query, page_size=self.page_size)
+
+            with self.connection:
+                inserted, updated, unchanged, seen, high_water = self._write(records, high_water)
+
+                if full:
+                    deleted = self._delete_missing(seen)
+                elif detect_deletions:
+                    remote_ids = set(
+                        record.record_id for record in self.server.iter_records(
+                            page_size=self.page_size * 10, layout=self.id_layout
+                        )
+                    )
+                    deleted = self._delete_missing(remote_ids)
+                else:
+                    deleted = 0
+
+                self.connection.execute(
+                    u'INSERT OR REPLACE INTO {} (tbl, high_water, synced_at) VALUES (?, ?, ?)'
+                    .format(_quote(_SYNC_TABLE)),
+                    (self.table, high_water.isoformat() if high_water else None, time.time())
+                )
+
+        return SyncResult(inserted, updated, unchanged, deleted, full)
+
+    def execute(self, sql, parameters = ()):
+        u"""Runs sql against the local database and returns the cursor."""
+        with self._lock:
+            return self.connection.execute(sql, parameters)
+
+    def close(self):
+        u"""Closes the local database."""
+        self.connection.close()
+
+    def _write(self, records, high_water):
+        u"""Inserts or updates the given records. Returns the numbers of inserted, updated and
+        unchanged rows, the set of written record ids and the new high water mark."""
+        inserted = updated = unchanged = 0
+        seen = set()
+        select = u'SELECT modId FROM {} WHERE recordId = ?'.format(_quote(self.table))
+
+        for record in records:
+            record_id = record.record_id
+            seen.add(record_id)
+
+            modified = self._timestamp(record)
+            if modified is not None and (high_water is None or modified > high_water):
+                high_water = modified
+
+            row = self.connection.execute(select, (record_id,)).fetchone()
+            if row is not None and row[0] == record.modification_id:
+                unchanged += 1
+                continue
+
+            keys = [key for key in record.keys() if not key.startswith(PORTAL_PREFIX)]
+            self._add_columns(keys)
+            self.connection.execute(
+                u'INSERT OR REPLACE INTO {} ({}) VALUES ({})'.format(
+                    _quote(self.table),
+                    u', '.join(_quote(key) for key in keys),
+                    u', '.join(u'?' for _ in keys)
+                ),
+                [record_id if key == u'recordId' else
+                 record.modification_id if key == u'modId' else
+                 _sql_value(record[key]) for key in keys]
+            )
+            if row is None:
+                inserted += 1
+            else:
+                updated += 1
+
+        return inserted, updated, unchanged, seen, high_water
+
+    def _timestamp(self, record):
+        u"""Returns the modification timestamp of record as datetime, or None if it is empty or
+        not a timestamp (such records are still written, but don't move the high water mark)."""
+        value = record[self.modification_field]
+        if isinstance(value, datetime.datetime):
+            return value.replace(microsecond=0)
+        if not value:
+            return None
+        try:
+            return parse_datetime(value, self.server.date_order).replace(microsecond=0)
+        except (ValueError, TypeError):
+            return None
+
+    def _add_columns(self, keys):
+        u"""Adds columns for keys the table doesn't have yet."""
+        if self._columns is None:
+            self._columns = set(
+                row[1] for row in self.connection.execute(
+                    u'PRAGMA table_info({})'.format(_quote(self.table))
+                )
+            )
+
+        for key in keys:
+            if key not in self._columns:
+                self.connection.execute(
+                    u'ALTER TABLE {} ADD COLUMN {}'.format(_quote(self.table), _quote(key))
+                )
+                self._columns.add(key)
+
+    def _delete_missing(self, record_ids):
+        u"""Deletes all rows whose recordId is not in record_ids. Returns the number of deleted
+        rows."""
+        missing = [
+            (row[0],) for row in
+            self.connection.execute(u'SELECT recordId FROM {}'.format(_quote(self.table)))
+            if row[0] not in record_ids
+        ]
+        self.connection.executemany(
+            u'DELETE FROM {} WHERE recordId = ?'.format(_quote(self.table)), missing
+        )
+        return len(missing)
@@ -5,21 +5,57 @@ from .utils import convert_string_type
 from .const import PORTAL_PREFIX
 from itertools import izip
 
+class RecordSchema(tuple):
+    u"""Immutable, ordered tuple of field names with constant time position lookups.
+
+    Records built from the same response share one schema instead of each holding its own list
+    of keys. index() and the in operator use a name-to-position dict instead of scanning the keys.
+    """
+
+    def __new__(cls, keys):
+        schema = super(RecordSchema, cls).__new__(cls, keys)
+        schema._positions = dict((key, index) for index, key in enumerate(schema))
+        return schema
+
+    def __contains__(self, key):
+        return key in self._positions
+
+    def index(self, key):
+        u"""Returns the position of key. Raises ValueError if there is no such key (like
+        list.index)."""
+        try:
+            return self._positions[key]
+        except (KeyError, TypeError):
+            raise ValueError(u'{!r} is not in schema'.format(key))
+
+    def values_from(self, mapping):
+        u"""Returns the values of mapping in schema order if mapping has exactly the keys of this
+        schema, otherwise None."""
+        if len(mapping) != len(self):
+            return None
+        try:
+            return [mapping[key] for key in self]
+        except KeyError:
+            return None
+
 class Record(object):
     u"""A FileMaker record representation.
 
     (with ideas from: https://github.com/kennethreitz/records)
     """
     __slots__ = (u'_keys', u'_values', u'_in_portal', u'_modifications')
+    _attributes = frozenset(__slots__) # names set as attributes instead of fields
 
     def __init__(self, keys, values,
-                 in_portal = False, type_conversion = False):
+                 in_portal = False, type_conversion = False,
+                 date_order = u'MDY'):
         u"""Initialize the Record class.
 
         Parameters
         ----------
-        keys : list
-            List of keys (fields) for this Record as returned by FileMaker Server
+        keys : list or RecordSchema
+            List of keys (fields) for this Record as returned by FileMaker Server. Pass a
+            RecordSchema to share the keys between records with the same fields.
         values : list
             Values corresponding to keys
         in_portal : bool
@@ -31,20 +67,24 @@ class Record(object):
             FileMaker Data API always returns strings and there is no way of knowing the correct
             type of a requested field value. Be cautious with this parameter!
             Values will be converted into int, float, datetime, timedelta, string.
+        date_order : str, optional
+            Order of month, day and year in dates for type_conversion, see
+            fmrest.utils.parse_datetime(). Defaults to 'MDY'.
         """
 
-        self._keys = keys
+        self._keys = keys if isinstance(keys, RecordSchema) else RecordSchema(keys)
 
         if type_conversion:
             self._values = []
             for value in values:
-                parsed = convert_string_type(value) if isinstance(value, unicode) else value
+                parsed = (convert_string_type(value, date_order) if isinstance(value, unicode)
+                          else value)
                 self._values.append(parsed)
         else:
             self._values = values
 
         self._in_portal = in_portal
-        self._modifications = {}
+        self._modifications = None # allocated on first change
 
         if len(self._keys) != len(self._values):
             raise ValueError(u"Length of keys does not match length of values.")
@@ -58,11 +98,8 @@ class Record(object):
 
     def __getitem__(self, key):
         u"""Returns value for given key. For dict lookups, like my_id = record['id']."""
-        keys = self.keys()
-
         try:
-            index = keys.index(key)
-            return self.values()[index]
+            return self._values[self._keys.index(key)]
         except ValueError:
             raise KeyError((u"No field named {}. Note that the Data API only returns fields "
                             u"placed on your FileMaker layout.").format(key))
@@ -83,10 +120,10 @@ class Record(object):
         Modified keys land in _modifications and are later used to write values back to
         FileMaker.
         """
-        if key not in self.__slots__:
+        if key not in self._attributes:
             # objects in __slots__ are the only allowed attributes.
             # all others are handled here
-            if key not in self.keys():
+            if not self._has_field(key):
                 raise KeyError(unicode(key) + u" is not a valid field name.")
             elif key.startswith(PORTAL_PREFIX):
                 raise KeyError(
@@ -95,11 +132,12 @@ class Record(object):
                 )
             elif value != self[key]:
                 # store modified key and value for later re-use
+                if self._modifications is None:
+                    self._modifications = {}
                 self._modifications[key] = value
 
-                # also update the value in _values, so that values() returns expected data
-                index = self.keys().index(key)
-                self._values[index] = value
+                # also update the stored value, so that values() returns expected data
+                self._store(key, value)
         else:
             # allow setting of attributes in __slots__
             super(Record, self).__setattr__(key, value)
@@ -113,17 +151,30 @@ class Record(object):
         except KeyError, ex:
             raise AttributeError(ex)
 
+    def __getstate__(self):
+        u"""Returns the state for pickling. Needed as __getattr__ treats unset slots as fields."""
+        return (tuple(self._keys), self._values, self._in_portal, self._modifications)
+
+    def __setstate__(self, state):
+        keys, values, in_portal, modifications = state
+        object.__setattr__(self, u'_keys', RecordSchema(keys))
+        object.__setattr__(self, u'_values', values)
+        object.__setattr__(self, u'_in_portal', in_portal)
+        object.__setattr__(self, u'_modifications', modifications)
+
     def modifications(self):
         u"""Returns a dict of changed keys in the form of {key : new_value}.
 
         Used for writing back record changes via Server.edit(record).
         """
+        if self._modifications is None:
+            self._modifications = {}
         return self._modifications
 
     @property
     def is_dirty(self):
         u"""Returns True if key values have been modified."""
-        return len(self._modifications) > 0
+        return bool(self._modifications)
 
     @property
     def record_id(self):
@@ -145,7 +196,7 @@ class Record(object):
 
     def keys(self):
         u"""Returns all keys of this record."""
-        return self._keys
+        return list(self._keys)
 
     def values(self):
         u"""Returns all values of this record."""
@@ -153,7 +204,7 @@ class Record(object):
 
     def to_dict(self, ignore_portals = False, ignore_internal_ids = False):
         u"""Returns record values as dictionary of key: val."""
-        zipped = izip(self.keys(), self.values())
+        zipped = izip(self._keys, self._values)
 
         if ignore_portals:
             out = dict((k, v) for k, v in zipped if not k.startswith(PORTAL_PREFIX))
@@ -167,13 +218,169 @@ class Record(object):
 
     def pop(self, key, default = None):
         u"""Pops the record's key. Returns key's value or default."""
-        keys = self.keys()
-
         try:
             value = self[key]
-            index = keys.index(key)
-            self._keys.pop(index)
+            index = self._keys.index(key)
+            # the schema may be shared with other records, so this record gets its own
+            self._keys = RecordSchema(k for i, k in enumerate(self._keys) if i != index)
             self._values.pop(index)
             return value
         except (KeyError, ValueError):
             return default
+
+    def _has_field(self, key):
+        u"""Returns True if key is a field (or portal) of this record."""
+        return key in self._keys
+
+    def _store(self, key, value):
+        u"""Replaces the value of an existing key."""
+        self._values[self._keys.index(key)] = value
+
+def _restore_record(state):
+    u"""Returns a Record with the given pickled state."""
+    record = Record.__new__(Record)
+    record.__setstate__(state)
+    return record
+
+_REMOVED = object() # marks keys popped from a LazyRecord
+
+class LazyRecord(Record):
+    u"""A Record reading its values from the record dict of a Data API response on access.
+
+    Nothing is copied on creation. Values are converted when a field is read for the first time
+    (if type_conversion is enabled) and kept for later reads, so that reading a few fields of
+    records with many fields only pays for those few. Portal foundsets are built on first access.
+
+    Used by Server instances with lazy_records=True. Apart from being lazy, LazyRecord behaves
+    like Record.
+    """
+    __slots__ = (u'_data', u'_portal_factory', u'_type_conversion', u'_date_order', u'_cache')
+    _attributes = Record._attributes.union(__slots__)
+
+    def __init__(self, data, portal_factory = None,
+                 in_portal = False, type_conversion = False,
+                 date_order = u'MDY'):
+        u"""Initialize the LazyRecord class.
+
+        Parameters
+        ----------
+        data : dict
+            Record as returned by FileMaker Server, i.e. a dict with fieldData, portalData,
+            recordId and modId keys, or a row of portalData if in_portal is True. The dict is not
+            modified.
+        portal_factory : callable, optional
+            Called with data and a portal name on first access of a portal. Should return the
+            Foundset for the portal.
+        in_portal : bool
+            If true, this record instance describes a related record from a portal.
+        type_conversion : bool, optional
+            If True, attempt to convert string values into their potential original types on
+            access. See Record.
+        date_order : str, optional
+            Order of month, day and year in dates for type_conversion. See Record.
+        """
+        self._data = data
+        self._portal_factory = portal_factory
+        self._in_portal = in_portal
+        self._type_conversion = type_conversion
+        self._date_order = date_order
+        self._modifications = None
+        self._cache = None # converted and modified values, allocated on first use
+
+    def __getitem__(self, key):
+        u"""Returns value for given key. For dict lookups, like my_id = record['id']."""
+        cache = self._cache
+        if cache is not None and key in cache:
+            value = cache[key]
+            if value is not _REMOVED:
+                return value
+        else:
+            value = self._load(key)
+            if value is not _REMOVED:
+                return value
+
+        raise KeyError((u"No field named {}. Note that the Data API only returns fields "
+                        u"placed on your FileMaker layout.").format(key))
+
+    def __reduce__(self):
+        u"""Pickles the LazyRecord as Record with all values (and changes), as its portal factory
+        usually can't be pickled."""
+        keys = self.keys()
+        state = (tuple(keys), [self[key] for key in keys], self._in_portal, self._modifications)
+        return (_restore_record, (state,))
+
+    def _load(self, key):
+        u"""Reads (and if needed converts and caches) the raw value of key. Returns _REMOVED if
+        there is no such key."""
+        data = self._data
+
+        if self._in_portal:
+            value = data.get(key, _REMOVED)
+        elif key == u'recordId' or key == u'modId':
+            value = data.get(key)
+        elif key in data[u'fieldData']:
+            value = data[u'fieldData'][key]
+        elif isinstance(key, basestring) and key.startswith(PORTAL_PREFIX) and \
+                key[len(PORTAL_PREFIX):] in data[u'portalData']:
+            value = self._portal_factory(data, key[len(PORTAL_PREFIX):])
+            self._store(key, value)
+            return value
+        else:
+            return _REMOVED
+
+        if self._type_conversion and isinstance(value, unicode):
+            value = convert_string_type(value, self._date_order)
+            self._store(key, value)
+        return value
+
+    def keys(self):
+        u"""Returns all keys of this record."""
+        if self._in_portal:
+            keys = list(self._data)
+        else:
+            keys = [key for key in self._data[u'fieldData']
+                    if key != u'recordId' and key != u'modId']
+            keys.extend((u'recordId', u'modId'))
+            keys.extend(PORTAL_PREFIX + name for name in self._data[u'portalData'])
+
+        if self._cache is not None:
+            keys = [key for key in keys if self._cache.get(key) is not _REMOVED]
+        return keys
+
+    def values(self):
+        u"""Returns all values of this record."""
+        return [self[key] for key in self.keys()]
+
+    def to_dict(self, ignore_portals = False, ignore_internal_ids = False):
+        u"""Returns record values as dictionary of key: val."""
+        keys = self.keys()
+
+        if ignore_portals:
+            keys = [key for key in keys if not key.startswith(PORTAL_PREFIX)]
+        if ignore_internal_ids:
+            keys = [key for key in keys if key != u'recordId' and key != u'modId']
+        return dict((key, self[key]) for key in keys)
+
+    def pop(self, key, default = None):
+        u"""Pops the record's key. Returns key's value or default."""
+        try:
+            value = self[key]
+        except KeyError:
+            return default
+
+        self._store(key, _REMOVED)
+        return value
+
+    def _has_field(self, key):
+        u"""Returns True if key is a field (or portal) of this record."""
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
+
+    def _store(self, key, value):
+        u"""Replaces the value of an existing key."""
+        if self._cache is None:
+            self._cache = {}
+        self._cache[key] = value
@@ -0,0 +1,228 @@
+u"""RecordCache class for keeping records and revalidating them by modId"""
+from __future__ import absolute_import
+import threading
+
+from .const import FMSErrorCode
+from .exceptions import FileMakerError
+
+class RecordCache(object):
+    u"""A cache of Record instances by record id that refetches records only if they changed.
+
+    FileMaker increments the modId of a record with every change. Instead of requesting all fields
+    of cached records again, the cache requests their current modIds (via a slim layout only
+    holding few fields) and refetches the full records only where the modId moved:
+
+        cache = fmrest.RecordCache(fms, validation_layout='Contacts_slim', id_field='record_id')
+        contacts = cache.get_many([1, 2, 3]) # fetched
+        contacts = cache.get_many([1, 2, 3]) # one find on the slim layout, refetches changes only
+
+    With id_field (a field on the server's layout holding the record id, e.g. a calculation of
+    Get(RecordID)), the modIds of up to batch_size records are requested with a single find.
+    Without it, one get_record() per record is made, which is still cheaper than fetching all
+    fields when the validation layout is slim.
+
+    Requests bypass the server's response_cache (if any), as it could answer with outdated modIds.
+    Records removed in FileMaker are dropped from the cache. Note that the cached Record
+    instances are handed out as they are, i.e. changes made to them are visible to other callers.
+    """
+
+    def __init__(self, server, validation_layout = None,
+                 id_field = None, batch_size = 100,
+                 portals = None):
+        u"""Initialize the RecordCache class.
+
+        Parameters
+        ----------
+        server : Server
+            Logged-in Server instance to request records through. Records are fetched from its
+            current layout.
+        validation_layout : str, optional
+            Response layout used for requesting modIds, ideally with only one small field on it.
+            Defaults to None (the server's layout).
+        id_field : str, optional
+            Name of a field on the server's layout that holds the record id. Enables requesting
+            modIds (and changed records) in bulk via find(). Defaults to None.
+        batch_size : int, optional
+            Maximum number of records requested by one find. Defaults to 100.
+        portals : list of dicts, optional
+            Portals to include when fetching full records, see Server.get_record().
+        """
+        if batch_size < 1:
+            raise ValueError(u'batch_size must be greater than 0.')
+
+        self.server = server
+        self.validation_layout = validation_layout
+        self.id_field = id_field
+        self.batch_size = batch_size
+        self.portals = portals
+
+        self._records = {} # record id -> Record
+        self._lock = threading.Lock()
+        self._stats = {u'hits': 0, u'misses': 0, u'refetches': 0, u'removals': 0}
+
+    def __len__(self):
+        return len(self._records)
+
+    def __contains__(self, record_id):
+        return int(record_id) in self._records
+
+    def __repr__(self):
+        return u'<RecordCache records={}>'.format(len(self._records))
+
+    def get(self, record_id, revalidate = True):
+        u"""Returns the Record for record_id, fetching it if it is not cached (or changed).
+
+        Raises FileMakerError (with error code 101) if the record does not exist (anymore).
+
+        Parameters
+        ----------
+        record_id : int
+            FileMaker record id
+        revalidate : bool, optional
+            If False, a cached record is returned without checking its modId. Defaults to True.
+        """
+        records = self.get_many([record_id], revalidate)
+        if not records:
+            raise FileMakerError(FMSErrorCode.RECORD_MISSING.value, u'Record is missing')
+        return records[0]
+
+    def get_many(self, record_ids, revalidate = True):
+        u"""Returns a list of the Records for record_ids (in the same order). Cached records are
+        revalidated in bulk and only fetched again if they changed. Records that don't exist
+        are left out.
+
+        Parameters
+        ----------
+        record_ids : list of int
+            FileMaker record ids
+        revalidate : bool, optional
+            If False, cached records are returned without checking their modIds.
+        """
+        record_ids = [int(record_id) for record_id in record_ids]
+        cached = [record_id for record_id in record_ids if record_id in self._records]
+        missing = [record_id for record_id in record_ids if record_id not in self._records]
+
+        if revalidate and cached:
+            changed = self.revalidate(cached)[0]
+            self._count(u'hits', len(cached) - len(changed))
+        else:
+            self._count(u'hits', len(cached))
+
+        if missing:
+            self._count(u'misses', len(missing))
+            self._fetch(missing)
+
+        return [self._records[record_id] for record_id in record_ids
+                if record_id in self._records]
+
+    def revalidate(self, record_ids = None):
+        u"""Compares the modIds of cached records with the ones in FileMaker, refetches changed
+        records and drops deleted ones. Returns a tuple of the lists of changed and deleted ids.
+
+        Parameters
+        ----------
+        record_ids : list of int, optional
+            Ids of cached records to revalidate. Defaults to None (all cached records).
+        """
+        if record_ids is None:
+            record_ids = list(self._records)
+        record_ids = [int(record_id) for record_id in record_ids if int(record_id) in self._records]
+
+        current = self._mod_ids(record_ids)
+        changed = [record_id for record_id in record_ids if record_id in current and
+                   current[record_id] != self._records[record_id].modification_id]
+        deleted = [record_id for record_id in record_ids if record_id not in current]
+
+        with self._lock:
+            for record_id in deleted:
+                self._records.pop(record_id, None)
+        self._count(u'removals', len(deleted))
+
+        if changed:
+            self._count(u'refetches', len(changed))
+            self._fetch(changed)
+
+        return changed, deleted
+
+    def put(self, record):
+        u"""Adds (or replaces) a Record obtained elsewhere, e.g. from a find."""
+        with self._lock:
+            self._records[record.record_id] = record
+
+    def invalidate(self, record_id = None):
+        u"""Removes record_id from the cache, or all records if record_id is None."""
+        with self._lock:
+            if record_id is None:
+                self._records.clear()
+            else:
+                self._records.pop(int(record_id), None)
+
+    def stats(self):
+        u"""Returns a dict with the number of hits (cached and unchanged), misses (not cached),
+        refetches (cached, but changed) and removals (deleted in FileMaker) so far."""
+        with self._lock:
+            stats = dict(self._stats)
+        stats[u'records'] = len(self._records)
+        return stats
+
+    def _count(self, stat, number):
+        u"""Adds number to the given stat."""
+        with self._lock:
+            self._stats[stat] += number
+
+    def _mod_ids(self, record_ids):
+        u"""Returns a dict of record id to current modId for the given ids that still exist."""
+        mod_ids = {}
+        if self.id_field is not None:
+            for record in self._find(record_ids, self.validation_layout):
+                mod_ids[record.record_id] = record.modification_id
+            return mod_ids
+
+        for record_id in record_ids:
+            try:
+                record = self.server.get_record(record_id, layout=self.validation_layout,
+                                                use_cache=False)
+            except FileMakerError, ex:
+                if ex.error_code == FMSErrorCode.RECORD_MISSING.value:
+                    continue
+                raise
+            mod_ids[record_id] = record.modification_id
+        return mod_ids
+
+    def _fetch(self, record_ids):
+        u"""Requests the full records for the given ids and stores them."""
+        if self.id_field is not None:
+            records = self._find(record_ids, None, self.portals)
+        else:
+            records = []
+            for record_id in record_ids:
+                try:
+                    records.append(self.server.get_record(record_id, portals=self.portals,
+                                                          use_cache=False))
+                except FileMakerError, ex:
+                    if ex.error_code != FMSErrorCode.RECORD_MISSING.value:
+                        raise
+
+        fetched = set()
+        with self._lock:
+            for record in records:
+                self._records[record.record_id] = record
+                fetched.add(record.record_id)
+            for record_id in record_ids:
+                if record_id not in fetched:
+                    self._records.pop(record_id, None)
+
+    def _find(self, record_ids, layout, portals = None):
+        u"""Generator of the Records with the given ids, found via id_field in batches."""
+        for start in xrange(0, len(record_ids), self.batch_size):
+            batch = record_ids[start:start + self.batch_size]
+            query = [{self.id_field: u'=={}'.format(record_id)} for record_id in batch]
+            try:
+                foundset = self.server.find(query, limit=len(batch), portals=portals,
+                                            layout=layout, use_cache=False)
+            except FileMakerError, ex:
+                if ex.error_code == FMSErrorCode.NO_RECORDS_MATCH.value:
+                    continue
+                raise
+            for record in foundset:
+                yield record
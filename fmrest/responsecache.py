@@ -0,0 +1,160 @@
+u"""ResponseCache class for answering repeated reads without a request"""
+from __future__ import absolute_import
+import collections
+import json
+import threading
+import time
+
+class ResponseCache(object):
+    u"""An in-memory cache of Data API read responses with TTL and LRU eviction.
+
+    Pass an instance to Server(response_cache=...) to answer repeated get_record(), get_records()
+    and find() calls with identical parameters from memory:
+
+        cache = fmrest.ResponseCache(ttl=30, max_bytes=16 * 1024 * 1024)
+        fms = fmrest.Server(..., response_cache=cache)
+        fms.find([{'name': 'David'}]) # requested from FMS
+        fms.find([{'name': 'David'}]) # answered from the cache
+        cache.stats()
+
+    Entries are keyed by server, database, user, layout, record id and the normalized request
+    parameters (query, sort, offset, limit, portals, scripts, response layout). The least
+    recently used entries are evicted when max_entries or max_bytes (measured as size of the JSON
+    response) is exceeded.
+
+    Writes made through a Server using the cache (including its SessionPool sessions) invalidate
+    all cached get_records()/find() results of the database and the cached get_record() results of
+    the written record. Changes made by other clients become visible after ttl seconds.
+    Streamed requests are not cached.
+    """
+
+    def __init__(self, ttl = 60, max_entries = 1024,
+                 max_bytes = 32 * 1024 * 1024):
+        u"""Initialize the ResponseCache class.
+
+        Parameters
+        ----------
+        ttl : int or float, optional
+            Seconds a response is served from the cache. Defaults to 60.
+        max_entries : int, optional
+            Maximum number of cached responses. Defaults to 1024.
+        max_bytes : int, optional
+            Maximum total size of cached responses in bytes. Responses larger than this are not
+            cached. Defaults to 32 MB.
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+        self._entries = collections.OrderedDict() # key -> (expires at, size, response), LRU first
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {u'hits': 0, u'misses': 0, u'evictions': 0, u'expirations': 0,
+                       u'invalidations': 0}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __repr__(self):
+        return u'<ResponseCache entries={} bytes={}>'.format(len(self._entries), self._bytes)
+
+    @staticmethod
+    def make_key(url, database,
+                 user, path,
+                 params = None, data = None,
+                 record_id = None):
+        u"""Returns the key a response is cached by. params and data are normalized, so that the
+        order of keys and parameters set to None do not matter."""
+        def normalize(mapping):
+            if not mapping:
+                return None
+            return dict((key, value) for key, value in mapping.iteritems() if value is not None)
+
+        request = json.dumps([normalize(params), normalize(data)], sort_keys=True)
+        return (url, database, user, None if record_id is None else unicode(record_id),
+                path, request)
+
+    def get(self, key):
+        u"""Returns the response cached for key, or None if there is none or it expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= time.time():
+                self._remove(key)
+                self._stats[u'expirations'] += 1
+                entry = None
+
+            if entry is None:
+                self._stats[u'misses'] += 1
+                return None
+
+            # move to the end, i.e. mark as most recently used
+            del self._entries[key]
+            self._entries[key] = entry
+            self._stats[u'hits'] += 1
+            return entry[2]
+
+    def set(self, key, response, size):
+        u"""Caches response for key.
+
+        Parameters
+        ----------
+        key : tuple
+            Key as returned by make_key()
+        response : dict
+            Parsed response. It is handed out to every caller hitting the entry and must not be
+            modified.
+        size : int
+            Size of the response in bytes, used for the max_bytes budget
+        """
+        if size > self.max_bytes or self.max_entries < 1:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+            self._entries[key] = (time.time() + self.ttl, size, response)
+            self._bytes += size
+
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self._stats[u'evictions'] += 1
+
+    def invalidate(self, url, database,
+                   record_id = None, all_records = False):
+        u"""Removes the entries a write to a record of database may have changed: all cached
+        get_records()/find() results and the get_record() results of record_id (if given) or of
+        all records (if all_records is True). Returns the number of removed entries."""
+        record_id = None if record_id is None else unicode(record_id)
+        with self._lock:
+            keys = [key for key in self._entries
+                    if key[0] == url and key[1] == database and
+                    (all_records or key[3] is None or key[3] == record_id)]
+            for key in keys:
+                self._remove(key)
+            self._stats[u'invalidations'] += len(keys)
+        return len(keys)
+
+    def clear(self):
+        u"""Removes all entries."""
+        with self._lock:
+            self._stats[u'invalidations'] += len(self._entries)
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        u"""Returns a dict with the number of hits, misses, evictions (due to max_entries or
+        max_bytes), expirations and invalidations so far, as well as the current number of
+        entries and bytes and the hit rate."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats[u'entries'] = len(self._entries)
+            stats[u'bytes'] = self._bytes
+
+        requests = stats[u'hits'] + stats[u'misses']
+        stats[u'hit_rate'] = float(stats[u'hits']) / requests if requests else 0.0
+        return stats
+
+    def _remove(self, key):
+        u"""Removes the entry for key. Must be called with the lock held."""
+        self._bytes -= self._entries.pop(key)[1]
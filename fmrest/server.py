@@ -1,15 +1,25 @@
 u"""Server class for API connections"""
 from __future__ import absolute_import
-import json
+import collections
+import copy
+import threading
+import time
 import warnings
 
 from functools import wraps
+from itertools import izip
 import requests
-from .utils import request, build_portal_params, build_script_params, filename_from_url
+from .utils import (request, build_session, build_portal_params, build_script_params,
+                    filename_from_url, prefetch_generator, concurrent_map,
+                    parse_streamed_response, get_json_codec, STDLIB_JSON, import_pandas)
 from .const import API_PATH, PORTAL_PREFIX, FMSErrorCode
-from .exceptions import BadJSON, FileMakerError, RecordError
-from .record import Record
-from .foundset import Foundset
+from .exceptions import (FMRestException, BadJSON, FileMakerError, RecordError,
+                         RequestException)
+from .record import Record, RecordSchema, LazyRecord
+from .conversion import TypeInference, MetadataConversion
+from .foundset import Foundset, ColumnarFoundset, append_columns, columns_to_df
+from .sessionpool import SessionPool
+from .bulk import WriteResult, UnitOfWork, BulkProgress
 
 class Server(object):
     u"""The server class provides easy access to the FileMaker Data API
@@ -32,6 +42,10 @@ class Server(object):
         with fms as my_server:
             my_server.login()
             # do stuff
+
+    A logged-in instance can be shared by multiple threads. Headers are built per request and
+    last_error/last_script_result are tracked per thread. Avoid changing attributes like layout
+    while other threads are using the instance.
     """
 
     def __init__(self, url, user,
@@ -40,7 +54,20 @@ class Server(object):
                  verify_ssl = True,
                  type_conversion = False,
                  auto_relogin = False,
-                 proxies = None):
+                 proxies = None,
+                 pool_connections = 10,
+                 pool_maxsize = 10,
+                 keep_alive = True,
+                 session = None,
+                 token_store = None,
+                 session_timeout = 15 * 60,
+                 json_codec = None,
+                 lazy_records = False,
+                 date_order = u'MDY',
+                 use_layout_metadata = False,
+                 layout_metadata_ttl = 5 * 60,
+                 response_cache = None,
+                 foundset_cache = u'all'):
         u"""Initialize the Server class.
 
         Parameters
@@ -73,8 +100,10 @@ class Server(object):
 
             Be cautious with this parameter, as results may be different from what you expect!
 
-            Values will be converted into int, float, datetime, timedelta, string. This happens
-            on a record level, not on a foundset level.
+            Values will be converted into int, float, datetime, timedelta, string. The type of
+            each field is decided once per foundset (see fmrest.conversion.TypeInference), values
+            not matching it are converted individually, so the result is the same as converting
+            each value on its own.
         auto_relogin : bool, optional
             If True, tries to automatically get a new token (re-login) when a
             request comes back with a 952 (invalid token) error. Defaults to
@@ -82,6 +111,56 @@ class Server(object):
         proxies : dict, optional
             Pass requests through a proxy, configure like so:
             { 'https': 'http://127.0.0.1:8080' }
+        pool_connections : int, optional
+            Number of hosts the connection pool keeps connections for. Default 10.
+        pool_maxsize : int, optional
+            Maximum number of connections kept open per host. Raise this if you share the
+            Server (or its session) between many threads. Default 10.
+        keep_alive : bool, optional
+            If True (default), connections and their TLS sessions are kept open and re-used
+            for subsequent calls. Set to False to close the connection after every request.
+        session : requests.Session, optional
+            Session (connection pool) to send all requests through. Pass the session of
+            another Server instance to share one pool between multiple Server instances.
+            If None, a new session is built from pool_connections, pool_maxsize and keep_alive.
+        token_store : FileTokenStore, optional
+            Store to share tokens between processes. login() then re-uses a stored token that is
+            likely still valid instead of requesting a new one, and leaving a with statement keeps
+            the token in the store instead of logging out. A stored token that turns out to be
+            invalid is replaced by a new login, even if auto_relogin is False.
+        session_timeout : int or float, optional
+            Idle time in seconds after which FMS invalidates a session (15 minutes by default on
+            FMS). With auto_relogin, a token that was idle for longer than that is replaced before
+            the next request is sent, instead of waiting for the request to fail with error 952.
+        json_codec : JSONCodec, optional
+            Codec used to encode request data (incl. find queries and sort params) and decode
+            responses. Defaults to the module-wide codec of fmrest.utils.get_json_codec(),
+            which uses orjson or ujson when installed and falls back to json.
+        lazy_records : bool, optional
+            If True, records are returned as LazyRecord instances that read their values from the
+            response on access instead of copying (and converting) all values upfront. Speeds up
+            reading a few fields of records with many fields. Defaults to False.
+        date_order : str, optional
+            Order of month, day and year in dates for type_conversion: 'MDY' (default, as returned
+            by the Data API), 'DMY' or 'YMD'. Set it if your files return dates in the file's
+            locale (or as ISO 8601) instead.
+        use_layout_metadata : bool, optional
+            If True (and type_conversion is True), values are converted according to the field
+            result types declared in the layout metadata instead of being guessed, so that e.g.
+            zip codes in text fields stay strings. See get_layout_metadata() and
+            fmrest.conversion.MetadataConversion. Not used for lazy_records. Defaults to False.
+        layout_metadata_ttl : int or float, optional
+            Seconds the metadata of a layout is cached by get_layout_metadata(). Defaults to 5
+            minutes.
+        response_cache : ResponseCache, optional
+            Cache answering repeated get_record(), get_records() and find() calls with the same
+            parameters without a request. Writes made through this instance invalidate the
+            affected entries. Can be shared by multiple Server instances. Defaults to None (no
+            caching).
+        foundset_cache : str or callable, optional
+            Cache policy of the returned Foundsets (including portals): 'all' (default) keeps
+            every consumed record, 'none', fmrest.foundset.window(n) or fmrest.foundset.spill()
+            bound the memory of large foundsets. See Foundset.
         """
 
         self.url = url
@@ -93,43 +172,117 @@ class Server(object):
         self.verify_ssl = verify_ssl
         self.auto_relogin = auto_relogin
         self.proxies = proxies
+        self.token_store = token_store
+        self.session_timeout = session_timeout
+        self.json_codec = json_codec
 
         self.type_conversion = type_conversion
+        self.lazy_records = lazy_records
+        self.date_order = date_order
+        self.use_layout_metadata = use_layout_metadata
+        self.layout_metadata_ttl = layout_metadata_ttl
+        self.response_cache = response_cache
+        self.foundset_cache = foundset_cache
 
         if url[:5] != u'https':
             raise ValueError(u'Please make sure to use https, otherwise calls to the Data '
                              u'API will not work.')
 
+        if session is None:
+            session = build_session(pool_connections, pool_maxsize, keep_alive)
+        self._session = session
+
         self._token = None
-        self._last_fm_error = None
-        self._last_script_result = None
-        self._headers = {}
-        self._set_content_type()
+        self._token_from_store = False
+        self._token_issued_at = None
+        self._token_last_used = None
+        self._heartbeat = None
+        self._heartbeat_stop = threading.Event()
+        self._login_lock = threading.Lock()
+        self._relogin_stats = {u'logins': 0, u'login_time': 0.0, u'waits': 0, u'wait_time': 0.0}
+
+        # layout -> (time of request, metadata), shared with clones as the layouts are the same
+        self._layout_metadata = {}
+
+        # error and script result of the last call are kept per thread, so that one instance
+        # can be shared by multiple threads
+        self._local = threading.local()
 
     def __enter__(self):
         return self
 
     def __exit__(self, exc_type, exc_val, exc_traceback):
-        self.logout()
+        if self.token_store is not None and self._token:
+            # keep the session alive for the next process instead of logging out
+            self.token_store.set(self._token_store_key(), self._token, self._token_last_used)
+        else:
+            self.logout()
 
     def __repr__(self):
         return u'<Server logged_in={} database={} layout={}>'.format(
             bool(self._token), self.database, self.layout
         )
 
+    @property
+    def session(self):
+        u"""Returns the requests.Session holding the connection pool of this instance."""
+        return self._session
+
+    def warm_up(self, connections = 1):
+        u"""Opens connections to the server upfront and returns the number of opened connections.
+
+        Use this at startup, so that the first Data API calls don't have to pay for the TCP and
+        TLS handshake. Connections are opened in parallel and kept in the pool afterwards.
+
+        Parameters
+        -----------
+        connections : int, optional
+            Number of connections to open. Should not exceed pool_maxsize. Default 1.
+        """
+        opened = []
+
+        def _open():
+            try:
+                request(method=u'HEAD',
+                        url=self.url,
+                        verify=self.verify_ssl,
+                        proxies=self.proxies,
+                        session=self._session)
+            except RequestException:
+                return
+            opened.append(True)
+
+        threads = [threading.Thread(target=_open) for _ in xrange(connections)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        return len(opened)
+
+    def close(self):
+        u"""Closes all pooled connections of this instance. Does not log out."""
+        self._session.close()
+
     def _with_auto_relogin(f):
         @wraps(f)
         def wrapper(self, *args, **kwargs):
-            if not self.auto_relogin:
+            if not self.auto_relogin and not self._token_from_store:
                 return f(self, *args, **kwargs)
 
+            token = self._token
+            if token and self._token_expired():
+                # token has most likely timed out on the server; don't waste a request on it
+                self._relogin(token)
+
+            token = self._token
             try:
                 return f(self, *args, **kwargs)
             except FileMakerError:
                 if self.last_error == FMSErrorCode.INVALID_DAPI_TOKEN.value:
-                    # got invalid token error; try to get a new token
-                    self._token = None
-                    self.login()
+                    # got invalid token error; try to get a new token (unless another thread
+                    # already did)
+                    self._relogin(token)
                     # ... now perform original request again
                     return f(self, *args, **kwargs)
                 raise  # if another error occurred, re-raise the exception
@@ -141,22 +294,170 @@ class Server(object):
         Authentication happens via HTTP Basic Auth. Subsequent calls to the API will then use
         the return session token.
 
+        If a token_store is set and holds a token that is likely still valid, that token is used
+        without contacting FMS.
+
         Note that OAuth is currently not supported.
         """
+        if self.token_store is not None:
+            stored = self.token_store.get(self._token_store_key())
+            if stored:
+                self._token, self._token_last_used = stored
+                self._token_from_store = True
+                self._token_issued_at = None
+                return self._token
+
+        self._token = self._request_token()
+        self._token_from_store = False
+        self._token_issued_at = self._token_last_used
+
+        if self.token_store is not None and self._token:
+            self.token_store.set(self._token_store_key(), self._token)
+
+        return self._token
 
+    def _request_token(self):
+        u"""Requests a new session token from FMS and returns it. Overridden by subclasses that
+        authenticate differently (see CloudServer)."""
         path = API_PATH[u'auth'].format(database=self.database, token=u'')
         data = {u'fmDataSource': self.data_sources}
 
         response = self._call_filemaker(u'POST', path, data, auth=(self.user, self.password))
-        self._token = response.get(u'token', None)
+        return response.get(u'token', None)
 
-        return self._token
+    def _relogin(self, stale_token):
+        u"""Replaces the given (invalid) token by logging in again.
+
+        Only one thread logs in at a time. Threads that ask for a new token while another thread
+        is already replacing the same stale token wait for that login and then re-use its token.
+
+        Parameters
+        -----------
+        stale_token : str
+            The token that was found to be invalid.
+        """
+        waiting_since = time.time()
+        with self._login_lock:
+            waited = time.time() - waiting_since
+
+            if self._token and self._token != stale_token:
+                # token was replaced while we were waiting for the lock
+                self._relogin_stats[u'waits'] += 1
+                self._relogin_stats[u'wait_time'] += waited
+                return
+
+            login_start = time.time()
+            if self.token_store is not None:
+                self.token_store.delete(self._token_store_key())
+
+            # the old token stays in place until login() replaces it, so that concurrent
+            # requests never go out without an Authorization header
+            self.login()
+
+            self._relogin_stats[u'logins'] += 1
+            self._relogin_stats[u'login_time'] += time.time() - login_start
+
+    @property
+    def relogin_stats(self):
+        u"""Returns a dict of counters about automatic re-logins of this instance.
+
+        logins / login_time: number of re-logins and total seconds spent on them
+        waits / wait_time: number of times a thread waited for another thread's re-login
+        instead of logging in itself, and total seconds spent waiting
+        """
+        with self._login_lock:
+            return dict(self._relogin_stats)
+
+    @property
+    def token_age(self):
+        u"""Returns seconds since the current token was obtained, or None if unknown."""
+        if not self._token or self._token_issued_at is None:
+            return None
+        return time.time() - self._token_issued_at
+
+    @property
+    def token_idle_time(self):
+        u"""Returns seconds since the last request made with the current token, or None."""
+        if not self._token or self._token_last_used is None:
+            return None
+        return time.time() - self._token_last_used
+
+    def _token_expired(self):
+        u"""Returns True if the current token was idle for longer than session_timeout."""
+        idle = self.token_idle_time
+        return idle is not None and idle >= self.session_timeout
+
+    def validate_session(self):
+        u"""Returns True if FMS still accepts the current token, otherwise False.
+
+        As every request, this resets the idle timer of the session on the server.
+        Requires FileMaker Server 19.1.2 or later.
+        """
+        if not self._token:
+            return False
+
+        try:
+            self._call_filemaker(u'GET', API_PATH[u'validate_session'])
+        except FileMakerError:
+            if self.last_error == FMSErrorCode.INVALID_DAPI_TOKEN.value:
+                return False
+            raise
+        return True
+
+    def start_heartbeat(self, interval = None):
+        u"""Starts a background thread that keeps the session alive.
+
+        Whenever the token was idle for interval seconds, the session is validated, which resets
+        its timeout on the server. If the session turns out to be invalid and auto_relogin is
+        enabled, a new token is requested. The heartbeat is stopped by logout() or
+        stop_heartbeat().
+
+        Parameters
+        -----------
+        interval : int or float, optional
+            Idle seconds after which the session is refreshed. Defaults to half of session_timeout.
+        """
+        if self._heartbeat is not None:
+            return
+
+        interval = self.session_timeout / 2.0 if interval is None else interval
+
+        def _beat():
+            while not self._heartbeat_stop.wait(min(interval, 60)):
+                idle = self.token_idle_time
+                if idle is None or idle < interval:
+                    continue
+                try:
+                    token = self._token
+                    if not self.validate_session() and self.auto_relogin:
+                        self._relogin(token)
+                except FMRestException:
+                    # try again on the next beat
+                    pass
+
+        self._heartbeat_stop.clear()
+        self._heartbeat = threading.Thread(target=_beat)
+        self._heartbeat.daemon = True
+        self._heartbeat.start()
+
+    def stop_heartbeat(self):
+        u"""Stops the background thread started by start_heartbeat()."""
+        if self._heartbeat is not None:
+            self._heartbeat_stop.set()
+            self._heartbeat = None
+
+    def _token_store_key(self):
+        u"""Returns the key of this instance's token in the token_store."""
+        return self.token_store.make_key(self.url, self.database, self.user, self.data_sources)
 
     def logout(self):
         u"""Logs out of current session. Returns True if successful.
 
-        Note: this method is also called by __exit__
+        Note: this method is also called by __exit__, unless a token_store is used.
         """
+        self.stop_heartbeat()
+        if self.token_store is not None:
+            self.token_store.delete(self._token_store_key())
 
 	# token is expected in endpoint for logout
         path = API_PATH[u'auth'].format(database=self.database, token=self._token)
@@ -173,7 +474,6 @@ class Server(object):
         # TODO: support for handling foundset instances inside record instance
         return self.create_record(record.to_dict(ignore_portals=True, ignore_internal_ids=True))
 
-    @_with_auto_relogin
     def create_record(self, field_data,
                       portals = None,
                       scripts = None):
@@ -195,6 +495,63 @@ class Server(object):
                 {'TO::field': 'another record'}
             ]
         """
+        response = self._create_record(field_data, portals, scripts)
+        record_id = response.get(u'recordId')
+
+        return int(record_id) if record_id else None
+
+    def create_records(self, field_data_list,
+                       concurrency = 4,
+                       portals = None,
+                       scripts = None,
+                       session_pool = None):
+        u"""Creates a record for each dict of field data and yields a WriteResult per record.
+
+        Requests are sent concurrently, either through this instance (re-using its pooled
+        connections) or through sessions of the given session_pool. Results are yielded in the
+        order of field_data_list, as soon as they are available. An error for one record (e.g. a
+        FileMakerError or a RequestException) is reported in its result and does not stop the
+        other records from being created.
+
+        Example:
+            for result in fms.create_records(rows, concurrency=8):
+                if result.error:
+                    print(result.error)
+
+        Parameters
+        -----------
+        field_data_list : iterable of dicts
+            Field data for each record, see create_record(). Consumed lazily.
+        concurrency : int, optional
+            Maximum number of create requests in flight. Defaults to 4
+        portals, scripts
+            See create_record(). Applied to every record.
+        session_pool : SessionPool, optional
+            Pool to take sessions from. As FMS processes the requests of one session one after
+            another, use a pool to have the records created in parallel on the server.
+        """
+        def create(field_data):
+            try:
+                if session_pool is None:
+                    response = self._create_record(field_data, portals, scripts)
+                else:
+                    with session_pool.session() as server:
+                        response = server._create_record(field_data, portals, scripts)
+            except FMRestException, ex:
+                return WriteResult(None, None, ex)
+
+            return WriteResult(int(response[u'recordId']), int(response[u'modId']), None)
+
+        return concurrent_map(create, field_data_list, concurrency)
+
+    @_with_auto_relogin
+    def _create_record(self, field_data,
+                       portals = None,
+                       scripts = None):
+        u"""Creates a new record and returns the fms response containing recordId and modId.
+
+        See create_record() for parameters.
+        """
         path = API_PATH[u'record'].format(
             database=self.database,
             layout=self.layout,
@@ -210,16 +567,14 @@ class Server(object):
             request_data.update(script_params)
 
         response = self._call_filemaker(u'POST', path, request_data)
-        record_id = response.get(u'recordId')
-
-        return int(record_id) if record_id else None
+        self._invalidate_response_cache()
+        return response
 
     def edit(self, record, validate_mod_id = False):
         u"""Shortcut to edit_record method. Takes (modified) record instance and calls edit_record"""
         mod_id = record.modification_id if validate_mod_id else None
         return self.edit_record(record.record_id, record.modifications(), mod_id)
 
-    @_with_auto_relogin
     def edit_record(self, record_id, field_data,
                     mod_id = None, portals = None,
                     scripts = None):
@@ -250,6 +605,18 @@ class Server(object):
             Allowed types: 'prerequest', 'presort', 'after'
             List should have length of 2 (both script name and parameter are required.)
         """
+        self._edit_record(record_id, field_data, mod_id, portals, scripts)
+
+        return self.last_error == FMSErrorCode.SUCCESS.value
+
+    @_with_auto_relogin
+    def _edit_record(self, record_id, field_data,
+                     mod_id = None, portals = None,
+                     scripts = None):
+        u"""Edits the record and returns the fms response containing the new modId.
+
+        See edit_record() for parameters.
+        """
         path = API_PATH[u'record_action'].format(
             database=self.database,
             layout=self.layout,
@@ -268,9 +635,24 @@ class Server(object):
         if script_params:
             request_data.update(script_params)
 
-        self._call_filemaker(u'PATCH', path, request_data)
+        response = self._call_filemaker(u'PATCH', path, request_data)
+        self._invalidate_response_cache(record_id)
+        return response
 
-        return self.last_error == FMSErrorCode.SUCCESS.value
+    def unit_of_work(self, concurrency = 4,
+                     validate_mod_id = False,
+                     session_pool = None):
+        u"""Returns a UnitOfWork collecting record edits to write them back in one go.
+
+            with fms.unit_of_work(concurrency=8) as uow:
+                for record in foundset:
+                    record.status = 'done'
+                    uow.edit(record)
+            print(uow.conflicts)
+
+        See UnitOfWork for parameters.
+        """
+        return UnitOfWork(self, concurrency, validate_mod_id, session_pool)
 
     def delete(self, record):
         u"""Shortcut to delete_record method. Takes record instance and calls delete_record."""
@@ -304,13 +686,15 @@ class Server(object):
         params = build_script_params(scripts) if scripts else None
 
         self._call_filemaker(u'DELETE', path, params=params)
+        self._invalidate_response_cache(record_id)
 
         return self.last_error == FMSErrorCode.SUCCESS.value
 
     @_with_auto_relogin
     def get_record(self, record_id, portals = None,
                    scripts = None,
-                   layout = None):
+                   layout = None,
+                   use_cache = True):
         u"""Fetches record with given ID and returns Record instance
 
         Parameters
@@ -332,6 +716,9 @@ class Server(object):
             Passing a layout name allows you to set the response (!) layout.
             This is helpful, for example, if you want to limit the number of fields/portals being
             returned and have a dedicated response layout.
+        use_cache : bool, optional
+            If False, the response_cache (if any) is neither read nor filled, e.g. to get the
+            current state of records. Defaults to True.
         """
         path = API_PATH[u'record_action'].format(
             database=self.database,
@@ -347,11 +734,12 @@ class Server(object):
         if script_params:
             params.update(script_params)
 
-        response = self._call_filemaker(u'GET', path, params=params)
+        response = self._cached_call(u'GET', path, params=params, record_id=record_id,
+                                     use_cache=use_cache)
 
         # pass response to foundset generator function. As we are only requesting one record though,
         # we only re-use the code and immediately consume the first (and only) record via next().
-        return self._process_foundset_response(response).next()
+        return self._process_foundset_response(response, layout).next()
 
     @_with_auto_relogin
     def perform_script(self, name,
@@ -374,6 +762,8 @@ class Server(object):
         )
 
         response = self._call_filemaker(u'GET', path, params={u'script.param': param})
+        # the script may have changed any record
+        self._invalidate_response_cache(all_records=True)
 
         script_error = response.get(u'scriptError', None)
         script_error = int(script_error) if script_error else None
@@ -400,17 +790,19 @@ class Server(object):
         ) + u'/containers/' + field_name + u'/1'
 
         # requests library handles content type for multipart/form-data incl. boundary
-        self._set_content_type(False)
-        self._call_filemaker(u'POST', path, files={u'upload': file_})
+        self._call_filemaker(u'POST', path, files={u'upload': file_}, content_type=None)
+        self._invalidate_response_cache(record_id)
 
         return self.last_error == FMSErrorCode.SUCCESS.value
 
-    @_with_auto_relogin
     def get_records(self, offset = 1, limit = 100,
                     sort = None,
                     portals = None,
                     scripts = None,
-                    layout = None):
+                    layout = None,
+                    stream = False,
+                    columnar = False,
+                    use_cache = True):
         u"""Requests all records with given offset and limit and returns result as
         (sorted) Foundset instance.
 
@@ -436,7 +828,31 @@ class Server(object):
             Passing a layout name allows you to set the response (!) layout.
             This is helpful, for example, if you want to limit the number of fields/portals being
             returned and have a dedicated response layout.
+        stream : bool, optional
+            If True, the response is parsed incrementally while the returned Foundset is consumed,
+            so that the records of a big page are never all in memory at once. Requires ijson.
+            Consume the Foundset completely to release the connection. Defaults to False.
+        columnar : bool, optional
+            If True, a ColumnarFoundset is returned, which stores the records column by column
+            instead of as Record instances. Defaults to False.
+        use_cache : bool, optional
+            If False, the response_cache (if any) is neither read nor filled, e.g. to get the
+            current state of records. Defaults to True.
         """
+        response = self._request_records(offset, limit, sort, portals, scripts, layout, stream,
+                                         use_cache)
+        info = response.get(u'dataInfo', {})
+
+        if columnar:
+            return self._columnar_foundset(response, info, layout)
+        return self._foundset(response, info, layout)
+
+    @_with_auto_relogin
+    def _request_records(self, offset, limit,
+                         sort, portals,
+                         scripts, layout,
+                         stream = False, use_cache = True):
+        u"""Requests a page of records and returns the FMS response. See get_records()."""
         path = API_PATH[u'record'].format(
             database=self.database,
             layout=self.layout
@@ -448,25 +864,24 @@ class Server(object):
         params[u'layout.response'] = layout
 
         if sort:
-            params[u'_sort'] = json.dumps(sort)
+            params[u'_sort'] = self._json_codec().dumps(sort)
 
         # build script param object in FMSDAPI style
         script_params = build_script_params(scripts) if scripts else None
         if script_params:
             params.update(script_params)
 
-        response = self._call_filemaker(u'GET', path, params=params)
-        info = response.get(u'dataInfo', {})
+        return self._cached_call(u'GET', path, params=params, stream=stream, use_cache=use_cache)
 
-        return Foundset(self._process_foundset_response(response), info)
-
-    @_with_auto_relogin
     def find(self, query,
              sort = None,
              offset = 1, limit = 100,
              portals = None,
              scripts = None,
-             layout = None):
+             layout = None,
+             stream = False,
+             columnar = False,
+             use_cache = True):
         u"""Finds all records matching query and returns result as a Foundset instance.
 
         Parameters
@@ -502,7 +917,32 @@ class Server(object):
             Your find will still be performed based on the Server.layout attribute.
             This is helpful, for example, if you want to limit the number of fields/portals being
             returned and have a dedicated response layout.
+        stream : bool, optional
+            If True, the response is parsed incrementally while the returned Foundset is consumed,
+            so that the records of a big page are never all in memory at once. Requires ijson.
+            Consume the Foundset completely to release the connection. Defaults to False.
+        columnar : bool, optional
+            If True, a ColumnarFoundset is returned, which stores the records column by column
+            instead of as Record instances. Defaults to False.
+        use_cache : bool, optional
+            If False, the response_cache (if any) is neither read nor filled, e.g. to get the
+            current state of records. Defaults to True.
         """
+        response = self._request_find(query, sort, offset, limit, portals, scripts, layout, stream,
+                                      use_cache)
+        info = response.get(u'dataInfo', {})
+
+        if columnar:
+            return self._columnar_foundset(response, info, layout)
+        return self._foundset(response, info, layout)
+
+    @_with_auto_relogin
+    def _request_find(self, query, sort,
+                      offset, limit,
+                      portals, scripts,
+                      layout, stream = False,
+                      use_cache = True):
+        u"""Performs a find and returns the FMS response. See find()."""
         path = API_PATH[u'find'].format(
             database=self.database,
             layout=self.layout
@@ -529,10 +969,442 @@ class Server(object):
         # FM Data API from v17 cannot handle null values, so we remove all Nones from data
         data = dict((k, v) for k, v in data.items() if v is not None)
 
-        response = self._call_filemaker(u'POST', path, data=data)
-        info = response.get(u'dataInfo', {})
+        return self._cached_call(u'POST', path, data=data, stream=stream, use_cache=use_cache)
+
+    def get_layout_metadata(self, layout = None,
+                            refresh = False):
+        u"""Returns the metadata of a layout: its fields (fieldMetaData), portals
+        (portalMetaData) and value lists (valueLists), as returned by FMS.
+
+        Metadata is cached per layout for layout_metadata_ttl seconds (shared with the sessions of
+        a SessionPool or parallel_scan()), so repeated calls cost no extra requests.
+
+        Parameters
+        -----------
+        layout : str, optional
+            Name of the layout. Defaults to the current layout.
+        refresh : bool, optional
+            If True, the metadata is requested from FMS even if it is cached.
+        """
+        layout = self.layout if layout is None else layout
+
+        cached = self._layout_metadata.get(layout)
+        if cached is not None and not refresh and \
+                time.time() - cached[0] < self.layout_metadata_ttl:
+            return cached[1]
+
+        metadata = self._request_layout_metadata(layout)
+        self._layout_metadata[layout] = (time.time(), metadata)
+        return metadata
+
+    def clear_layout_metadata(self, layout = None):
+        u"""Removes the cached metadata of layout, or of all layouts if layout is None."""
+        if layout is None:
+            self._layout_metadata.clear()
+        else:
+            self._layout_metadata.pop(layout, None)
+
+    @_with_auto_relogin
+    def _request_layout_metadata(self, layout):
+        u"""Requests the metadata of layout from FMS."""
+        path = API_PATH[u'layout'].format(database=self.database, layout=layout)
+        return self._call_filemaker(u'GET', path)
+
+    def iter_records(self, page_size = 100,
+                     max_records = None,
+                     offset = 1,
+                     sort = None,
+                     portals = None,
+                     scripts = None,
+                     layout = None,
+                     prefetch = 0,
+                     stream = False):
+        u"""Generator yielding all records of the current layout, requested page by page.
+
+        Pages are requested lazily via get_records() while records are consumed, so only one page
+        is held in memory at a time. Iteration stops when the foundCount reported by FMS (or
+        max_records) is reached.
+
+        Parameters
+        -----------
+        page_size : int, optional
+            Number of records requested per call. Defaults to 100
+        max_records : int, optional
+            Upper bound of records to yield. Defaults to None (all records)
+        offset : int, optional
+            Offset to start at, starting at 1, default 1
+        sort, portals, layout
+            See get_records()
+        scripts : dict, optional
+            See get_records(). Note that scripts are performed for every requested page.
+        prefetch : int, optional
+            Number of pages to request ahead on a background thread while the current page is
+            consumed. At most prefetch + 2 pages are held in memory. Defaults to 0 (no prefetching,
+            pages are requested on demand in the calling thread).
+        stream : bool, optional
+            If True, each page is parsed incrementally while its records are consumed. See
+            get_records(). Defaults to False.
+        """
+        def fetch_page(page_offset, page_limit):
+            return self.get_records(offset=page_offset, limit=page_limit, sort=sort,
+                                    portals=portals, scripts=scripts, layout=layout,
+                                    stream=stream)
+
+        pages = self._iter_pages(fetch_page, offset, page_size, max_records)
+        if prefetch:
+            pages = prefetch_generator(pages, prefetch)
+
+        for foundset in pages:
+            for record in foundset:
+                yield record
+
+    def iter_find(self, query,
+                  page_size = 100,
+                  max_records = None,
+                  offset = 1,
+                  sort = None,
+                  portals = None,
+                  scripts = None,
+                  layout = None,
+                  prefetch = 0,
+                  stream = False):
+        u"""Generator yielding all records matching query, requested page by page.
+
+        Pages are requested lazily via find() while records are consumed, so only one page is held
+        in memory at a time. Iteration stops when the foundCount reported by FMS (or max_records)
+        is reached. Unlike find(), no FileMakerError is raised when no records match the query.
+
+        Parameters
+        -----------
+        query : list of dicts
+            See find()
+        page_size : int, optional
+            Number of records requested per call. Defaults to 100
+        max_records : int, optional
+            Upper bound of records to yield. Defaults to None (all records)
+        offset : int, optional
+            Offset to start at, starting at 1, default 1
+        sort, portals, layout
+            See find()
+        scripts : dict, optional
+            See find(). Note that scripts are performed for every requested page.
+        prefetch : int, optional
+            Number of pages to request ahead on a background thread while the current page is
+            consumed. At most prefetch + 2 pages are held in memory. Defaults to 0 (no prefetching,
+            pages are requested on demand in the calling thread).
+        stream : bool, optional
+            If True, each page is parsed incrementally while its records are consumed. See
+            find(). Defaults to False.
+        """
+        def fetch_page(page_offset, page_limit):
+            try:
+                return self.find(query, sort=sort, offset=page_offset, limit=page_limit,
+                                 portals=portals, scripts=scripts, layout=layout,
+                                 stream=stream)
+            except FileMakerError:
+                if self.last_error == FMSErrorCode.NO_RECORDS_MATCH.value:
+                    return None
+                raise
+
+        pages = self._iter_pages(fetch_page, offset, page_size, max_records)
+        if prefetch:
+            pages = prefetch_generator(pages, prefetch)
+
+        for foundset in pages:
+            for record in foundset:
+                yield record
+
+    def parallel_scan(self, concurrency = 4,
+                      page_size = 1000,
+                      ordered = True,
+                      max_records = None,
+                      offset = 1,
+                      sort = None,
+                      portals = None,
+                      layout = None,
+                      session_pool = None):
+        u"""Generator yielding all records of the current layout, fetched concurrently through
+        multiple Data API sessions.
+
+        FMS processes the requests of one session one after another. To have several requests in
+        flight, the offset range is split into pages of page_size, which are fetched by
+        concurrency independently logged-in sessions. All sessions share this instance's
+        connection pool and are logged out when the generator is exhausted or closed (unless
+        they come from the given session_pool).
+
+        Parameters
+        -----------
+        concurrency : int, optional
+            Number of sessions (and requests in flight). Defaults to 4
+        page_size : int, optional
+            Number of records requested per call. Defaults to 1000
+        ordered : bool, optional
+            If True (default), records are yielded in offset order. If False, pages are yielded
+            as soon as they arrive, which avoids waiting for slow pages.
+        max_records : int, optional
+            Upper bound of records to yield. Defaults to None (all records)
+        offset : int, optional
+            Offset to start at, starting at 1, default 1
+        sort, portals, layout
+            See get_records()
+        session_pool : SessionPool, optional
+            Pool to take the sessions from. If None, a pool of concurrency sessions is created
+            for the scan and closed afterwards.
+        """
+        if page_size < 1:
+            raise ValueError(u'page_size must be greater than 0.')
+
+        pool = SessionPool(self, size=concurrency) if session_pool is None else session_pool
+
+        def fetch_page(page):
+            with pool.session() as server:
+                return server.get_records(offset=page[0], limit=page[1], sort=sort,
+                                          portals=portals, layout=layout)
+
+        try:
+            try:
+                found_count = int(fetch_page((offset, 1)).info.get(u'foundCount', 0))
+            except FileMakerError, ex:
+                if ex.error_code == FMSErrorCode.NO_RECORDS_MATCH.value:
+                    return
+                raise
+
+            end = found_count + 1
+            if max_records is not None:
+                end = min(end, offset + max_records)
+
+            pages = ((page_offset, min(page_size, end - page_offset))
+                     for page_offset in xrange(offset, end, page_size))
+
+            for foundset in concurrent_map(fetch_page, pages, concurrency, ordered):
+                for record in foundset:
+                    yield record
+        finally:
+            if session_pool is None:
+                pool.close()
+
+    def to_df(self, query = None,
+              page_size = 1000,
+              max_records = None,
+              offset = 1,
+              sort = None,
+              layout = None,
+              prefetch = 0):
+        u"""Returns a Pandas DataFrame of all records of the current layout, or of all records
+        matching query, requested page by page. Must have Pandas installed.
+
+        The columns are built straight from the response data of each page, without building
+        Records, and the dtype of each column is inferred once for the whole column. Portal data
+        is not returned as part of the DataFrame.
+
+        Parameters
+        -----------
+        query : list of dicts, optional
+            Find query, see find(). Defaults to None (all records).
+        page_size : int, optional
+            Number of records requested per call. Defaults to 1000
+        max_records : int, optional
+            Upper bound of records to return. Defaults to None (all records)
+        offset : int, optional
+            Offset to start at, starting at 1, default 1
+        sort, layout
+            See get_records()
+        prefetch : int, optional
+            Number of pages to request ahead on a background thread while the current page is
+            processed. See iter_records(). Defaults to 0.
+        """
+        import_pandas()
+
+        def fetch_page(page_offset, page_limit):
+            # no records are built, so the page is wrapped in a Foundset only holding its data
+            if query is None:
+                response = self._request_records(page_offset, page_limit, sort, None, None,
+                                                 layout)
+            else:
+                try:
+                    response = self._request_find(query, sort, page_offset, page_limit, None,
+                                                  None, layout)
+                except FileMakerError:
+                    if self.last_error == FMSErrorCode.NO_RECORDS_MATCH.value:
+                        return None
+                    raise
+            return Foundset((), response.get(u'dataInfo', {}), data=response[u'data'])
+
+        pages = self._iter_pages(fetch_page, offset, page_size, max_records)
+        if prefetch:
+            pages = prefetch_generator(pages, prefetch)
+
+        columns = collections.OrderedDict()
+        length = 0
+        for foundset in pages:
+            length = append_columns(columns, foundset._data[0], length)
+
+        return columns_to_df(columns, self._value_conversion(layout))
+
+    def _clone(self):
+        u"""Returns a copy of this instance that shares configuration and connection pool, but
+        not the session token, so that it can log in independently."""
+        clone = copy.copy(self)
+        clone._token = None
+        clone._token_from_store = False
+        clone._token_issued_at = None
+        clone._token_last_used = None
+        clone._heartbeat = None
+        clone._heartbeat_stop = threading.Event()
+        clone._login_lock = threading.Lock()
+        clone._relogin_stats = {u'logins': 0, u'login_time': 0.0, u'waits': 0, u'wait_time': 0.0}
+        clone.token_store = None
+        clone._local = threading.local()
+        return clone
+
+    def delete_where(self, query, concurrency = 4,
+                     page_size = 1000,
+                     dry_run = False,
+                     layout = None,
+                     session_pool = None,
+                     progress = None):
+        u"""Deletes all records matching query. Returns a BulkProgress with the final counters.
+
+        The record ids of all matching records are collected page by page first (so that deleting
+        does not shift the pages of the found set), then the records are deleted with at most
+        concurrency requests in flight. Records that fail to delete are reported in the errors
+        of the returned BulkProgress and don't stop the others from being deleted.
+
+        Parameters
+        -----------
+        query : list of dicts
+            See find()
+        concurrency : int, optional
+            Maximum number of delete requests in flight. Defaults to 4
+        page_size : int, optional
+            Number of record ids requested per find call. Defaults to 1000
+        dry_run : bool, optional
+            If True, nothing is deleted and only the matched counter is set, taken from the
+            dataInfo of a single find request.
+        layout : str, optional
+            Response layout for collecting the record ids. Use a layout with few fields to keep the
+            find responses small.
+        session_pool : SessionPool, optional
+            Pool to take sessions from for the delete requests.
+        progress : function, optional
+            Called with the BulkProgress instance after each processed record.
+        """
+        def delete(server, record_id):
+            server.delete_record(record_id)
+
+        return self._mutate_where(delete, query, concurrency, page_size, dry_run, layout,
+                                  session_pool, progress)
+
+    def update_where(self, query, field_data,
+                     concurrency = 4,
+                     page_size = 1000,
+                     dry_run = False,
+                     layout = None,
+                     session_pool = None,
+                     progress = None):
+        u"""Sets field_data on all records matching query. Returns a BulkProgress with the final
+        counters.
+
+        Works like delete_where(), but edits the matching records instead of deleting them.
+
+        Parameters
+        -----------
+        query : list of dicts
+            See find()
+        field_data : dict
+            Dict of field names and values to set, see edit_record()
+        concurrency, page_size, dry_run, layout, session_pool, progress
+            See delete_where()
+        """
+        def update(server, record_id):
+            server._edit_record(record_id, field_data)
+
+        return self._mutate_where(update, query, concurrency, page_size, dry_run, layout,
+                                  session_pool, progress)
+
+    def _mutate_where(self, mutate, query,
+                      concurrency, page_size,
+                      dry_run, layout,
+                      session_pool, progress):
+        u"""Calls mutate(server, record_id) for all records matching query and tracks progress.
 
-        return Foundset(self._process_foundset_response(response), info)
+        See delete_where() for parameters.
+        """
+        counters = BulkProgress()
+
+        if dry_run:
+            try:
+                foundset = self.find(query, limit=1, layout=layout)
+            except FileMakerError, ex:
+                if ex.error_code != FMSErrorCode.NO_RECORDS_MATCH.value:
+                    raise
+            else:
+                counters.matched = int(foundset.info.get(u'foundCount', 0))
+            return counters
+
+        record_ids = [record.record_id
+                      for record in self.iter_find(query, page_size=page_size, layout=layout)]
+        counters.matched = len(record_ids)
+
+        def run(record_id):
+            try:
+                if session_pool is None:
+                    mutate(self, record_id)
+                else:
+                    with session_pool.session() as server:
+                        mutate(server, record_id)
+            except FMRestException, ex:
+                return record_id, ex
+            return record_id, None
+
+        for record_id, error in concurrent_map(run, record_ids, concurrency, ordered=False):
+            counters.processed += 1
+            if error is None:
+                counters.succeeded += 1
+            else:
+                counters.failed += 1
+                counters.errors[record_id] = error
+
+            if progress is not None:
+                progress(counters)
+
+        return counters
+
+    def _iter_pages(self, fetch_page, offset,
+                    page_size, max_records):
+        u"""Generator calling fetch_page(offset, limit) for consecutive pages and yielding the
+        returned Foundsets until the found set is exhausted.
+
+        Parameters
+        -----------
+        fetch_page : function
+            Takes offset and limit and returns a Foundset, or None if there are no records.
+        offset : int
+            Offset of the first page, starting at 1
+        page_size : int
+            Limit for each page
+        max_records : int or None
+            Total number of records to request at most
+        """
+        if page_size < 1:
+            raise ValueError(u'page_size must be greater than 0.')
+
+        requested = 0
+        while max_records is None or requested < max_records:
+            limit = page_size if max_records is None else min(page_size, max_records - requested)
+
+            foundset = fetch_page(offset, limit)
+            if foundset is None:
+                return
+
+            returned = int(foundset.info.get(u'returnedCount', 0))
+            found_count = int(foundset.info.get(u'foundCount', 0))
+            yield foundset
+
+            requested += limit
+            offset += limit
+            if returned < limit or offset > found_count:
+                return
 
     def fetch_file(self, file_url,
                    stream = False):
@@ -562,7 +1434,9 @@ class Server(object):
         response = request(method=u'get',
                            url=file_url,
                            verify=self.verify_ssl,
-                           stream=stream
+                           proxies=self.proxies,
+                           stream=stream,
+                           session=self._session
                           )
 
         return (name,
@@ -590,13 +1464,34 @@ class Server(object):
         data = {u'globalFields': globals_}
 
         self._call_filemaker(u'PATCH', path, data=data)
+        # calculations depending on globals may have changed
+        self._invalidate_response_cache(all_records=True)
         return self.last_error == FMSErrorCode.SUCCESS.value
 
+    @property
+    def _last_fm_error(self):
+        u"""Error code of the last call made by the current thread."""
+        return getattr(self._local, u'last_fm_error', None)
+
+    @_last_fm_error.setter
+    def _last_fm_error(self, value):
+        self._local.last_fm_error = value
+
+    @property
+    def _last_script_result(self):
+        u"""Script results of the last call made by the current thread."""
+        return getattr(self._local, u'last_script_result', None)
+
+    @_last_script_result.setter
+    def _last_script_result(self, value):
+        self._local.last_script_result = value
+
     @property
     def last_error(self):
         u"""Returns last error number returned by FileMaker Server as int.
 
-        Error is set by _call_filemaker method. If error == -1, the previous request failed
+        Error is set by _call_filemaker method and is tracked per thread, i.e. you get the error
+        of the last call made by the current thread. If error == -1, the previous request failed
         and no FM error code is available. If no request was made yet, last_error will be None.
         """
         if self._last_fm_error:
@@ -613,6 +1508,7 @@ class Server(object):
         only be present if the last call performed a presort script.
         The returned error (0th element in list) will always be converted to int.
         """
+        result = {}
         if self._last_script_result:
             result = dict((
                 k, [int(v[0]), v[1]]) for k, v in self._last_script_result.items() if v[0] is not None)
@@ -621,6 +1517,10 @@ class Server(object):
     def _call_filemaker(self, method, path,
                         data = None,
                         params = None,
+                        content_type = u'application/json',
+                        stream = False,
+                        authorization = None,
+                        return_size = False,
                         **kwargs):
         u"""Calls a FileMaker Server Data API path and returns the parsed fms response data
 
@@ -636,46 +1536,112 @@ class Server(object):
         params : dict of str : str, optional
             Dict of get parameters for http request
             Can be None if API expects no params
+        content_type : str, optional
+            Content-Type header of the request. Pass None to let the requests lib set it, e.g.
+            for multipart/form-data uploads.
+        stream : bool, optional
+            If True, the response data is parsed incrementally, see parse_streamed_response().
+            The returned response's data key then holds a generator of records.
+        authorization : str, optional
+            Authorization header to send instead of the one for the current token, e.g. an FMID
+            token for the login of a CloudServer.
+        return_size : bool, optional
+            If True, a tuple of the fms response data and the size of the response body in bytes
+            is returned. Not supported for streamed requests.
         auth : tuple of str, str, optional
             Tuple containing user and password for HTTP basic
             auth
         """
 
         url = self.url + path
-        request_data = json.dumps(data) if data else None
-
-        # if we have a token, make sure it's included in the header
-        # if not, the Authorization header gets removed (necessary for example
-        # for logout)
-        self._update_token_header()
+        codec = self._json_codec()
+        request_data = codec.dumps(data) if data else None
+        sent_at = time.time()
 
         response = request(method=method,
-                           headers=self._headers,
+                           headers=self._build_headers(content_type, authorization),
                            url=url,
                            data=request_data,
                            verify=self.verify_ssl,
                            params=params,
                            proxies=self.proxies,
+                           session=self._session,
+                           stream=stream,
                            **kwargs)
 
-        try:
-            response_data = response.json()
-        except json.decoder.JSONDecodeError, ex:
-            raise BadJSON(ex, response)
+        if stream:
+            response_data = parse_streamed_response(response)
+        else:
+            try:
+                if codec is STDLIB_JSON:
+                    # let requests handle the decoding of the body
+                    response_data = response.json()
+                else:
+                    response_data = codec.loads(response.content)
+            except ValueError, ex:
+                raise BadJSON(ex, response)
 
         fms_messages = response_data.get(u'messages')
         fms_response = response_data.get(u'response')
 
+        if stream and fms_messages is None:
+            # messages follow the data array and have not been read yet. FMS only sends data
+            # for successful requests.
+            fms_messages = [{u'code': u'0'}]
+
         self._update_script_result(fms_response)
         self._last_fm_error = fms_messages[0].get(u'code', -1)
+
+        # any answer but an invalid token error means the session's idle timer was reset
+        if self.last_error != FMSErrorCode.INVALID_DAPI_TOKEN.value:
+            self._token_last_used = sent_at
+
         if self.last_error != FMSErrorCode.SUCCESS.value:
             raise FileMakerError(self._last_fm_error,
                                  fms_messages[0].get(u'message', u'Unkown error'))
 
-        self._set_content_type() # reset content type
-
+        if return_size:
+            return fms_response, len(response.content)
         return fms_response
 
+    def _cached_call(self, method, path,
+                     data = None, params = None,
+                     stream = False, record_id = None,
+                     use_cache = True):
+        u"""Like _call_filemaker(), but answers from the response_cache (if any) and caches
+        successful responses. Streamed requests are not cached.
+
+        Parameters
+        -----------
+        record_id : int, optional
+            Id of the requested record, so that writes to it can invalidate the entry
+        use_cache : bool, optional
+            If False, the request bypasses the response_cache
+        """
+        cache = self.response_cache
+        if cache is None or stream or not use_cache:
+            return self._call_filemaker(method, path, data=data, params=params, stream=stream)
+
+        key = cache.make_key(self.url, self.database, self.user, path, params, data, record_id)
+        response = cache.get(key)
+        if response is not None:
+            # leave the state as a successful request would
+            self._update_script_result(response)
+            self._last_fm_error = u'0'
+            return response
+
+        response, size = self._call_filemaker(method, path, data=data, params=params,
+                                              return_size=True)
+        cache.set(key, response, size)
+        return response
+
+    def _invalidate_response_cache(self, record_id = None,
+                                   all_records = False):
+        u"""Removes the response_cache entries that a write to record_id (or a new record, or
+        with all_records any record) may have changed."""
+        if self.response_cache is not None:
+            self.response_cache.invalidate(self.url, self.database, record_id, all_records)
+
     def _update_script_result(self, response):
         u"""Extracts script result data from fms response and updates script result attribute"""
         self._last_script_result = {
@@ -695,33 +1661,43 @@ class Server(object):
 
         return self._last_script_result
 
-    def _update_token_header(self):
-        u"""Update header to include access token (if available) for subsequent calls."""
-        if self._token:
-            self._headers[u'Authorization'] = u'Bearer ' + self._token
-        else:
-            self._headers.pop(u'Authorization', None)
-        return self._headers
+    def _json_codec(self):
+        u"""Returns the JSON codec of this instance, or the module-wide one if not set."""
+        return self.json_codec or get_json_codec()
 
-    def _set_content_type(self, type_ = u'application/json'):
-        u"""Set the Content-Type header and returns the updated _headers dict.
+    def _build_headers(self, content_type = u'application/json',
+                       authorization = None):
+        u"""Returns a new headers dict for a single request.
+
+        Headers are built per call instead of being stored on the instance, so that requests
+        sent concurrently from multiple threads don't interfere with each other.
 
         Parameters
         -----------
-        type_ : str, boolean
-            String definining the content type for the HTTP header or False to remove the
-            Content-Type key from _headers (i.e. let the requests lib handle the Content-Type.)
-        path : str
+        content_type : str or None
+            String defining the content type for the HTTP header or None to leave out the
+            Content-Type key (i.e. let the requests lib handle the Content-Type.)
+        authorization : str or None
+            Authorization header to use instead of the one for the current token.
         """
-        if isinstance(type_, unicode):
-            self._headers[u'Content-Type'] = type_
-        elif not type_:
-            self._headers.pop(u'Content-Type')
-        else:
-            raise ValueError
-        return self._headers
+        headers = {}
+        if content_type:
+            headers[u'Content-Type'] = content_type
+
+        # if we have a token, make sure it's included in the header
+        # if not, the Authorization header is left out (necessary for example for logout)
+        if authorization is None:
+            authorization = self._authorization_header()
+        if authorization:
+            headers[u'Authorization'] = authorization
+
+        return headers
+
+    def _authorization_header(self):
+        u"""Returns the Authorization header value for the current token or None."""
+        return u'Bearer ' + self._token if self._token else None
 
-    def _process_foundset_response(self, response):
+    def _process_foundset_response(self, response, layout = None):
         u"""Generator function that takes a response object, brings it into a Foundset/Record
         structure and yields processed Records.
 
@@ -735,22 +1711,73 @@ class Server(object):
         -----------
         response : dict
             FMS response from a _call_filemaker request
+        layout : str, optional
+            Response layout of the request, if not the current layout
+        """
+        if self.lazy_records:
+            for record in response[u'data']:
+                yield LazyRecord(record, self._lazy_portal, type_conversion=self.type_conversion,
+                                 date_order=self.date_order)
+            return
+
+        for schema, values in self._iter_rows(response, layout):
+            yield Record(schema, values)
+
+    def _iter_rows(self, response, layout = None):
+        u"""Generator yielding a tuple of RecordSchema and list of values for each record of the
+        response. Portals are included as Foundsets.
+
+        With type_conversion, the values (also of portal records) are already converted. The
+        type of each field is decided once per response (see TypeInference) or taken from the
+        layout metadata (see use_layout_metadata).
+
+        Parameters
+        -----------
+        response : dict
+            FMS response from a _call_filemaker request
+        layout : str, optional
+            Response layout of the request, if not the current layout
         """
         data = response[u'data']
 
-        for record in data:
-            field_data = record[u'fieldData']
+        # records (and portal rows) of one response share their fields, so they share one schema
+        schema = field_keys = row_keys = portal_names = None
+        field_count = 0
+        portal_schemas = {}
+        conversion = self._value_conversion(layout)
 
-            # Add meta fields to record.
+        for record in data:
+            # the response may be held by the response_cache, so it is not modified. The meta
+            # fields recordId and modId are added after the fields of fieldData.
             # TODO: this can clash with fields that have the same name. Find a better
             # way (maybe prefix?).
             # Note that portal foundsets have the recordId field included by default
             # (without the related table prefix).
-            field_data[u'recordId'] = record.get(u'recordId')
-            field_data[u'modId'] = record.get(u'modId')
-
-            keys = list(field_data)
-            values = list(field_data.values())
+            field_data = record[u'fieldData']
+            portal_data = record[u'portalData']
+            values = None
+            if schema is not None and field_count == len(field_data) and \
+                    len(portal_names) == len(portal_data):
+                try:
+                    values = [field_data[key] for key in field_keys]
+                    portals = [portal_data[name] for name in portal_names]
+                except KeyError:
+                    values = None
+
+            if values is None:
+                field_count = len(field_data)
+                field_keys = [key for key in field_data if key != u'recordId' and key != u'modId']
+                row_keys = field_keys + [u'recordId', u'modId']
+                portal_names = list(portal_data)
+                schema = RecordSchema(row_keys + [PORTAL_PREFIX + name for name in portal_names])
+                values = [field_data[key] for key in field_keys]
+                portals = [portal_data[name] for name in portal_names]
+
+            values.append(record.get(u'recordId'))
+            values.append(record.get(u'modId'))
+
+            if conversion is not None:
+                values = conversion.convert_row(row_keys, values)
 
             portal_info = {}
             for entry in record.get(u'portalDataInfo', []):
@@ -758,16 +1785,73 @@ class Server(object):
                 portal_identifier = entry.get(u'portalObjectName', entry[u'table'])
                 portal_info[portal_identifier] = entry
 
-            for portal_name, rows in record[u'portalData'].items():
-                keys.append(PORTAL_PREFIX + portal_name)
-
+            for portal_name, rows in izip(portal_names, portals):
                 # further delay creation of portal record instances
-                related_records = (
-                    Record(list(row), list(row.values()),
-                           in_portal=True, type_conversion=self.type_conversion
-                          ) for row in rows
-                )
+                related_records = self._portal_records(rows, portal_name, portal_schemas,
+                                                       conversion)
                 # add portal foundset to record
-                values.append(Foundset(related_records, portal_info.get(portal_name, {})))
-
-            yield Record(keys, values, type_conversion=self.type_conversion)
+                values.append(Foundset(related_records, portal_info.get(portal_name, {}),
+                                       cache=self.foundset_cache))
+
+            yield schema, values
+
+    def _value_conversion(self, layout = None):
+        u"""Returns the object converting the values of records from layout (defaults to the
+        current layout), or None without type_conversion."""
+        if not self.type_conversion:
+            return None
+        if self.use_layout_metadata:
+            return MetadataConversion(self.get_layout_metadata(layout), self.date_order)
+        return TypeInference(date_order=self.date_order)
+
+    def _foundset(self, response, info,
+                  layout = None):
+        u"""Returns a Foundset of the records of the response."""
+        data = response[u'data']
+        # a streamed response has no list of records to build a DataFrame from, and foundsets
+        # with a bounded cache policy must not keep the whole response alive
+        if not isinstance(data, list) or self.foundset_cache != u'all':
+            data = None
+        return Foundset(self._process_foundset_response(response, layout), info,
+                        data=data,
+                        conversion=self._value_conversion(layout),
+                        cache=self.foundset_cache)
+
+    def _columnar_foundset(self, response, info,
+                           layout = None):
+        u"""Returns a ColumnarFoundset built from the records of the response."""
+        foundset = ColumnarFoundset(info=info)
+        for schema, values in self._iter_rows(response, layout):
+            foundset.append_row(schema, values)
+        return foundset
+
+    def _lazy_portal(self, record, portal_name):
+        u"""Returns the Foundset of the portal portal_name of a LazyRecord."""
+        info = {}
+        for entry in record.get(u'portalDataInfo', []):
+            if entry.get(u'portalObjectName', entry[u'table']) == portal_name:
+                info = entry
+                break
+
+        related_records = (
+            LazyRecord(row, in_portal=True, type_conversion=self.type_conversion,
+                       date_order=self.date_order)
+            for row in record[u'portalData'][portal_name]
+        )
+        return Foundset(related_records, info, cache=self.foundset_cache)
+
+    def _portal_records(self, rows, portal_name,
+                        portal_schemas, conversion):
+        u"""Generator of Records for the given portal rows. Rows with the same fields share the
+        schema stored for portal_name in portal_schemas. Values are converted by conversion
+        (if not None)."""
+        for row in rows:
+            schema = portal_schemas.get(portal_name)
+            values = schema.values_from(row) if schema is not None else None
+            if values is None:
+                schema = portal_schemas[portal_name] = RecordSchema(row)
+                values = [row[key] for key in schema]
+
+            if conversion is not None:
+                values = conversion.convert_row(schema, values)
+            yield Record(schema, values, in_portal=True)
@@ -0,0 +1,233 @@
+u"""SessionPool class for sharing a bounded set of Data API sessions"""
+from __future__ import absolute_import
+import collections
+import threading
+import time
+
+from contextlib import contextmanager
+from .const import FMSErrorCode
+from .exceptions import FMRestException, FileMakerError
+
+class SessionPool(object):
+    u"""A bounded pool of logged-in Server instances, each holding its own Data API token.
+
+    FMS processes the requests of one session one after another and limits the number of
+    concurrent sessions. The pool hands out warm sessions to concurrent callers, so that they
+    can run in parallel without a login per request:
+
+        pool = fmrest.SessionPool(fms, size=4)
+        with pool.session() as server:
+            server.get_record(1)
+        pool.close()
+
+    Sessions are created lazily (by logging in a copy of the given server) up to size.
+    Sessions that returned error 952 (invalid token) are replaced on next use and sessions
+    that were idle for longer than max_idle are logged out before FMS times them out.
+    """
+
+    def __init__(self, server, size = 4,
+                 max_idle = 14 * 60,
+                 timeout = None):
+        u"""Initialize the SessionPool class.
+
+        Parameters
+        ----------
+        server : Server
+            Server instance used as template for the sessions. The server itself is not logged in,
+            the sessions are copies that share its configuration and connection pool.
+        size : int, optional
+            Maximum number of sessions (and thereby FMS session slots) used at the same time.
+            Defaults to 4.
+        max_idle : int or float, optional
+            Seconds after which an unused session is logged out. Should be lower than the session
+            timeout of your FMS (15 minutes by default). Defaults to 14 minutes.
+        timeout : int or float, optional
+            Seconds to wait in checkout() for a session to become available before raising
+            FMRestException. Defaults to None (wait forever).
+        """
+        if size < 1:
+            raise ValueError(u'size must be greater than 0.')
+
+        self.size = size
+        self.max_idle = max_idle
+        self.timeout = timeout
+
+        self._server = server
+        self._idle = collections.deque() # (server, last_used) tuples, most recent last
+        self._created = 0
+        self._condition = threading.Condition()
+        self._reaper = None
+        self._reaper_stop = threading.Event()
+        self._closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_traceback):
+        self.close()
+
+    def __repr__(self):
+        return u'<SessionPool size={} sessions={} idle={}>'.format(
+            self.size, self._created, len(self._idle)
+        )
+
+    @property
+    def in_use(self):
+        u"""Returns the number of sessions that are currently checked out."""
+        return self._created - len(self._idle)
+
+    def checkout(self, timeout = None):
+        u"""Returns a logged-in Server instance for exclusive use until it is passed to checkin().
+
+        Parameters
+        ----------
+        timeout : int or float, optional
+            Overrides the timeout of the pool for this call.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        deadline = None if timeout is None else time.time() + timeout
+        expired = []
+        server = None
+
+        with self._condition:
+            if self._closed:
+                raise FMRestException(u'SessionPool is closed.')
+
+            while server is None:
+                while self._idle:
+                    candidate, last_used = self._idle.pop()
+                    if time.time() - last_used < self.max_idle:
+                        server = candidate
+                        break
+                    expired.append(candidate)
+                    self._created -= 1
+
+                if server is not None:
+                    break
+
+                if self._created < self.size:
+                    self._created += 1
+                    break
+
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    raise FMRestException(
+                        u'No session available after waiting {} seconds.'.format(timeout))
+                self._condition.wait(remaining)
+
+        self._logout(expired)
+
+        if server is None:
+            server = self._server._clone()
+            try:
+                server.login()
+            except Exception:
+                self._discard()
+                raise
+
+        return server
+
+    def checkin(self, server, discard = False):
+        u"""Returns a Server instance obtained from checkout() to the pool.
+
+        Parameters
+        ----------
+        server : Server
+            Server instance returned by checkout()
+        discard : bool, optional
+            If True, the session is logged out and replaced by a new one on a later checkout.
+            Sessions whose last call (in the current thread) failed with an invalid token error
+            are always discarded.
+        """
+        if server.last_error == FMSErrorCode.INVALID_DAPI_TOKEN.value:
+            server._token = None
+            discard = True
+
+        if discard or self._closed or not server._token:
+            self._logout([server])
+            self._discard()
+            return
+
+        with self._condition:
+            self._idle.append((server, time.time()))
+            self._condition.notify()
+
+    @contextmanager
+    def session(self, timeout = None):
+        u"""Context manager checking out a session and checking it back in on exit.
+
+            with pool.session() as server:
+                server.find([{'name': 'David'}])
+        """
+        server = self.checkout(timeout)
+        discard = False
+        try:
+            yield server
+        except FileMakerError, ex:
+            discard = ex.error_code == FMSErrorCode.INVALID_DAPI_TOKEN.value
+            raise
+        finally:
+            self.checkin(server, discard)
+
+    def reap(self):
+        u"""Logs out all sessions that were idle for longer than max_idle. Returns their count."""
+        now = time.time()
+        with self._condition:
+            expired = [server for server, last_used in self._idle if now - last_used >= self.max_idle]
+            self._idle = collections.deque(
+                (server, last_used) for server, last_used in self._idle
+                if now - last_used < self.max_idle
+            )
+            self._created -= len(expired)
+            self._condition.notify_all()
+
+        self._logout(expired)
+        return len(expired)
+
+    def start_reaper(self, interval = 60):
+        u"""Starts a background thread calling reap() every interval seconds."""
+        if self._reaper is not None:
+            return
+
+        def _run():
+            while not self._reaper_stop.wait(interval):
+                self.reap()
+
+        self._reaper_stop.clear()
+        self._reaper = threading.Thread(target=_run)
+        self._reaper.daemon = True
+        self._reaper.start()
+
+    def close(self):
+        u"""Stops the reaper and logs out all idle sessions.
+
+        Sessions that are checked out are logged out when they are checked in.
+        """
+        if self._reaper is not None:
+            self._reaper_stop.set()
+            self._reaper = None
+
+        with self._condition:
+            self._closed = True
+            idle = [server for server, _ in self._idle]
+            self._idle.clear()
+            self._created -= len(idle)
+            self._condition.notify_all()
+
+        self._logout(idle)
+
+    def _discard(self):
+        u"""Frees the slot of a session that is not returned to the pool."""
+        with self._condition:
+            self._created -= 1
+            self._condition.notify()
+
+    def _logout(self, servers):
+        u"""Logs out the given servers, ignoring errors of already invalid sessions."""
+        for server in servers:
+            if not server._token:
+                continue
+            try:
+                server.logout()
+            except FMRestException:
+                pass
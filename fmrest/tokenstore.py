@@ -0,0 +1,143 @@
+u"""FileTokenStore class for re-using Data API tokens across processes"""
+from __future__ import with_statement
+from __future__ import absolute_import
+import errno
+import hashlib
+import json
+import os
+import time
+
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    _has_fcntl = False
+else:
+    _has_fcntl = True
+
+class FileTokenStore(object):
+    u"""A JSON file holding Data API tokens and the time they were last used.
+
+    Pass an instance to Server(token_store=...) to let short-lived processes re-use a token that
+    an earlier process obtained, instead of logging in (and out) every time:
+
+        store = fmrest.FileTokenStore('~/.fmrest_tokens')
+        with fmrest.Server(..., token_store=store) as fms:
+            fms.login() # only hits FMS if there is no token that is likely still valid
+            fms.get_record(1)
+        # no logout on exit, the token is kept in the store for the next process
+
+    Tokens are stored by a hash of url, database, user and data sources. A token is considered
+    valid as long as it was used within session_timeout minus margin seconds. The file is
+    locked while being read or written (on platforms supporting fcntl) and only readable by
+    its owner.
+    """
+
+    def __init__(self, path, session_timeout = 15 * 60,
+                 margin = 60):
+        u"""Initialize the FileTokenStore class.
+
+        Parameters
+        ----------
+        path : str
+            Path of the token file. Is created if it doesn't exist.
+        session_timeout : int or float, optional
+            Idle time in seconds after which FMS invalidates a session. Defaults to 15 minutes,
+            which is the FMS default.
+        margin : int or float, optional
+            Seconds subtracted from session_timeout to account for clock differences and the time
+            until the token is used. Defaults to 60.
+        """
+        self.path = os.path.expanduser(path)
+        self.session_timeout = session_timeout
+        self.margin = margin
+
+    def __repr__(self):
+        return u'<FileTokenStore path={}>'.format(self.path)
+
+    @staticmethod
+    def make_key(url, database,
+                 user, data_sources = None):
+        u"""Returns the key a token is stored by for the given connection details."""
+        identity = json.dumps([url, database, user, data_sources or []], sort_keys=True)
+        return hashlib.sha256(identity.encode(u'utf-8')).hexdigest()
+
+    def get(self, key):
+        u"""Returns a tuple of token and last used timestamp stored for key, or None if there is no
+        token or it has likely expired."""
+        with self._locked():
+            entry = self._read().get(key)
+
+        if not entry:
+            return None
+        if time.time() - entry[u'last_used'] >= self.session_timeout - self.margin:
+            return None
+        return entry[u'token'], entry[u'last_used']
+
+    def set(self, key, token,
+            last_used = None):
+        u"""Stores token for key.
+
+        Parameters
+        ----------
+        key : str
+            Key as returned by make_key()
+        token : str
+            Data API session token
+        last_used : float, optional
+            Timestamp of the last call made with the token. Defaults to now.
+        """
+        with self._locked():
+            tokens = self._read()
+            tokens[key] = {
+                u'token': token,
+                u'last_used': time.time() if last_used is None else last_used
+            }
+            self._write(tokens)
+
+    def delete(self, key):
+        u"""Removes the token stored for key (if any)."""
+        with self._locked():
+            tokens = self._read()
+            if tokens.pop(key, None) is not None:
+                self._write(tokens)
+
+    @contextmanager
+    def _locked(self):
+        u"""Holds an exclusive lock on a lock file next to the token file."""
+        if not _has_fcntl:
+            yield
+            return
+
+        fd = os.open(self.path + u'.lock', os.O_RDWR | os.O_CREAT, 0600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+    def _read(self):
+        u"""Returns the dict of stored tokens. Unreadable files are treated as empty."""
+        try:
+            with open(self.path, u'r') as file_:
+                tokens = json.load(file_)
+        except IOError, ex:
+            if ex.errno != errno.ENOENT:
+                raise
+            return {}
+        except ValueError:
+            return {}
+        return tokens if isinstance(tokens, dict) else {}
+
+    def _write(self, tokens):
+        u"""Atomically replaces the token file with the given dict."""
+        tmp_path = self.path + u'.tmp'
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0600)
+        with os.fdopen(fd, u'w') as file_:
+            json.dump(tokens, file_)
+
+        if os.name == u'nt' and os.path.exists(self.path):
+            os.remove(self.path)
+        os.rename(tmp_path, self.path)
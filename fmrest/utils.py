@@ -1,18 +1,153 @@
 u"""Utility functions for fmrest"""
 from __future__ import absolute_import
+import json
+import sys
+import threading
+import Queue
+import collections
+import datetime
+import re
+from decimal import Decimal
+from multiprocessing.pool import ThreadPool
 import requests
-from .exceptions import RequestException
+from requests.adapters import HTTPAdapter
+from .exceptions import RequestException, BadJSON
 from .const import TIMEOUT
 from itertools import imap
 
+try:
+    import ijson
+    from ijson.common import ObjectBuilder
+except ImportError:
+    _has_ijson = False
+else:
+    _has_ijson = True
+
+
+class JSONCodec(object):
+    u"""A pair of functions to encode request data to and decode responses from JSON."""
+
+    def __init__(self, name, dumps, loads):
+        u"""Initialize the JSONCodec class.
+
+        Parameters
+        ----------
+        name : str
+            Name of the codec, e.g. the name of the underlying library
+        dumps : function
+            Takes a Python object and returns a JSON string
+        loads : function
+            Takes a JSON string (or bytes) and returns a Python object. Must raise ValueError
+            (or a subclass) for invalid JSON.
+        """
+        self.name = name
+        self.dumps = dumps
+        self.loads = loads
+
+    def __repr__(self):
+        return u'<JSONCodec name={}>'.format(self.name)
+
+STDLIB_JSON = JSONCodec(u'json', json.dumps, json.loads)
+
+_PRECISE_FLOATS = u'[0.1, 1.0000000000000002, 2.2250738585072014e-308]'
+
+def _detect_json_codec():
+    u"""Returns a codec for the fastest installed JSON library, falling back to json.
+
+    ujson is only used if it parses floats exactly like json does: with precise_float=True on
+    versions accepting it (1.x), as is on later versions (which dropped the argument and are
+    always precise). Any version failing the check is skipped.
+    """
+    try:
+        import orjson
+    except ImportError:
+        pass
+    else:
+        return JSONCodec(u'orjson', lambda obj: orjson.dumps(obj).decode(u'utf-8'), orjson.loads)
+
+    try:
+        import ujson
+    except ImportError:
+        pass
+    else:
+        try:
+            # ujson 1.x trades float precision for speed unless told otherwise
+            ujson.loads(u'1.5', precise_float=True)
+        except TypeError:
+            loads = ujson.loads
+        else:
+            loads = lambda s: ujson.loads(s, precise_float=True)
+
+        # never lose precision silently, whatever the version does
+        if loads(_PRECISE_FLOATS) == json.loads(_PRECISE_FLOATS):
+            return JSONCodec(u'ujson', ujson.dumps, loads)
+
+    return STDLIB_JSON
+
+_json_codec = _detect_json_codec()
+
+def get_json_codec():
+    u"""Returns the JSON codec used by Server instances that don't have their own json_codec."""
+    return _json_codec
+
+def set_json_codec(codec):
+    u"""Sets the JSON codec used by Server instances that don't have their own json_codec.
+
+    By default, orjson or ujson (if it parses floats precisely) are used if installed, otherwise
+    the json module.
+
+    Parameters
+    ----------
+    codec : JSONCodec or module
+        Object with dumps() and loads() functions, e.g. JSONCodec(...) or the json module.
+        Pass None to restore the automatically detected codec.
+    """
+    global _json_codec
+    _json_codec = _detect_json_codec() if codec is None else codec
 
 def request(*args, **kwargs):
-    u"""Wrapper around requests library request call"""
+    u"""Wrapper around requests library request call
+
+    Pass a requests.Session instance as keyword argument session to send the request through
+    the session's connection pool. Without a session, requests.request is used, which opens
+    a new connection for every call.
+    """
+    session = kwargs.pop(u'session', None)
     try:
+        if session is not None:
+            return session.request(*args, timeout=TIMEOUT, **kwargs)
         return requests.request(*args, timeout=TIMEOUT, **kwargs)
     except Exception, ex:
         raise RequestException(ex, args, kwargs)
 
+def build_session(pool_connections = 10, pool_maxsize = 10,
+                  keep_alive = True):
+    u"""Returns a requests.Session with a sized connection pool mounted for https.
+
+    Connections (and thereby their TLS sessions) are kept open and re-used for subsequent
+    requests to the same host, so that only the first call has to pay for the TCP and TLS
+    handshake.
+
+    Parameters
+    -----------
+    pool_connections : int
+        Number of hosts to keep a connection pool for
+    pool_maxsize : int
+        Maximum number of connections kept open per host. Should be at least the number of
+        threads sharing the session.
+    keep_alive : bool
+        If False, a "Connection: close" header is sent, so that connections are not re-used.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+    session.mount(u'https://', adapter)
+    session.mount(u'http://', adapter)
+
+    if not keep_alive:
+        session.headers[u'Connection'] = u'close'
+
+    return session
+
 def build_portal_params(portals, names_as_string = False):
     u"""Takes a list of dicts and returns a dict in a format as FMServer expects it.
 
@@ -109,6 +244,194 @@ def cache_generator(iterator, cache):
 
     cache[1] = True # all values have been cached
 
+def prefetch_generator(iterator, lookahead = 1):
+    u"""Consumes iterator on a background thread and yields its values.
+
+    While the caller processes one value, the following values are already produced by the
+    worker thread. At most lookahead values are buffered, so the worker is paused when the
+    consumer falls behind. Exceptions raised by the iterator are re-raised in the consumer.
+
+    Parameters
+    ----------
+    iterator : generator
+        Generator to consume in the background, e.g. one producing pages of records
+    lookahead : int
+        Maximum number of values produced ahead of the consumer
+    """
+    buffer_ = Queue.Queue(maxsize=max(lookahead, 1))
+    stop = threading.Event()
+    exhausted = object()
+
+    def _put(item):
+        # give up when the consumer went away, so that the worker thread can finish
+        while not stop.is_set():
+            try:
+                buffer_.put(item, timeout=0.1)
+                return True
+            except Queue.Full:
+                pass
+        return False
+
+    def _produce():
+        try:
+            for value in iterator:
+                if not _put((value, None)):
+                    return
+        except Exception:
+            _put((None, sys.exc_info()))
+            return
+        _put((exhausted, None))
+
+    worker = threading.Thread(target=_produce)
+    worker.daemon = True
+    worker.start()
+
+    try:
+        while True:
+            value, exc_info = buffer_.get()
+            if exc_info is not None:
+                raise exc_info[0], exc_info[1], exc_info[2]
+            if value is exhausted:
+                return
+            yield value
+    finally:
+        stop.set()
+
+def concurrent_map(func, iterable, concurrency = 4, ordered = True):
+    u"""Calls func for every value of iterable on a pool of worker threads and yields the results.
+
+    Values are taken from iterable lazily, at most 2 * concurrency calls are pending or
+    buffered at any time. Exceptions raised by func are re-raised in the consumer.
+
+    Parameters
+    ----------
+    func : function
+        Function taking one value of iterable
+    iterable : iterable
+        Values to call func with
+    concurrency : int
+        Number of worker threads
+    ordered : bool
+        If True, results are yielded in the order of iterable. If False, results are yielded as
+        soon as they are available.
+    """
+    pool = ThreadPool(concurrency)
+    window = 2 * concurrency
+    pending = collections.deque()
+    completed = Queue.Queue()
+
+    def _call(value):
+        try:
+            result = (func(value), None)
+        except Exception:
+            result = (None, sys.exc_info())
+        if not ordered:
+            completed.put(result)
+        return result
+
+    def _next_result():
+        if ordered:
+            result, exc_info = pending.popleft().get()
+        else:
+            result, exc_info = completed.get()
+        if exc_info is not None:
+            raise exc_info[0], exc_info[1], exc_info[2]
+        return result
+
+    in_flight = 0
+    try:
+        for value in iterable:
+            async_result = pool.apply_async(_call, (value,))
+            if ordered:
+                pending.append(async_result)
+            in_flight += 1
+            if in_flight >= window:
+                in_flight -= 1
+                yield _next_result()
+
+        while in_flight:
+            in_flight -= 1
+            yield _next_result()
+    finally:
+        pool.terminate()
+
+def parse_streamed_response(response):
+    u"""Incrementally parses the JSON body of a streamed Data API response. Requires ijson.
+
+    The body is read from the socket up to the start of the response.data array and returned as
+    dict, with response.data being a generator instead of a list. The generator parses and
+    yields one record dict at a time, so that the full list of records is never held in memory.
+    Anything following the data array (usually the messages) is added to the returned dict
+    once the generator is exhausted.
+
+    Parameters
+    ----------
+    response : requests.Response
+        Response of a request made with stream=True
+    """
+    if not _has_ijson:
+        raise ImportError(
+            u'Please install ijson for streaming responses. '
+            u'You can do so with: pip install ijson'
+        )
+
+    response.raw.decode_content = True
+    events = _json_events(ijson.parse(response.raw), response)
+    builder = ObjectBuilder()
+
+    for prefix, event, value in events:
+        builder.event(event, value)
+        if prefix == u'response.data' and event == u'start_array':
+            break
+    else:
+        response.close()
+        return builder.value
+
+    def records():
+        try:
+            record_builder = None
+            for prefix, event, value in events:
+                if prefix == u'response.data.item':
+                    if event == u'start_map':
+                        record_builder = ObjectBuilder()
+                    record_builder.event(event, value)
+                    if event == u'end_map':
+                        yield record_builder.value
+                        record_builder = None
+                elif record_builder is not None:
+                    record_builder.event(event, value)
+                else:
+                    # end of data array and everything after it
+                    builder.event(event, value)
+        finally:
+            response.close()
+
+    data = builder.value[u'response']
+    data[u'data'] = records()
+    return builder.value
+
+def _json_events(events, response):
+    u"""Passes through ijson parser events, turning Decimals into floats (as json does) and
+    parser errors into BadJSON."""
+    try:
+        for prefix, event, value in events:
+            if isinstance(value, Decimal):
+                value = float(value)
+            yield prefix, event, value
+    except ijson.JSONError, ex:
+        raise BadJSON(ex, response)
+
+def import_pandas():
+    u"""Returns the pandas module or raises an exception explaining how to install it."""
+    try:
+        import pandas as pd
+    except ImportError:
+        raise Exception(
+            u"You need to have Pandas installed to use this feature. "
+            u"You can install it like this: 'pip install pandas'"
+        )
+    return pd
+
 def filename_from_url(url):
     u"""Returns filename from given remote container url."""
 
@@ -121,7 +444,70 @@ def filename_from_url(url):
 
     return filename
 
-def convert_string_type(value):
+_DATE_ORDERS = {
+    # positions of year, month and day in the matched groups
+    u'MDY': (2, 0, 1),
+    u'DMY': (2, 1, 0),
+    u'YMD': (0, 1, 2)
+}
+_DATE_PATTERNS = {
+    u'MDY': re.compile(
+        ur'^(\d{1,2})/(\d{1,2})/(\d{4})(?: (\d{1,2}):(\d{1,2}):(\d{1,2})(?:\.(\d{1,6}))?)?$'),
+    u'DMY': re.compile(
+        ur'^(\d{1,2})[/.-](\d{1,2})[/.-](\d{4})(?: (\d{1,2}):(\d{1,2}):(\d{1,2})(?:\.(\d{1,6}))?)?$'),
+    u'YMD': re.compile(
+        ur'^(\d{4})[/.-](\d{1,2})[/.-](\d{1,2})(?:[ T](\d{1,2}):(\d{1,2}):(\d{1,2})(?:\.(\d{1,6}))?)?$')
+}
+_TIME_PATTERN = re.compile(ur'^(\d+):(\d{1,2})(?::(\d{1,2})(?:\.(\d{1,6}))?)?$')
+
+def _microseconds(fraction):
+    u"""Returns microseconds for the digits after the decimal point of a seconds value."""
+    return int(fraction.ljust(6, u'0')) if fraction else 0
+
+def parse_datetime(value, date_order = u'MDY'):
+    u"""Parses a FileMaker date (e.g. 12/24/2016) or timestamp (e.g. 12/24/2016 20:45:30) into a
+    datetime. Raises ValueError for other values.
+
+    Parameters
+    ----------
+    value : str
+        Value as returned by the Data API
+    date_order : str, optional
+        Order of month, day and year in dates: 'MDY' (default, as returned by the Data API),
+        'DMY' (e.g. 24.12.2016, for files returning dates in a day-first locale) or 'YMD'
+        (ISO 8601, e.g. 2016-12-24).
+    """
+    try:
+        pattern = _DATE_PATTERNS[date_order]
+    except KeyError:
+        raise ValueError(u'Unknown date order {}.'.format(date_order))
+
+    match = pattern.match(value)
+    if match is None:
+        raise ValueError(u'{} is not a FileMaker date or timestamp.'.format(value))
+
+    groups = match.groups()
+    year, month, day = _DATE_ORDERS[date_order]
+    if groups[3] is None:
+        return datetime.datetime(int(groups[year]), int(groups[month]), int(groups[day]))
+
+    return datetime.datetime(int(groups[year]), int(groups[month]), int(groups[day]),
+                             int(groups[3]), int(groups[4]), int(groups[5]),
+                             _microseconds(groups[6]))
+
+def parse_duration(value):
+    u"""Parses a FileMaker time (e.g. 20:45:30) into a timedelta. Hours may exceed 24 (e.g.
+    48:61:01 for 2 days, 1 hour, 1 minute and 1 second). Raises ValueError for other values."""
+    match = _TIME_PATTERN.match(value)
+    if match is None:
+        raise ValueError(u'{} is not a FileMaker time.'.format(value))
+
+    hours, minutes, seconds, fraction = match.groups()
+    return datetime.timedelta(hours=int(hours), minutes=int(minutes),
+                              seconds=int(seconds) if seconds else 0,
+                              microseconds=_microseconds(fraction))
+
+def convert_string_type(value, date_order = u'MDY'):
     u"""Quick and dirty way to convert strings into their (guessed) original type.
 
     FileMaker Data API only returns strings. Hopefully, we can throw this function away as
@@ -129,6 +515,9 @@ def convert_string_type(value):
 
     Not used when running fmrest with default parameters as returned values can
     be unexpected.
+
+    Dates and timestamps are only recognized in the format FileMaker returns them in (see
+    parse_datetime() for date_order), times also with more than 24 hours (see parse_duration()).
     """
 
     # int and float
@@ -138,28 +527,17 @@ def convert_string_type(value):
         except ValueError:
             pass
 
-    # datetime / timedelta
+    # datetime
     try:
-        from dateutil.parser import parse
-        from datetime import timedelta
-        parsed = parse(value)
-        if u'/' not in value:
-            #assume time, as FM always returns / for date and ts, and parse didn't raise ValueError
-            parsed = timedelta(hours=parsed.hour, minutes=parsed.minute, seconds=parsed.second)
-        return parsed
+        return parse_datetime(value, date_order)
     except ValueError:
         pass
 
-    # timedelta (above try will fail for >24h)
-    time_split = value.split(u':')
-    if len(time_split) == 3:
-        try:
-            hours = int(time_split[0])
-            minutes = int(time_split[1])
-            seconds = int(time_split[2])
-            return timedelta(hours=hours, minutes=minutes, seconds=seconds)
-        except ValueError:
-            pass
+    # timedelta
+    try:
+        return parse_duration(value)
+    except ValueError:
+        pass
 
     # fall back to string
     return value
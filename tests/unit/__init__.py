@@ -0,0 +1,7 @@
+from __future__ import absolute_import
+from fmrest.utils import set_json_codec, STDLIB_JSON
+
+# mocked responses in the unit tests provide their body via Response.json(), which is only
+# used with the json module codec (and not with ujson or orjson, if installed). Decoding
+# Response.content with other codecs is covered by the json codec tests in test_server.
+set_json_codec(STDLIB_JSON)
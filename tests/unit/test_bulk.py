@@ -0,0 +1,216 @@
+u"""Bulk operations test suite"""
+from __future__ import with_statement
+from __future__ import absolute_import
+import unittest
+import json
+import mock
+import requests
+import fmrest
+from fmrest.record import Record
+from fmrest.exceptions import RequestException
+
+URL = u'https://111.111.111.111'
+ACCOUNT_NAME = u'demo'
+ACCOUNT_PASS = u'demo'
+DATABASE = u'Demo'
+LAYOUT = u'Demo'
+
+def _mock_find_response(record_ids, found_count):
+    u"""Returns a mocked find response for the given record ids."""
+    mock_response = mock.Mock()
+    mock_response.json.return_value = {
+        u'messages': [{u'code': u'0'}],
+        u'response': {
+            u'dataInfo': {u'foundCount': found_count, u'returnedCount': len(record_ids)},
+            u'data': [{u'fieldData': {}, u'portalData': {}, u'recordId': unicode(record_id),
+                       u'modId': u'1'} for record_id in record_ids]
+        }
+    }
+    return mock_response
+
+class UnitOfWorkTestCase(unittest.TestCase):
+    u"""UnitOfWork test suite.
+
+    Only put mocked requests here that don't need an actual FileMaker Server.
+    """
+    def setUp(self):
+
+        # disable urlib warnings as we are testing with non verified certs
+        requests.packages.urllib3.disable_warnings()
+
+        self._fms = fmrest.Server(url=URL,
+                                  user=ACCOUNT_NAME,
+                                  password=ACCOUNT_PASS,
+                                  database=DATABASE,
+                                  layout=LAYOUT
+                                 )
+        self._requests = []
+
+    def _respond(self, method, url, **kwargs):
+        u"""Answers edits with a conflict if modId 1 is sent, success otherwise."""
+        data = json.loads(kwargs[u'data'])
+        self._requests.append((url.split(u'/')[-1], data))
+
+        mock_response = mock.Mock()
+        if data.get(u'modId') == u'1':
+            mock_response.json.return_value = {
+                u'messages': [{u'code': u'306', u'message': u'Record modification id does not match'}],
+                u'response': {}}
+        else:
+            mock_response.json.return_value = {u'messages': [{u'code': u'0'}],
+                                               u'response': {u'modId': u'8'}}
+        return mock_response
+
+    @mock.patch.object(requests.Session, u'request')
+    def test_merged_edits(self, mock_request):
+        u"""Test that repeated edits of a record are sent as one request on commit."""
+        mock_request.side_effect = self._respond
+
+        with self._fms.unit_of_work() as uow:
+            uow.edit_record(1, {u'name': u'David'})
+            uow.edit_record(2, {u'name': u'Caspar'})
+            uow.edit_record(1, {u'drink': u'Coffee', u'name': u'Dave'})
+            self.assertEqual(uow.pending, 2)
+            self.assertEqual(mock_request.call_count, 0)
+
+        self.assertEqual(sorted(self._requests), [
+            (u'1', {u'fieldData': {u'name': u'Dave', u'drink': u'Coffee'}}),
+            (u'2', {u'fieldData': {u'name': u'Caspar'}})
+        ])
+        self.assertEqual(uow.results[1].mod_id, 8)
+        self.assertEqual(uow.pending, 0)
+
+    @mock.patch.object(requests.Session, u'request')
+    def test_conflicts(self, mock_request):
+        u"""Test that mod id mismatches are reported as conflicts without stopping the commit."""
+        mock_request.side_effect = self._respond
+        stale = Record([u'name', u'recordId', u'modId'], [u'David', u'1', u'1'])
+        fresh = Record([u'name', u'recordId', u'modId'], [u'Caspar', u'2', u'5'])
+        stale.name = u'Dave'
+        fresh.name = u'Cas'
+
+        uow = self._fms.unit_of_work(validate_mod_id=True)
+        uow.edit(stale)
+        uow.edit(fresh)
+        results = uow.commit()
+
+        self.assertEqual(uow.conflicts, [1])
+        self.assertTrue(results[2].ok)
+        self.assertEqual(list(uow.failed), [1])
+
+    @mock.patch.object(requests.Session, u'request')
+    def test_commit_errors(self, mock_request):
+        u"""Test that request errors are reported per record and an interrupted commit keeps
+        the finished writes and leaves only the others pending."""
+
+        def respond(method, url, **kwargs):
+            record_id = url.split(u'/')[-1]
+            if record_id == u'2':
+                raise requests.exceptions.ConnectionError(u'Connection reset')
+            mock_response = mock.Mock()
+            mod_id = u'invalid' if record_id == u'3' else u'8'
+            mock_response.json.return_value = {u'messages': [{u'code': u'0'}],
+                                               u'response': {u'modId': mod_id}}
+            return mock_response
+
+        mock_request.side_effect = respond
+        uow = self._fms.unit_of_work(concurrency=1)
+        for record_id in (1, 2, 3, 4):
+            uow.edit_record(record_id, {u'name': u'David'})
+
+        with self.assertRaises(ValueError):
+            uow.commit()
+
+        self.assertEqual(list(uow.results), [1, 2])
+        self.assertIsInstance(uow.failed[2], RequestException)
+        self.assertEqual(uow.conflicts, [])
+        self.assertEqual(list(uow._pending), [3, 4])
+
+    @mock.patch.object(requests.Session, u'request')
+    def test_discard_on_error(self, mock_request):
+        u"""Test that edits are not written when the with block raises."""
+        with self.assertRaises(ValueError):
+            with self._fms.unit_of_work() as uow:
+                uow.edit_record(1, {u'name': u'David'})
+                raise ValueError
+
+        self.assertEqual(mock_request.call_count, 0)
+        self.assertEqual(uow.pending, 0)
+
+class DeleteUpdateWhereTestCase(unittest.TestCase):
+    u"""delete_where() and update_where() test suite.
+
+    Only put mocked requests here that don't need an actual FileMaker Server.
+    """
+    def setUp(self):
+
+        # disable urlib warnings as we are testing with non verified certs
+        requests.packages.urllib3.disable_warnings()
+
+        self._fms = fmrest.Server(url=URL,
+                                  user=ACCOUNT_NAME,
+                                  password=ACCOUNT_PASS,
+                                  database=DATABASE,
+                                  layout=LAYOUT
+                                 )
+
+    @mock.patch.object(requests.Session, u'request')
+    def test_delete_where(self, mock_request):
+        u"""Test that all matching records are deleted and failures are counted."""
+        deleted = []
+
+        def respond(method, url, **kwargs):
+            if method == u'POST':
+                offset = int(json.loads(kwargs[u'data'])[u'offset'])
+                return _mock_find_response([[1, 2], [3]][offset // 2], 3)
+
+            record_id = int(url.split(u'/')[-1])
+            deleted.append(record_id)
+            mock_response = mock.Mock()
+            code = u'200' if record_id == 2 else u'0'
+            mock_response.json.return_value = {u'messages': [{u'code': code}], u'response': {}}
+            return mock_response
+
+        mock_request.side_effect = respond
+        updates = []
+
+        counters = self._fms.delete_where([{u'name': u'David'}], page_size=2,
+                                          progress=lambda p: updates.append(p.processed))
+
+        self.assertEqual(sorted(deleted), [1, 2, 3])
+        self.assertEqual((counters.matched, counters.succeeded, counters.failed), (3, 2, 1))
+        self.assertEqual(list(counters.errors), [2])
+        self.assertEqual(updates, [1, 2, 3])
+        self.assertTrue(counters.is_complete)
+
+    @mock.patch.object(requests.Session, u'request')
+    def test_delete_where_request_error(self, mock_request):
+        u"""Test that a failed request is counted as failure without stopping the others."""
+
+        def respond(method, url, **kwargs):
+            if method == u'POST':
+                return _mock_find_response([1, 2, 3], 3)
+            if url.endswith(u'/2'):
+                raise requests.exceptions.ConnectionError(u'Connection reset')
+            mock_response = mock.Mock()
+            mock_response.json.return_value = {u'messages': [{u'code': u'0'}], u'response': {}}
+            return mock_response
+
+        mock_request.side_effect = respond
+
+        counters = self._fms.delete_where([{u'name': u'David'}])
+
+        self.assertEqual((counters.processed, counters.succeeded, counters.failed), (3, 2, 1))
+        self.assertIsInstance(counters.errors[2], RequestException)
+
+    @mock.patch.object(requests.Session, u'request')
+    def test_update_where_dry_run(self, mock_request):
+        u"""Test that a dry run only reports the match count of a single find request."""
+        mock_request.return_value = _mock_find_response([1], 42)
+
+        counters = self._fms.update_where([{u'name': u'David'}], {u'drink': u'Tea'}, dry_run=True)
+
+        self.assertEqual(counters.matched, 42)
+        self.assertEqual(counters.processed, 0)
+        self.assertEqual(mock_request.call_count, 1)
+        self.assertEqual(json.loads(mock_request.call_args[1][u'data'])[u'limit'], u'1')
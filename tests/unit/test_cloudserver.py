@@ -1,6 +1,9 @@
 u"""CloudServer test suite"""
 from __future__ import with_statement
 from __future__ import absolute_import
+import os
+import shutil
+import tempfile
 import unittest
 import json
 import mock
@@ -8,6 +11,7 @@ import requests
 import pycognito
 import fmrest
 from fmrest.exceptions import FileMakerError, BadJSON
+from fmrest.tokenstore import FileTokenStore
 
 URL = u'https://111.111.111.111'
 ACCOUNT_NAME = u'demo'
@@ -51,7 +55,7 @@ class CloudServerTestCase(unittest.TestCase):
                                        layout=LAYOUT
                                        )
 
-    @mock.patch.object(requests, u'request')
+    @mock.patch.object(requests.Session, u'request')
     @mock.patch(u'pycognito.aws_srp.AWSSRP.authenticate_user', _mock_authenticate_user)
     @mock.patch(u'pycognito.Cognito.verify_token', _mock_verify_tokens)
     def test_login(self, mock_request):
@@ -70,7 +74,7 @@ class CloudServerTestCase(unittest.TestCase):
         # After login, token should be a string
         self.assertIsInstance(self._fms._token, unicode)
 
-    @mock.patch.object(requests, u'request')
+    @mock.patch.object(requests.Session, u'request')
     @mock.patch(u'pycognito.aws_srp.AWSSRP.authenticate_user', _mock_authenticate_user)
     @mock.patch(u'pycognito.Cognito.verify_token', _mock_verify_tokens)
     def test_last_error(self, mock_request):
@@ -90,7 +94,7 @@ class CloudServerTestCase(unittest.TestCase):
         # Assert last error to be error from mocked response
         self.assertEqual(self._fms.last_error, 212)
 
-    @mock.patch.object(requests, u'request')
+    @mock.patch.object(requests.Session, u'request')
     @mock.patch(u'pycognito.aws_srp.AWSSRP.authenticate_user', _mock_authenticate_user)
     @mock.patch(u'pycognito.Cognito.verify_token', _mock_verify_tokens)
     def test_bad_json_response(self, mock_request):
@@ -102,6 +106,58 @@ class CloudServerTestCase(unittest.TestCase):
         with self.assertRaises(BadJSON):
             self._fms.login()
 
+    @mock.patch.object(requests.Session, u'request')
+    @mock.patch(u'pycognito.aws_srp.AWSSRP.authenticate_user', _mock_authenticate_user)
+    @mock.patch(u'pycognito.Cognito.verify_token', _mock_verify_tokens)
+    def test_token_store(self, mock_request):
+        u"""Test that the token is stored on login and re-used by a second instance."""
+        directory = tempfile.mkdtemp()
+        try:
+            store = FileTokenStore(os.path.join(directory, u'tokens'))
+            mock_response = mock.Mock()
+            mock_response.json.return_value = {u'response': {u'token': u'dummytoken'},
+                                               u'messages': [{u'code': u'0', u'message': u'OK'}]}
+            mock_request.return_value = mock_response
+
+            def cloud_server():
+                return fmrest.CloudServer(url=URL, user=ACCOUNT_NAME, password=ACCOUNT_PASS,
+                                          database=DATABASE, layout=LAYOUT, token_store=store)
+
+            with cloud_server() as fms:
+                fms.login()
+                self.assertIsNotNone(fms.token_age)
+            self.assertEqual(mock_request.call_count, 1) # no logout, the token is kept
+
+            with cloud_server() as fms:
+                self.assertEqual(fms.login(), u'dummytoken')
+                self.assertTrue(fms._token_from_store)
+            self.assertEqual(mock_request.call_count, 1)
+        finally:
+            shutil.rmtree(directory)
+
+    @mock.patch.object(requests.Session, u'request')
+    @mock.patch(u'pycognito.aws_srp.AWSSRP.authenticate_user', _mock_authenticate_user)
+    @mock.patch(u'pycognito.Cognito.verify_token', _mock_verify_tokens)
+    def test_fmid_header_per_request(self, mock_request):
+        u"""Test that the FMID token is only sent with the login request, so that requests of
+        other threads keep using the current bearer token during a re-login."""
+        self._fms._token = u'old'
+        other_headers = []
+
+        def respond(**kwargs):
+            other_headers.append(self._fms._build_headers()[u'Authorization'])
+            mock_response = mock.Mock()
+            mock_response.json.return_value = {u'response': {u'token': u'new'},
+                                               u'messages': [{u'code': u'0'}]}
+            return mock_response
+        mock_request.side_effect = respond
+
+        self._fms.login()
+        self.assertEqual(mock_request.call_args[1][u'headers'][u'Authorization'],
+                         u'FMID dummy_token')
+        self.assertEqual(other_headers, [u'Bearer old'])
+        self.assertEqual(self._fms._build_headers()[u'Authorization'], u'Bearer new')
+
     def test_non_ssl_handling(self):
         u"""Make sure you cannot instantiate a Server with an http address."""
 
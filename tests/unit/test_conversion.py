@@ -0,0 +1,89 @@
+from __future__ import absolute_import
+import unittest
+import datetime
+from fmrest.conversion import TypeInference, MetadataConversion, _has_numpy
+from fmrest.utils import convert_string_type
+
+class TypeInferenceTestCase(unittest.TestCase):
+    u"""TypeInference test suite"""
+
+    def test_convert_row(self):
+        u"""Test that rows are converted like records and decisions are kept per field."""
+        inference = TypeInference(sample_size=2)
+        keys = [u'id', u'price', u'name', u'born', u'empty']
+        rows = [
+            [u'1', u'1.5', u'David', u'12/24/2016', u''],
+            [u'2', u'2', u'Caspar', u'01/02/2017', u''],
+            [u'', u'3', u'42', u'01/03/2017', u'7']
+        ]
+
+        converted = [inference.convert_row(keys, row) for row in rows]
+
+        self.assertEqual(inference.kind(u'id'), u'int')
+        self.assertEqual(inference.kind(u'price'), u'number')
+        self.assertEqual(inference.kind(u'name'), u'string')
+        self.assertEqual(inference.kind(u'born'), u'datetime')
+        self.assertEqual(inference.kind(u'empty'), u'mixed')
+
+        self.assertEqual(converted[:2], [[convert_string_type(value) if value else value
+                                          for value in row] for row in rows[:2]])
+        self.assertEqual(converted[2], [u'', 3, 42, datetime.datetime(2017, 1, 3), 7])
+        self.assertIsInstance(converted[2][1], int)
+        self.assertEqual(converted[2], [convert_string_type(value) if value else value
+                                        for value in rows[2]])
+
+    def test_convert_column(self):
+        u"""Test that a column is decided from its values and converted as a whole."""
+        inference = TypeInference()
+
+        self.assertEqual(inference.convert_column(u'id', [u'1', u'2', u'x']), [1, 2, u'x'])
+        self.assertEqual(inference.convert_column(u'id', [u'3']), [3])
+        self.assertEqual(inference.convert_column(u'name', [u'a', u'b']), [u'a', u'b'])
+        self.assertEqual(inference.convert_column(u'name', [u'1', u'inf', u'c']),
+                         [1, float(u'inf'), u'c'])
+        self.assertEqual(inference.convert_column(u'empty', [u'', u'']), [u'', u''])
+        self.assertIsNone(inference.kind(u'empty'))
+
+    @unittest.skipUnless(_has_numpy, u'requires numpy')
+    def test_convert_column_as_array(self):
+        u"""Test that numeric columns are converted by NumPy if requested."""
+        inference = TypeInference()
+
+        ids = inference.convert_column(u'id', [u'1', u'2'], as_array=True)
+        prices = inference.convert_column(u'price', [u'1.5', u'2'], as_array=True)
+
+        self.assertEqual(ids.dtype.kind, u'i')
+        self.assertEqual(prices.tolist(), [1.5, 2.0])
+
+        # e.g. Get(UUIDNumber) keys don't fit into int64
+        uuid = u'12345678901234567890123456789012345678901'
+        self.assertEqual(inference.convert_column(u'uuid', [uuid, u'1'], as_array=True),
+                         [int(uuid), 1])
+
+class MetadataConversionTestCase(unittest.TestCase):
+    u"""MetadataConversion test suite"""
+
+    def test_convert_row(self):
+        u"""Test that values are converted according to their declared result type only."""
+        metadata = {
+            u'fieldMetaData': [
+                {u'name': u'zip', u'result': u'text'},
+                {u'name': u'amount', u'result': u'number'},
+                {u'name': u'born', u'result': u'date'},
+                {u'name': u'start', u'result': u'time'},
+                {u'name': u'created', u'result': u'timeStamp'}
+            ],
+            u'portalMetaData': {u'notes': [{u'name': u'notes::count', u'result': u'number'}]}
+        }
+        conversion = MetadataConversion(metadata)
+        keys = [u'zip', u'amount', u'born', u'start', u'created', u'recordId', u'notes::count']
+
+        self.assertEqual(
+            conversion.convert_row(keys, [u'01234', u'1e5', u'12/24/2016', u'25:00:00',
+                                          u'12/24/2016 20:45:30', u'1', u'2']),
+            [u'01234', 100000.0, datetime.date(2016, 12, 24), datetime.timedelta(hours=25),
+             datetime.datetime(2016, 12, 24, 20, 45, 30), u'1', 2]
+        )
+        self.assertEqual(conversion.convert_row(keys, [u'', u'', u'?', u'', u'', u'', 3]),
+                         [u'', u'', u'?', u'', u'', u'', 3])
+        self.assertEqual(conversion.convert_column(u'amount', [u'1', u'2.5']), [1, 2.5])
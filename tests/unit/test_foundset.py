@@ -1,7 +1,9 @@
 from __future__ import with_statement
 from __future__ import absolute_import
 import unittest
-from fmrest.foundset import Foundset
+import collections
+import pickle
+from fmrest.foundset import Foundset, ColumnarFoundset, append_columns, window, spill
 from fmrest.record import Record
 from itertools import izip
 
@@ -32,6 +34,62 @@ class FoundsetTestCase(unittest.TestCase):
         sample_gen = Foundset(i for i in [1, 2, 4, 5, 6, 7, 8])
         self.assertEqual(list(izip(sample_gen, sample_gen)), list(izip(sample_gen, sample_gen)))
 
+    def test_cache_policies(self):
+        u"""Test that the none and window policies drop records and keep indexes absolute."""
+        foundset = Foundset((i for i in xrange(5)), cache=u'none')
+        self.assertEqual(list(foundset), range(5))
+        self.assertEqual(list(foundset), [])
+        with self.assertRaises(IndexError):
+            foundset[0]
+
+        foundset = Foundset((i for i in xrange(5)), cache=window(2))
+        self.assertEqual(foundset[3], 3)
+        self.assertEqual(foundset[2], 2)
+        with self.assertRaises(IndexError):
+            foundset[1]
+        self.assertEqual(list(foundset), [2, 3, 4])
+
+        with self.assertRaises(ValueError):
+            Foundset([], cache=u'some')
+
+    def test_spill_cache(self):
+        u"""Test that older records are spilled to disk and remain accessible."""
+        records = [Record([u'name', u'recordId', u'modId'], [u'john ' + unicode(i), i, 1])
+                   for i in xrange(20)]
+        records[0][u'name'] = u'jane'
+        foundset = Foundset(iter(records), cache=spill(max_bytes=500))
+        list(foundset)
+
+        self.assertGreater(len(foundset._cache[0]._offsets), 0)
+        self.assertEqual([record.name for record in foundset],
+                         [u'jane'] + [u'john ' + unicode(i) for i in xrange(1, 20)])
+        self.assertEqual(foundset[0].modifications(), {u'name': u'jane'})
+        self.assertEqual(foundset[-1].record_id, 19)
+
+    def test_pickle_dropped_records(self):
+        u"""Test that a foundset is pickled with all records, unless its policy dropped some."""
+        records = [Record([u'name'], [u'john ' + unicode(i)]) for i in xrange(3)]
+        foundset = Foundset(iter(records), cache=window(2))
+        foundset[0]
+        copy = pickle.loads(pickle.dumps(foundset, pickle.HIGHEST_PROTOCOL))
+        self.assertEqual([record.name for record in copy], [u'john 0', u'john 1', u'john 2'])
+
+        list(foundset)
+        with self.assertRaises(TypeError):
+            pickle.dumps(foundset, pickle.HIGHEST_PROTOCOL)
+
+    def test_data_released(self):
+        u"""Test that the response data is only kept until the first record is consumed."""
+        data = [{u'fieldData': {u'name': u'john doe'}, u'portalData': {}, u'recordId': u'1',
+                 u'modId': u'1'}]
+        foundset = Foundset(iter([Record([u'name'], [u'john doe'])]), data=data)
+        self.assertIs(foundset._data[0], data)
+        foundset[0]
+        self.assertIsNone(foundset._data[0])
+
+        foundset = Foundset(iter([]), data=data, cache=window(10))
+        self.assertIsNone(foundset._data[0])
+
     def test_info(self):
         u"""Test that info section is available."""
         info = {u'portalObjectName': u'sample', u'database': u'DB', u'table': u'Sample', u'foundCount': 69, u'returnedCount': 50}
@@ -43,3 +101,49 @@ class FoundsetTestCase(unittest.TestCase):
 
         sample_gen = Foundset(i for i in [1, 2])
         self.assertEqual(sample_gen.info, {})
+
+    def test_columnar_foundset(self):
+        u"""Test that ColumnarFoundset stores columns and hands out records per row."""
+        records = [
+            Record([u'name', u'drink', u'recordId', u'modId'], [u'David', u'Coffee', u'1', u'1']),
+            Record([u'name', u'drink', u'recordId', u'modId'], [u'Caspar', u'Tea', u'2', u'1']),
+            Record([u'drink', u'name', u'recordId', u'modId'], [u'Coffee', u'Dan', u'3', u'1']),
+            Record([u'name', u'city', u'recordId', u'modId'], [u'Eve', u'Hamburg', u'4', u'1'])
+        ]
+        foundset = ColumnarFoundset(iter(records), {u'foundCount': 4}, max_categories=3)
+
+        self.assertEqual(len(foundset), 4)
+        self.assertEqual(foundset.info[u'foundCount'], 4)
+        self.assertEqual(foundset.keys(), [u'name', u'drink', u'recordId', u'modId', u'city'])
+        self.assertEqual(foundset.column(u'drink'), [u'Coffee', u'Tea', u'Coffee', None])
+        self.assertEqual(foundset.column(u'name'), [u'David', u'Caspar', u'Dan', u'Eve'])
+
+        # drink has two distinct values (plus missing) and stays encoded, name exceeds max_categories
+        self.assertEqual(foundset._columns[1].categories[:2], [u'Coffee', u'Tea'])
+        self.assertIsInstance(foundset._columns[0], list)
+
+        self.assertEqual(foundset[2].to_dict(), records[2].to_dict())
+        self.assertEqual(foundset[-1].to_dict(), records[3].to_dict())
+        self.assertEqual([record.record_id for record in foundset], [1, 2, 3, 4])
+        with self.assertRaises(IndexError):
+            foundset[4]
+        with self.assertRaises(KeyError):
+            foundset.column(u'zip')
+
+    def test_append_columns(self):
+        u"""Test that columns are built from response data, filling up missing fields."""
+        columns = collections.OrderedDict()
+        data = [
+            {u'fieldData': {u'name': u'David'}, u'portalData': {}, u'recordId': u'1', u'modId': u'1'},
+            {u'fieldData': {u'name': u'Caspar', u'city': u'Hamburg'}, u'portalData': {},
+             u'recordId': u'2', u'modId': u'3'}
+        ]
+
+        length = append_columns(columns, data, 0)
+        length = append_columns(columns, data[:1], length)
+
+        self.assertEqual(length, 3)
+        self.assertEqual(list(columns), [u'name', u'city', u'recordId', u'modId'])
+        self.assertEqual(columns[u'name'], [u'David', u'Caspar', u'David'])
+        self.assertEqual(columns[u'city'], [None, u'Hamburg', None])
+        self.assertEqual(columns[u'modId'], [u'1', u'3', u'1'])
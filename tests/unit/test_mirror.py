@@ -0,0 +1,71 @@
+from __future__ import absolute_import
+import unittest
+import mock
+from fmrest.record import Record
+from fmrest.mirror import SQLiteMirror, SyncResult
+
+def record(record_id, mod_id, name, modified):
+    return Record([u'name', u'ModifiedAt', u'recordId', u'modId'],
+                  [name, modified, unicode(record_id), unicode(mod_id)])
+
+class SQLiteMirrorTestCase(unittest.TestCase):
+    u"""SQLiteMirror test suite"""
+
+    def setUp(self):
+        self._server = mock.Mock(layout=u'Contacts', date_order=u'MDY')
+        self._mirror = SQLiteMirror(self._server, u':memory:', u'ModifiedAt',
+                                    id_layout=u'Contacts_ids')
+
+    def _rows(self):
+        return self._mirror.execute(
+            u'SELECT recordId, modId, name FROM Contacts ORDER BY recordId').fetchall()
+
+    def test_full_and_incremental_sync(self):
+        u"""Test the initial full pull, incremental pulls by timestamp and deletions."""
+        self._server.iter_records.return_value = [
+            record(1, 1, u'David', u'01/02/2018 10:00:00'),
+            record(2, 1, u'Sam', u'01/03/2018 09:30:00')
+        ]
+        self.assertEqual(self._mirror.sync(), SyncResult(2, 0, 0, 0, True))
+        self.assertEqual(self._rows(), [(1, 1, u'David'), (2, 1, u'Sam')])
+
+        # record 2 is found again due to the inclusive query, record 1 changed, 3 is new
+        self._server.iter_find.return_value = [
+            record(2, 1, u'Sam', u'01/03/2018 09:30:00'),
+            record(1, 2, u'Dave', u'01/04/2018 08:00:00'),
+            record(3, 1, u'Jo', u'01/04/2018 08:00:00')
+        ]
+        self._server.iter_records.return_value = [
+            record(1, 2, u'Dave', u''), record(3, 1, u'Jo', u'')
+        ]
+        self.assertEqual(self._mirror.sync(), SyncResult(1, 1, 1, 1, False))
+        self._server.iter_find.assert_called_once_with(
+            [{u'ModifiedAt': u'>=01/03/2018 09:30:00'}], page_size=1000)
+        self._server.iter_records.assert_called_with(page_size=10000, layout=u'Contacts_ids')
+        self.assertEqual(self._rows(), [(1, 2, u'Dave'), (3, 1, u'Jo')])
+        self.assertEqual(self._mirror.high_water.isoformat(), u'2018-01-04T08:00:00')
+
+    def test_new_columns(self):
+        u"""Test that fields appearing later get their own column."""
+        self._server.iter_records.return_value = [record(1, 1, u'David', u'01/02/2018 10:00:00')]
+        self._mirror.sync()
+
+        self._server.iter_records.return_value = [
+            Record([u'name', u'city', u'ModifiedAt', u'recordId', u'modId'],
+                   [u'David', u'Hamburg', u'01/05/2018 10:00:00', u'1', u'2'])
+        ]
+        self.assertEqual(self._mirror.sync(full=True), SyncResult(0, 1, 0, 0, True))
+        self.assertEqual(self._mirror.execute(u'SELECT city FROM Contacts').fetchall(),
+                         [(u'Hamburg',)])
+
+    def test_large_integers_and_malformed_timestamps(self):
+        u"""Test that integers beyond 64 bit are stored as text and malformed modification
+        timestamps don't stop the sync."""
+        self._server.iter_records.return_value = [
+            record(1, 1, 2 ** 64, u'01/02/2018 10:00:00'),
+            record(2, 1, -2 ** 63, u'not a timestamp'),
+            record(3, 1, u'Jo', 42)
+        ]
+        self.assertEqual(self._mirror.sync(), SyncResult(3, 0, 0, 0, True))
+        self.assertEqual(self._rows(), [(1, 1, unicode(2 ** 64)), (2, 1, -2 ** 63), (3, 1, u'Jo')])
+        self.assertEqual(self._mirror.high_water.isoformat(), u'2018-01-02T10:00:00')
@@ -1,7 +1,10 @@
 from __future__ import with_statement
 from __future__ import absolute_import
 import unittest
-from fmrest.record import Record
+import datetime
+import pickle
+from fmrest.record import Record, RecordSchema, LazyRecord
+from fmrest.foundset import Foundset
 
 class RecordTestCase(unittest.TestCase):
     u"""Record test suite"""
@@ -141,3 +144,73 @@ class RecordTestCase(unittest.TestCase):
         self.assertEqual(record.values(), [u'David', u'Hamburg'])
 
         self.assertEqual(record.pop(u'not existing'), None)
+
+    def test_shared_schema(self):
+        u"""Test that records can share a schema and popping a key does not affect others."""
+        schema = RecordSchema([u'name', u'drink'])
+        first = Record(schema, [u'David', u'Coffee'])
+        second = Record(schema, [u'Caspar', u'Tea'])
+
+        self.assertEqual(schema.index(u'drink'), 1)
+        self.assertIn(u'name', schema)
+        with self.assertRaises(ValueError):
+            schema.index(u'city')
+
+        self.assertEqual(second.drink, u'Tea')
+        first.pop(u'drink')
+        self.assertEqual(first.keys(), [u'name'])
+        self.assertEqual(second.keys(), [u'name', u'drink'])
+        self.assertEqual(second.drink, u'Tea')
+
+    def test_lazy_record(self):
+        u"""Test that a LazyRecord converts values on access and tracks modifications."""
+        data = {
+            u'fieldData': {u'name': u'David', u'born': u'12/24/2000', u'recordId': u'clash'},
+            u'portalData': {u'notes': [{u'recordId': u'7'}]},
+            u'recordId': u'1',
+            u'modId': u'2'
+        }
+        portal_factory = lambda data, name: data[u'portalData'][name]
+        record = LazyRecord(data, portal_factory, type_conversion=True)
+
+        self.assertIsNone(record._cache)
+        self.assertEqual(record.born, datetime.datetime(2000, 12, 24))
+        self.assertEqual(record._cache, {u'born': datetime.datetime(2000, 12, 24)})
+        self.assertEqual(record.record_id, 1)
+        self.assertEqual(record.modification_id, 2)
+        self.assertEqual(record.portal_notes, [{u'recordId': u'7'}])
+        self.assertEqual(sorted(record.keys()),
+                         [u'born', u'modId', u'name', u'portal_notes', u'recordId'])
+        with self.assertRaises(AttributeError):
+            record.city
+
+        self.assertIsNone(record._modifications)
+        record.name = u'David'
+        self.assertFalse(record.is_dirty)
+        record.name = u'Caspar'
+        self.assertEqual(record.modifications(), {u'name': u'Caspar'})
+        self.assertEqual(record.name, u'Caspar')
+        self.assertEqual(data[u'fieldData'][u'name'], u'David')
+        with self.assertRaises(KeyError):
+            record[u'portal_notes'] = 1
+
+        self.assertEqual(record.pop(u'born'), datetime.datetime(2000, 12, 24))
+        self.assertEqual(record.to_dict(ignore_portals=True, ignore_internal_ids=True),
+                         {u'name': u'Caspar'})
+
+    def test_pickling(self):
+        u"""Test that records (lazy ones as plain Records) survive pickling with changes and
+        portals."""
+        record = Record([u'name', u'portal_notes'],
+                        [u'David', Foundset(iter([Record([u'note'], [u'hi'], True)]))])
+        record.name = u'Caspar'
+        copy = pickle.loads(pickle.dumps(record, pickle.HIGHEST_PROTOCOL))
+        self.assertEqual(copy.name, u'Caspar')
+        self.assertEqual(copy.modifications(), {u'name': u'Caspar'})
+        self.assertEqual(copy.portal_notes[0].note, u'hi')
+
+        lazy = LazyRecord({u'fieldData': {u'name': u'David'}, u'portalData': {},
+                           u'recordId': u'1', u'modId': u'2'}, lambda data, name: None)
+        copy = pickle.loads(pickle.dumps(lazy, pickle.HIGHEST_PROTOCOL))
+        self.assertIs(type(copy), Record)
+        self.assertEqual(copy.to_dict(), {u'name': u'David', u'recordId': u'1', u'modId': u'2'})
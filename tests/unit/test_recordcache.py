@@ -0,0 +1,90 @@
+from __future__ import absolute_import
+import unittest
+import json
+import mock
+import requests
+import fmrest
+from fmrest.record import Record
+from fmrest.recordcache import RecordCache
+from fmrest.exceptions import FileMakerError
+
+def record(record_id, mod_id, name = None):
+    if name is None:
+        return Record([u'recordId', u'modId'], [unicode(record_id), unicode(mod_id)])
+    return Record([u'name', u'recordId', u'modId'], [name, unicode(record_id), unicode(mod_id)])
+
+class RecordCacheTestCase(unittest.TestCase):
+    u"""RecordCache test suite"""
+
+    def test_bulk_revalidation(self):
+        u"""Test that modIds are requested in bulk and only changed records are refetched."""
+        server = mock.Mock()
+        cache = RecordCache(server, validation_layout=u'slim', id_field=u'id', batch_size=2)
+
+        server.find.return_value = [record(1, 1, u'David'), record(2, 1, u'Sam')]
+        self.assertEqual([r.name for r in cache.get_many([1, 2])], [u'David', u'Sam'])
+        server.find.assert_called_once_with([{u'id': u'==1'}, {u'id': u'==2'}], limit=2,
+                                            portals=None, layout=None, use_cache=False)
+
+        # record 1 changed, record 2 was deleted, record 3 is not cached yet
+        server.find.reset_mock()
+        server.find.side_effect = [
+            [record(1, 2)],
+            [record(1, 2, u'Dave')],
+            [record(3, 1, u'Jo')]
+        ]
+        self.assertEqual([r.name for r in cache.get_many([1, 2, 3])], [u'Dave', u'Jo'])
+        self.assertEqual(server.find.call_args_list[0],
+                         mock.call([{u'id': u'==1'}, {u'id': u'==2'}], limit=2, portals=None,
+                                   layout=u'slim', use_cache=False))
+        self.assertEqual(server.find.call_args_list[1][0][0], [{u'id': u'==1'}])
+
+        stats = cache.stats()
+        self.assertEqual((stats[u'hits'], stats[u'misses']), (1, 3))
+        self.assertEqual((stats[u'refetches'], stats[u'removals'], stats[u'records']), (1, 1, 2))
+        self.assertNotIn(2, cache)
+
+    def test_single_revalidation(self):
+        u"""Test revalidation via get_record() and missing records."""
+        server = mock.Mock()
+        cache = RecordCache(server, validation_layout=u'slim')
+        server.get_record.return_value = record(1, 5, u'David')
+        cached = cache.get(1)
+
+        server.get_record.reset_mock()
+        server.get_record.return_value = record(1, 5)
+        self.assertIs(cache.get(1), cached)
+        server.get_record.assert_called_once_with(1, layout=u'slim', use_cache=False)
+        self.assertIs(cache.get(1, revalidate=False), cached)
+
+        server.get_record.side_effect = FileMakerError(101, u'Record is missing')
+        with self.assertRaises(FileMakerError):
+            cache.get(1)
+        self.assertEqual(len(cache), 0)
+
+    @mock.patch.object(requests.Session, u'request')
+    def test_bypasses_response_cache(self, mock_request):
+        u"""Test that revalidation sees changes although the server has a ResponseCache."""
+        server = fmrest.Server(url=u'https://111.111.111.111', user=u'demo', password=u'demo',
+                               database=u'Demo', layout=u'Demo',
+                               response_cache=fmrest.ResponseCache())
+        cache = RecordCache(server)
+
+        def response(mod_id):
+            mock_response = mock.Mock()
+            mock_response.json.return_value = {
+                u'messages': [{u'code': u'0'}],
+                u'response': {u'data': [{u'fieldData': {u'name': u'David'}, u'portalData': {},
+                                         u'recordId': u'1', u'modId': mod_id}]}
+            }
+            mock_response.content = json.dumps(mock_response.json.return_value)
+            return mock_response
+
+        mock_request.return_value = response(u'1')
+        server.get_record(1) # fills the response cache
+        self.assertEqual(cache.get(1).modification_id, 1)
+
+        mock_request.return_value = response(u'2')
+        self.assertEqual(server.get_record(1).modification_id, 1) # answered by the response cache
+        self.assertEqual(cache.get(1).modification_id, 2)
+        self.assertEqual(cache.stats()[u'refetches'], 1)
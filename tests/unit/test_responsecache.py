@@ -0,0 +1,59 @@
+from __future__ import absolute_import
+import unittest
+import mock
+from fmrest.responsecache import ResponseCache
+
+URL = u'https://111.111.111.111'
+DATABASE = u'Demo'
+
+class ResponseCacheTestCase(unittest.TestCase):
+    u"""ResponseCache test suite"""
+
+    def _key(self, path, record_id = None, params = None):
+        return ResponseCache.make_key(URL, DATABASE, u'admin', path, params, None, record_id)
+
+    def test_key_normalization(self):
+        u"""Test that key order and None values don't change the key."""
+        self.assertEqual(
+            self._key(u'/records', params={u'_limit': 10, u'_offset': 1, u'layout.response': None}),
+            self._key(u'/records', params={u'_offset': 1, u'_limit': 10})
+        )
+        self.assertNotEqual(self._key(u'/records', params={u'_limit': 10}),
+                            self._key(u'/records', params={u'_limit': 20}))
+
+    def test_ttl_and_lru_eviction(self):
+        u"""Test that entries expire and the least recently used entries are evicted."""
+        cache = ResponseCache(ttl=10, max_entries=2, max_bytes=100)
+
+        with mock.patch(u'fmrest.responsecache.time.time', return_value=1000):
+            cache.set(u'a', {u'data': 1}, 10)
+            cache.set(u'b', {u'data': 2}, 10)
+            self.assertEqual(cache.get(u'a'), {u'data': 1})
+            cache.set(u'c', {u'data': 3}, 10) # evicts b, as a was used more recently
+            self.assertIsNone(cache.get(u'b'))
+
+            cache.set(u'd', {u'data': 4}, 95) # exceeds max_bytes, evicts a and c
+            self.assertEqual(len(cache), 1)
+            cache.set(u'e', {u'data': 5}, 101) # larger than max_bytes, not cached
+            self.assertIsNone(cache.get(u'e'))
+
+        with mock.patch(u'fmrest.responsecache.time.time', return_value=1010):
+            self.assertIsNone(cache.get(u'd'))
+
+        stats = cache.stats()
+        self.assertEqual((stats[u'hits'], stats[u'misses']), (1, 3))
+        self.assertEqual((stats[u'evictions'], stats[u'expirations']), (3, 1))
+        self.assertEqual((stats[u'entries'], stats[u'bytes']), (0, 0))
+        self.assertEqual(stats[u'hit_rate'], 0.25)
+
+    def test_invalidate(self):
+        u"""Test that writes invalidate list results and results of the written record only."""
+        cache = ResponseCache()
+        for key in (self._key(u'/records'), self._key(u'/records/1', 1),
+                    self._key(u'/records/2', 2)):
+            cache.set(key, {}, 1)
+
+        self.assertEqual(cache.invalidate(URL, DATABASE, 1), 2)
+        self.assertIsNotNone(cache.get(self._key(u'/records/2', 2)))
+        self.assertEqual(cache.invalidate(URL, u'Other', all_records=True), 0)
+        self.assertEqual(cache.invalidate(URL, DATABASE, all_records=True), 1)
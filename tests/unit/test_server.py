@@ -2,11 +2,24 @@ u"""Server test suite"""
 from __future__ import with_statement
 from __future__ import absolute_import
 import unittest
+import io
 import json
+import threading
+import time
 import mock
 import requests
 import fmrest
-from fmrest.exceptions import FileMakerError, BadJSON
+from fmrest.exceptions import FileMakerError, BadJSON, RequestException
+from fmrest.utils import _has_ijson, JSONCodec, get_json_codec, set_json_codec
+from fmrest.record import LazyRecord
+from fmrest.foundset import ColumnarFoundset, window
+
+try:
+    import pandas
+except ImportError:
+    _has_pandas = False
+else:
+    _has_pandas = True
 
 URL = u'https://111.111.111.111'
 ACCOUNT_NAME = u'demo'
@@ -31,7 +44,7 @@ class ServerTestCase(unittest.TestCase):
                                   layout=LAYOUT
                                  )
 
-    @mock.patch.object(requests, u'request')
+    @mock.patch.object(requests.Session, u'request')
     def test_last_error(self, mock_request):
         u"""Test that FileMaker's errorCode response is available via last_error property."""
         mock_response = mock.Mock()
@@ -48,7 +61,7 @@ class ServerTestCase(unittest.TestCase):
         # Assert last error to be error from mocked response
         self.assertEqual(self._fms.last_error, 212)
 
-    @mock.patch.object(requests, u'request')
+    @mock.patch.object(requests.Session, u'request')
     def test_bad_json_response(self, mock_request):
         u"""Test handling of invalid JSON response."""
         mock_response = mock.Mock()
@@ -68,3 +81,509 @@ class ServerTestCase(unittest.TestCase):
                           database=DATABASE,
                           layout=LAYOUT
                          )
+
+    @mock.patch.object(requests.Session, u'request')
+    def test_connection_pool_reuse(self, mock_request):
+        u"""Test that all calls, incl. container downloads, go through the instance's session."""
+        mock_response = mock.Mock()
+        mock_response.json.return_value = {u'response': {u'token': u'dummytoken'},
+                                           u'messages': [{u'code': u'0'}]}
+        mock_request.return_value = mock_response
+
+        self._fms.login()
+        self._fms.fetch_file(u'https://111.111.111.111/Streaming_SSL/MainDB/file.png')
+
+        self.assertEqual(mock_request.call_count, 2)
+        self.assertIsInstance(self._fms.session, requests.Session)
+
+    def test_shared_session(self):
+        u"""Test that a session can be shared between Server instances."""
+        fms = fmrest.Server(url=URL,
+                            user=ACCOUNT_NAME,
+                            password=ACCOUNT_PASS,
+                            database=DATABASE,
+                            layout=LAYOUT,
+                            session=self._fms.session
+                           )
+        self.assertIs(fms.session, self._fms.session)
+
+    def test_no_keep_alive(self):
+        u"""Test that disabling keep-alive asks the server to close connections."""
+        fms = fmrest.Server(url=URL,
+                            user=ACCOUNT_NAME,
+                            password=ACCOUNT_PASS,
+                            database=DATABASE,
+                            layout=LAYOUT,
+                            keep_alive=False
+                           )
+        self.assertEqual(fms.session.headers[u'Connection'], u'close')
+        self.assertNotIn(u'close', self._fms.session.headers.values())
+
+    @mock.patch.object(requests.Session, u'request')
+    def test_iter_records_pagination(self, mock_request):
+        u"""Test that iter_records walks all pages lazily until foundCount is reached."""
+        mock_request.side_effect = [
+            _mock_page_response([1, 2], 5),
+            _mock_page_response([3, 4], 5),
+            _mock_page_response([5], 5)
+        ]
+
+        records = self._fms.iter_records(page_size=2)
+        self.assertEqual(mock_request.call_count, 0)
+
+        self.assertEqual([r.record_id for r in records], [1, 2, 3, 4, 5])
+        self.assertEqual(mock_request.call_count, 3)
+
+        offsets = [call[1][u'params'][u'_offset'] for call in mock_request.call_args_list]
+        self.assertEqual(offsets, [1, 3, 5])
+
+    @mock.patch.object(requests.Session, u'request')
+    def test_iter_records_max_records(self, mock_request):
+        u"""Test that iter_records does not request more than max_records."""
+        mock_request.side_effect = [
+            _mock_page_response([1, 2], 5),
+            _mock_page_response([3], 5)
+        ]
+
+        records = list(self._fms.iter_records(page_size=2, max_records=3))
+
+        self.assertEqual(len(records), 3)
+        self.assertEqual(mock_request.call_args[1][u'params'][u'_limit'], 1)
+
+    @mock.patch.object(requests.Session, u'request')
+    def test_iter_find_no_match(self, mock_request):
+        u"""Test that iter_find yields nothing instead of raising when no records match."""
+        mock_response = mock.Mock()
+        mock_response.json.return_value = {u'messages': [{u'code': u'401'}], u'response': {}}
+        mock_request.return_value = mock_response
+
+        self.assertEqual(list(self._fms.iter_find([{u'name': u'nobody'}])), [])
+
+    @mock.patch.object(requests.Session, u'request')
+    def test_iter_records_prefetch(self, mock_request):
+        u"""Test that prefetching pages in the background yields the same records."""
+        mock_request.side_effect = [
+            _mock_page_response([1, 2], 5),
+            _mock_page_response([3, 4], 5),
+            _mock_page_response([5], 5)
+        ]
+
+        records = self._fms.iter_records(page_size=2, prefetch=1)
+        self.assertEqual([r.record_id for r in records], [1, 2, 3, 4, 5])
+        self.assertEqual(mock_request.call_count, 3)
+
+    @mock.patch.object(requests.Session, u'request')
+    def test_parallel_scan(self, mock_request):
+        u"""Test that a parallel scan fetches all pages through multiple sessions."""
+        found_count = 25
+        logins = []
+
+        def respond(method, url, **kwargs):
+            if method == u'POST':
+                logins.append(True)
+                return _mock_token_response(u'token%d' % len(logins))
+            if method == u'DELETE':
+                return _mock_token_response(None)
+
+            offset = kwargs[u'params'][u'_offset']
+            limit = kwargs[u'params'][u'_limit']
+            last = min(offset + limit, found_count + 1)
+            return _mock_page_response(range(offset, last), found_count)
+
+        mock_request.side_effect = respond
+
+        records = self._fms.parallel_scan(concurrency=3, page_size=4)
+        self.assertEqual([r.record_id for r in records], range(1, found_count + 1))
+        self.assertLessEqual(len(logins), 3)
+
+        unordered = self._fms.parallel_scan(concurrency=3, page_size=4, ordered=False,
+                                            max_records=10)
+        self.assertEqual(sorted(r.record_id for r in unordered), range(1, 11))
+
+        # the instance itself never logged in
+        self.assertIsNone(self._fms._token)
+
+    @mock.patch.object(requests.Session, u'request')
+    def test_thread_local_last_error(self, mock_request):
+        u"""Test that last_error is tracked per thread when sharing an instance."""
+        mock_response = mock.Mock()
+        mock_response.json.return_value = {u'messages': [{u'code': u'212'}], u'response': {}}
+        mock_request.return_value = mock_response
+
+        def failing_login():
+            with self.assertRaises(FileMakerError):
+                self._fms.login()
+            errors.append(self._fms.last_error)
+
+        errors = []
+        thread = threading.Thread(target=failing_login)
+        thread.start()
+        thread.join()
+
+        self.assertEqual(errors, [212])
+        self.assertIsNone(self._fms.last_error)
+
+    @mock.patch.object(requests.Session, u'request')
+    def test_headers_per_request(self, mock_request):
+        u"""Test that headers are built per request and not shared between calls."""
+        mock_request.return_value = _mock_token_response(u'dummytoken')
+
+        self._fms.login()
+        self._fms.upload_container(1, u'container', mock.Mock())
+        self._fms.set_globals({u'Table::field': u'value'})
+
+        login, upload, globals_ = [call[1][u'headers'] for call in mock_request.call_args_list]
+        self.assertNotIn(u'Authorization', login)
+        self.assertNotIn(u'Content-Type', upload)
+        self.assertEqual(upload[u'Authorization'], u'Bearer dummytoken')
+        self.assertEqual(globals_[u'Content-Type'], u'application/json')
+        self.assertIsNot(upload, globals_)
+
+    @mock.patch.object(requests.Session, u'request')
+    def test_proactive_relogin(self, mock_request):
+        u"""Test that a token idle for longer than session_timeout is replaced before the call."""
+        mock_request.return_value = _mock_token_response(u'first')
+        self._fms.auto_relogin = True
+        self._fms.login()
+        self.assertLess(self._fms.token_idle_time, 1)
+
+        self._fms._token_last_used -= self._fms.session_timeout
+        mock_request.side_effect = [_mock_token_response(u'second'),
+                                    _mock_page_response([1], 1)]
+
+        self.assertEqual(self._fms.get_record(1).record_id, 1)
+        methods = [call[1][u'method'] for call in mock_request.call_args_list]
+        self.assertEqual(methods, [u'POST', u'POST', u'GET'])
+        self.assertEqual(self._fms._token, u'second')
+
+    @mock.patch.object(requests.Session, u'request')
+    def test_validate_session(self, mock_request):
+        u"""Test that validate_session reports whether the token is still accepted."""
+        mock_request.return_value = _mock_token_response(u'dummytoken')
+        self._fms.login()
+        self.assertTrue(self._fms.validate_session())
+
+        mock_response = mock.Mock()
+        mock_response.json.return_value = {u'messages': [{u'code': u'952'}], u'response': {}}
+        mock_request.return_value = mock_response
+        self.assertFalse(self._fms.validate_session())
+
+    @mock.patch.object(requests.Session, u'request')
+    def test_single_flight_relogin(self, mock_request):
+        u"""Test that concurrent threads hitting an expired token cause only one login."""
+        logins = []
+
+        def respond(method, url, **kwargs):
+            if method == u'POST':
+                logins.append(True)
+                time.sleep(0.1)
+                return _mock_token_response(u'fresh')
+            if kwargs[u'headers'].get(u'Authorization') != u'Bearer fresh':
+                mock_response = mock.Mock()
+                mock_response.json.return_value = {u'messages': [{u'code': u'952'}],
+                                                   u'response': {}}
+                return mock_response
+            return _mock_page_response([1], 1)
+
+        mock_request.side_effect = respond
+        self._fms.auto_relogin = True
+        self._fms._token = u'stale'
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(self._fms.get_record(1)))
+                   for _ in xrange(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(results), 5)
+        self.assertEqual(len(logins), 1)
+
+        stats = self._fms.relogin_stats
+        self.assertEqual(stats[u'logins'], 1)
+        self.assertLessEqual(stats[u'waits'], 4)
+
+    @mock.patch.object(requests.Session, u'request')
+    def test_create_records(self, mock_request):
+        u"""Test that bulk creation yields results in input order and reports failed rows."""
+
+        def respond(method, url, **kwargs):
+            name = json.loads(kwargs[u'data'])[u'fieldData'][u'name']
+            time.sleep(0.01 * (3 - len(name) % 3))
+            mock_response = mock.Mock()
+            if name == u'bad':
+                mock_response.json.return_value = {
+                    u'messages': [{u'code': u'504', u'message': u'Value is not unique'}],
+                    u'response': {}}
+            else:
+                mock_response.json.return_value = {
+                    u'messages': [{u'code': u'0'}],
+                    u'response': {u'recordId': unicode(len(name)), u'modId': u'0'}}
+            return mock_response
+
+        mock_request.side_effect = respond
+        rows = [{u'name': u'x' * i} for i in xrange(1, 6)]
+        rows.insert(2, {u'name': u'bad'})
+
+        results = list(self._fms.create_records(rows, concurrency=3))
+
+        self.assertEqual([r.record_id for r in results], [1, 2, None, 3, 4, 5])
+        self.assertEqual([r.ok for r in results], [True, True, False, True, True, True])
+        self.assertEqual(results[2].error.error_code, 504)
+        self.assertEqual(results[0].mod_id, 0)
+
+    @mock.patch.object(requests.Session, u'request')
+    def test_create_records_request_error(self, mock_request):
+        u"""Test that a failed request is reported in its result without stopping the others."""
+
+        def respond(method, url, **kwargs):
+            name = json.loads(kwargs[u'data'])[u'fieldData'][u'name']
+            if name == u'b':
+                raise requests.exceptions.ConnectionError(u'Connection reset')
+            mock_response = mock.Mock()
+            mock_response.json.return_value = {
+                u'messages': [{u'code': u'0'}],
+                u'response': {u'recordId': unicode(ord(name)), u'modId': u'0'}}
+            return mock_response
+
+        mock_request.side_effect = respond
+        rows = [{u'name': u'a'}, {u'name': u'b'}, {u'name': u'c'}]
+
+        results = list(self._fms.create_records(rows, concurrency=2))
+
+        self.assertEqual([r.record_id for r in results], [97, None, 99])
+        self.assertIsInstance(results[1].error, RequestException)
+
+    @unittest.skipIf(not _has_ijson, u'ijson not installed')
+    @mock.patch.object(requests.Session, u'request')
+    def test_get_records_stream(self, mock_request):
+        u"""Test that a streamed response yields the same records as a parsed one."""
+        mock_response = mock.Mock()
+        mock_response.raw = io.BytesIO(
+            b'{"response": {"dataInfo": {"foundCount": 2, "returnedCount": 2}, "data": ['
+            b'{"fieldData": {"name": "a"}, "portalData": {}, "recordId": "1", "modId": "1"}, '
+            b'{"fieldData": {"name": "b"}, "portalData": {}, "recordId": "2", "modId": "1"}]}, '
+            b'"messages": [{"code": "0"}]}'
+        )
+        mock_request.return_value = mock_response
+
+        foundset = self._fms.get_records(stream=True)
+
+        self.assertEqual(foundset.info[u'foundCount'], 2)
+        self.assertEqual([r.name for r in foundset], [u'a', u'b'])
+        self.assertTrue(mock_request.call_args[1][u'stream'])
+
+    @mock.patch.object(requests.Session, u'request')
+    def test_custom_json_codec(self, mock_request):
+        u"""Test that a configured codec is used for request data, sort params and responses."""
+        codec = JSONCodec(u'test', mock.Mock(side_effect=json.dumps),
+                          mock.Mock(side_effect=json.loads))
+        fms = fmrest.Server(url=URL,
+                            user=ACCOUNT_NAME,
+                            password=ACCOUNT_PASS,
+                            database=DATABASE,
+                            layout=LAYOUT,
+                            json_codec=codec
+                           )
+        mock_response = mock.Mock()
+        mock_response.content = json.dumps(_mock_page_response([1], 1).json.return_value)
+        mock_request.return_value = mock_response
+
+        fms.get_records(sort=[{u'fieldName': u'name'}])
+        fms.find([{u'name': u'David'}])
+
+        self.assertEqual(codec.dumps.call_args_list[0][0][0], [{u'fieldName': u'name'}])
+        self.assertEqual(codec.dumps.call_args_list[1][0][0][u'query'], [{u'name': u'David'}])
+        self.assertEqual(codec.loads.call_count, 2)
+        self.assertFalse(mock_response.json.called)
+
+        mock_response.content = u'<html>'
+        with self.assertRaises(BadJSON):
+            fms.find([{u'name': u'David'}])
+
+    @mock.patch.object(requests.Session, u'request')
+    def test_module_json_codec(self, mock_request):
+        u"""Test that responses are decoded from their content with a module-wide codec other
+        than json, as with orjson or ujson installed."""
+        codec = JSONCodec(u'test', json.dumps, mock.Mock(side_effect=json.loads))
+        previous = get_json_codec()
+        set_json_codec(codec)
+        try:
+            mock_response = mock.Mock()
+            mock_response.content = json.dumps(_mock_page_response([1, 2], 2).json.return_value)
+            mock_request.return_value = mock_response
+
+            self.assertEqual([r.record_id for r in self._fms.get_records()], [1, 2])
+            codec.loads.assert_called_once_with(mock_response.content)
+            self.assertFalse(mock_response.json.called)
+        finally:
+            set_json_codec(previous)
+
+    def test_records_share_schema(self):
+        u"""Test that records and portal rows of one response share their schema."""
+        rows = [{u'recordId': u'1', u'note': u'x'}, {u'recordId': u'2', u'note': u'y'}]
+        response = {u'data': [
+            {u'fieldData': {u'name': u'a'}, u'portalData': {u'notes': rows[:1]},
+             u'recordId': u'1', u'modId': u'1'},
+            {u'fieldData': {u'name': u'b'}, u'portalData': {u'notes': rows[1:]},
+             u'recordId': u'2', u'modId': u'1'},
+            {u'fieldData': {u'city': u'c'}, u'portalData': {},
+             u'recordId': u'3', u'modId': u'1'}
+        ]}
+
+        first, second, third = self._fms._process_foundset_response(response)
+
+        self.assertIs(first._keys, second._keys)
+        self.assertIsNot(second._keys, third._keys)
+        self.assertEqual(second.name, u'b')
+        self.assertEqual(third.city, u'c')
+        self.assertEqual(third.record_id, 3)
+
+        first_note, second_note = first.portal_notes[0], second.portal_notes[0]
+        self.assertIs(first_note._keys, second_note._keys)
+        self.assertEqual(second_note.note, u'y')
+
+    def test_lazy_records(self):
+        u"""Test that lazy_records returns LazyRecords with portal foundsets and info."""
+        self._fms.lazy_records = True
+        response = {u'data': [
+            {u'fieldData': {u'name': u'a'}, u'portalData': {u'notes': [{u'note': u'x'}]},
+             u'portalDataInfo': [{u'table': u'notes', u'foundCount': 1}],
+             u'recordId': u'1', u'modId': u'1'}
+        ]}
+
+        record, = self._fms._process_foundset_response(response)
+
+        self.assertIsInstance(record, LazyRecord)
+        self.assertEqual(record.name, u'a')
+        self.assertEqual(record.portal_notes.info[u'foundCount'], 1)
+        self.assertEqual(record.portal_notes[0].note, u'x')
+        self.assertNotIn(u'recordId', response[u'data'][0][u'fieldData'])
+
+    @mock.patch.object(requests.Session, u'request')
+    def test_get_records_columnar(self, mock_request):
+        u"""Test that get_records(columnar=True) returns a ColumnarFoundset."""
+        mock_request.return_value = _mock_page_response([1, 2], 2)
+
+        foundset = self._fms.get_records(columnar=True)
+
+        self.assertIsInstance(foundset, ColumnarFoundset)
+        self.assertEqual(foundset.info[u'foundCount'], 2)
+        self.assertEqual(foundset.column(u'recordId'), [u'1', u'2'])
+        self.assertEqual(foundset[1].name, u'dummy')
+
+    @unittest.skipUnless(_has_pandas, u'requires pandas')
+    @mock.patch.object(requests.Session, u'request')
+    def test_to_df(self, mock_request):
+        u"""Test that to_df() builds one DataFrame from all pages."""
+        mock_request.side_effect = [_mock_page_response([1, 2], 3), _mock_page_response([3], 3)]
+
+        df = self._fms.to_df(page_size=2)
+
+        self.assertEqual(list(df.columns), [u'name', u'recordId', u'modId'])
+        self.assertEqual(list(df[u'recordId']), [u'1', u'2', u'3'])
+        self.assertEqual(mock_request.call_count, 2)
+
+    @unittest.skipUnless(_has_pandas, u'requires pandas')
+    @mock.patch.object(requests.Session, u'request')
+    def test_bounded_foundset_cache(self, mock_request):
+        u"""Test that foundsets with a bounded cache policy don't keep the response data, while
+        to_df() still builds the DataFrame from it."""
+        self._fms.foundset_cache = window(1)
+        mock_request.return_value = _mock_page_response([1, 2], 2)
+
+        foundset = self._fms.get_records()
+        self.assertIsNone(foundset._data[0])
+        self.assertEqual([record.record_id for record in foundset], [1, 2])
+        self.assertEqual(list(self._fms.to_df()[u'recordId']), [u'1', u'2'])
+
+    @mock.patch.object(requests.Session, u'request')
+    def test_layout_metadata_conversion(self, mock_request):
+        u"""Test that layout metadata is cached and drives type conversion."""
+        metadata_response = mock.Mock()
+        metadata_response.json.return_value = {
+            u'messages': [{u'code': u'0'}],
+            u'response': {u'fieldMetaData': [{u'name': u'zip', u'result': u'text'},
+                                             {u'name': u'amount', u'result': u'number'}]}
+        }
+        page_response = mock.Mock()
+        page_response.json.return_value = {
+            u'messages': [{u'code': u'0'}],
+            u'response': {
+                u'dataInfo': {u'foundCount': 1, u'returnedCount': 1},
+                u'data': [{u'fieldData': {u'zip': u'01234', u'amount': u'42'}, u'portalData': {},
+                           u'recordId': u'1', u'modId': u'1'}]
+            }
+        }
+        mock_request.side_effect = [page_response, metadata_response, page_response]
+        self._fms.type_conversion = True
+        self._fms.use_layout_metadata = True
+
+        first = self._fms.get_records()[0]
+        second = self._fms.get_records()[0]
+
+        self.assertEqual((first.zip, first.amount), (u'01234', 42))
+        self.assertEqual(second.amount, 42)
+        self.assertEqual(mock_request.call_count, 3)
+        self.assertTrue(mock_request.call_args_list[1][1][u'url'].endswith(u'/layouts/' + LAYOUT))
+
+        self._fms.clear_layout_metadata()
+        mock_request.side_effect = [metadata_response]
+        self._fms.get_layout_metadata()
+        self.assertEqual(mock_request.call_count, 4)
+
+    @mock.patch.object(requests.Session, u'request')
+    def test_response_cache(self, mock_request):
+        u"""Test that repeated reads are answered from the cache until a write invalidates them."""
+        cache = fmrest.ResponseCache()
+        self._fms.response_cache = cache
+        mock_request.return_value = _mock_page_response([1], 1)
+
+        self._fms.find([{u'name': u'David'}], sort=None)
+        foundset = self._fms.find([{u'name': u'David'}])
+        self._fms.get_record(1)
+        self._fms.get_record(1)
+
+        self.assertEqual(mock_request.call_count, 2)
+        self.assertEqual(foundset[0].name, u'dummy')
+        self.assertEqual(foundset[0].record_id, 1)
+        self.assertEqual(self._fms.last_error, 0)
+        self.assertEqual(cache.stats()[u'hits'], 2)
+        self.assertEqual(cache._bytes, 2 * len(mock_request.return_value.content))
+        # consuming records must not modify the cached responses
+        for _, _, response in cache._entries.itervalues():
+            self.assertEqual(response[u'data'][0][u'fieldData'], {u'name': u'dummy'})
+
+        mock_request.return_value = _mock_token_response(None)
+        self._fms.delete_record(2)
+        self.assertEqual(len(cache), 1) # get_record(1) is not affected
+
+        mock_request.return_value = _mock_page_response([1], 1)
+        self._fms.find([{u'name': u'David'}])
+        self.assertEqual(mock_request.call_count, 4)
+
+
+def _mock_token_response(token):
+    u"""Returns a mocked response for a login or logout request."""
+    mock_response = mock.Mock()
+    mock_response.json.return_value = {u'messages': [{u'code': u'0'}],
+                                       u'response': {u'token': token} if token else {}}
+    return mock_response
+
+def _mock_page_response(record_ids, found_count):
+    u"""Returns a mocked response for a page of records with the given record ids."""
+    mock_response = mock.Mock()
+    mock_response.json.return_value = {
+        u'messages': [{u'code': u'0'}],
+        u'response': {
+            u'dataInfo': {u'foundCount': found_count, u'returnedCount': len(record_ids)},
+            u'data': [
+                {u'fieldData': {u'name': u'dummy'}, u'portalData': {},
+                 u'recordId': unicode(record_id), u'modId': u'1'}
+                for record_id in record_ids
+            ]
+        }
+    }
+    mock_response.content = json.dumps(mock_response.json.return_value)
+    return mock_response
@@ -0,0 +1,106 @@
+u"""SessionPool test suite"""
+from __future__ import with_statement
+from __future__ import absolute_import
+import unittest
+import time
+import mock
+import requests
+import fmrest
+from fmrest.exceptions import FileMakerError, FMRestException
+
+URL = u'https://111.111.111.111'
+ACCOUNT_NAME = u'demo'
+ACCOUNT_PASS = u'demo'
+DATABASE = u'Demo'
+LAYOUT = u'Demo'
+
+def _mock_response(code = u'0', token = None):
+    u"""Returns a mocked Data API response with the given error code and token."""
+    mock_response = mock.Mock()
+    mock_response.json.return_value = {u'messages': [{u'code': code}],
+                                       u'response': {u'token': token} if token else {}}
+    return mock_response
+
+class SessionPoolTestCase(unittest.TestCase):
+    u"""SessionPool test suite.
+
+    Only put mocked requests here that don't need an actual FileMaker Server.
+    """
+    def setUp(self):
+
+        # disable urlib warnings as we are testing with non verified certs
+        requests.packages.urllib3.disable_warnings()
+
+        self._fms = fmrest.Server(url=URL,
+                                  user=ACCOUNT_NAME,
+                                  password=ACCOUNT_PASS,
+                                  database=DATABASE,
+                                  layout=LAYOUT
+                                 )
+        self._logins = []
+
+    def _respond(self, method, url, **kwargs):
+        u"""Answers logins with a new token, logouts with success."""
+        if method == u'POST':
+            self._logins.append(True)
+            return _mock_response(token=u'token%d' % len(self._logins))
+        return _mock_response()
+
+    @mock.patch.object(requests.Session, u'request')
+    def test_session_reuse(self, mock_request):
+        u"""Test that checked in sessions are handed out again without a new login."""
+        mock_request.side_effect = self._respond
+        pool = fmrest.SessionPool(self._fms, size=2)
+
+        with pool.session() as server:
+            token = server._token
+        with pool.session() as server:
+            self.assertEqual(server._token, token)
+
+        self.assertEqual(len(self._logins), 1)
+        self.assertIsNone(self._fms._token)
+
+    @mock.patch.object(requests.Session, u'request')
+    def test_bounded_size(self, mock_request):
+        u"""Test that no more than size sessions are handed out at the same time."""
+        mock_request.side_effect = self._respond
+        pool = fmrest.SessionPool(self._fms, size=2, timeout=0.1)
+
+        first = pool.checkout()
+        second = pool.checkout()
+        self.assertNotEqual(first._token, second._token)
+
+        with self.assertRaises(FMRestException):
+            pool.checkout()
+
+        pool.checkin(first)
+        self.assertIs(pool.checkout(), first)
+        self.assertEqual(pool.in_use, 2)
+
+    @mock.patch.object(requests.Session, u'request')
+    def test_invalid_token_replacement(self, mock_request):
+        u"""Test that a session failing with error 952 is replaced by a new login."""
+        mock_request.side_effect = self._respond
+        pool = fmrest.SessionPool(self._fms, size=1)
+
+        with self.assertRaises(FileMakerError):
+            with pool.session() as server:
+                mock_request.side_effect = lambda *args, **kwargs: _mock_response(u'952')
+                server.get_record(1)
+
+        mock_request.side_effect = self._respond
+        with pool.session() as server:
+            self.assertEqual(server._token, u'token2')
+
+    @mock.patch.object(requests.Session, u'request')
+    def test_reap_idle_sessions(self, mock_request):
+        u"""Test that idle sessions are logged out once they exceed max_idle."""
+        mock_request.side_effect = self._respond
+        pool = fmrest.SessionPool(self._fms, size=2, max_idle=0.05)
+
+        pool.checkin(pool.checkout())
+        time.sleep(0.1)
+
+        self.assertEqual(pool.reap(), 1)
+        self.assertEqual(mock_request.call_args[1][u'method'], u'DELETE')
+        self.assertEqual(pool.in_use, 0)
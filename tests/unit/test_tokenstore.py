@@ -0,0 +1,97 @@
+u"""FileTokenStore test suite"""
+from __future__ import with_statement
+from __future__ import absolute_import
+import os
+import shutil
+import tempfile
+import time
+import unittest
+import mock
+import requests
+import fmrest
+from fmrest.tokenstore import FileTokenStore
+
+URL = u'https://111.111.111.111'
+ACCOUNT_NAME = u'demo'
+ACCOUNT_PASS = u'demo'
+DATABASE = u'Demo'
+LAYOUT = u'Demo'
+
+def _mock_response(code = u'0', token = None):
+    u"""Returns a mocked Data API response with the given error code and token."""
+    mock_response = mock.Mock()
+    mock_response.json.return_value = {
+        u'messages': [{u'code': code}],
+        u'response': {u'token': token} if token else {
+            u'data': [{u'fieldData': {}, u'portalData': {}, u'recordId': u'1', u'modId': u'1'}]
+        }
+    }
+    return mock_response
+
+class FileTokenStoreTestCase(unittest.TestCase):
+    u"""FileTokenStore test suite"""
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self._store = FileTokenStore(os.path.join(self._dir, u'tokens'))
+        self._key = FileTokenStore.make_key(URL, DATABASE, ACCOUNT_NAME)
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def _server(self):
+        return fmrest.Server(url=URL,
+                             user=ACCOUNT_NAME,
+                             password=ACCOUNT_PASS,
+                             database=DATABASE,
+                             layout=LAYOUT,
+                             token_store=self._store
+                            )
+
+    def test_store_and_expiry(self):
+        u"""Test that tokens are returned until they have likely expired."""
+        self.assertIsNone(self._store.get(self._key))
+
+        self._store.set(self._key, u'token')
+        self.assertEqual(self._store.get(self._key)[0], u'token')
+
+        self._store.set(self._key, u'token', time.time() - 15 * 60)
+        self.assertIsNone(self._store.get(self._key))
+
+        self._store.delete(self._key)
+        self.assertIsNone(self._store.get(self._key))
+
+    def test_key_per_identity(self):
+        u"""Test that tokens of different users or data sources don't collide."""
+        self.assertNotEqual(self._key, FileTokenStore.make_key(URL, DATABASE, u'other'))
+        self.assertNotEqual(
+            self._key,
+            FileTokenStore.make_key(URL, DATABASE, ACCOUNT_NAME, [{u'database': u'second'}])
+        )
+
+    @mock.patch.object(requests.Session, u'request')
+    def test_token_reuse_across_instances(self, mock_request):
+        u"""Test that a second instance re-uses the stored token without login or logout."""
+        mock_request.return_value = _mock_response(token=u'stored')
+
+        with self._server() as fms:
+            fms.login()
+        self.assertEqual(mock_request.call_count, 1)
+
+        with self._server() as fms:
+            self.assertEqual(fms.login(), u'stored')
+        self.assertEqual(mock_request.call_count, 1)
+
+    @mock.patch.object(requests.Session, u'request')
+    def test_invalid_stored_token(self, mock_request):
+        u"""Test that an invalid stored token is replaced by a new login."""
+        self._store.set(self._key, u'stale')
+        mock_request.side_effect = [
+            _mock_response(u'952'),
+            _mock_response(token=u'fresh'),
+            _mock_response()
+        ]
+
+        fms = self._server()
+        fms.login()
+        self.assertEqual(fms.get_record(1).record_id, 1)
+        self.assertEqual(self._store.get(self._key)[0], u'fresh')
@@ -1,7 +1,12 @@
 from __future__ import absolute_import
 import unittest
 import datetime
+import io
+import json
+import time
+import mock
 from fmrest.utils import *
+from fmrest.utils import _has_ijson, _detect_json_codec
 
 class UtilsTestCase(unittest.TestCase):
     u"""Utils test suite"""
@@ -106,6 +111,30 @@ class UtilsTestCase(unittest.TestCase):
             datetime.datetime(1, 12, 1, 20, 45, 30)
         )
 
+    def test_parse_datetime(self):
+        u"""Test that FileMaker dates and timestamps are parsed in the given date order."""
+        self.assertEqual(parse_datetime(u'12/24/2016 20:45:30.25'),
+                         datetime.datetime(2016, 12, 24, 20, 45, 30, 250000))
+        self.assertEqual(parse_datetime(u'24.12.2016', date_order=u'DMY'),
+                         datetime.datetime(2016, 12, 24))
+        self.assertEqual(parse_datetime(u'2016-12-24T20:45:30', date_order=u'YMD'),
+                         datetime.datetime(2016, 12, 24, 20, 45, 30))
+        self.assertEqual(convert_string_type(u'01/02/2017', date_order=u'DMY'),
+                         datetime.datetime(2017, 2, 1))
+
+        for value in u'24/12/2016', u'12/24/16', u'May 2016', u'12/24/2016 25:00:00':
+            with self.assertRaises(ValueError):
+                parse_datetime(value)
+            self.assertEqual(convert_string_type(value), value)
+
+    def test_parse_duration(self):
+        u"""Test that FileMaker times are parsed into timedeltas, also beyond 24 hours."""
+        self.assertEqual(parse_duration(u'100:00:01.5'),
+                         datetime.timedelta(hours=100, seconds=1, microseconds=500000))
+        self.assertEqual(parse_duration(u'08:30'), datetime.timedelta(hours=8, minutes=30))
+        with self.assertRaises(ValueError):
+            parse_duration(u'8h30')
+
     def test_string_to_number_conversion(self):
         u"""Test that strings can be converted into their "guessed" original types."""
 
@@ -124,6 +153,125 @@ class UtilsTestCase(unittest.TestCase):
             unicode
         )
 
+    def test_prefetch_generator(self):
+        u"""Test that prefetching yields all values in order and re-raises producer errors."""
+
+        self.assertEqual(list(prefetch_generator(iter(xrange(10)), 2)), range(10))
+
+        def failing():
+            yield 1
+            raise ValueError(u'page failed')
+
+        values = prefetch_generator(failing())
+        self.assertEqual(next(values), 1)
+        with self.assertRaises(ValueError):
+            next(values)
+
+    def test_prefetch_generator_lookahead(self):
+        u"""Test that the producer does not run further ahead than the lookahead allows."""
+        produced = []
+
+        def producer():
+            for i in xrange(10):
+                produced.append(i)
+                yield i
+
+        values = prefetch_generator(producer(), 2)
+        self.assertEqual(next(values), 0)
+        time.sleep(0.3)
+
+        # one consumed, two buffered, one waiting to be put into the buffer
+        self.assertLessEqual(len(produced), 4)
+        values.close()
+
+    def test_concurrent_map(self):
+        u"""Test that concurrent_map returns all results, in order if requested."""
+
+        def slow_square(value):
+            time.sleep(0.01 * (value % 3))
+            return value * value
+
+        self.assertEqual(list(concurrent_map(slow_square, xrange(20), 4)),
+                         [i * i for i in xrange(20)])
+        self.assertEqual(sorted(concurrent_map(slow_square, xrange(20), 4, ordered=False)),
+                         [i * i for i in xrange(20)])
+
+    def test_concurrent_map_error(self):
+        u"""Test that exceptions of the mapped function are re-raised in the consumer."""
+
+        def fail_on_three(value):
+            if value == 3:
+                raise ValueError(u'three')
+            return value
+
+        with self.assertRaises(ValueError):
+            list(concurrent_map(fail_on_three, xrange(10), 2))
+
+    @unittest.skipIf(not _has_ijson, u'ijson not installed')
+    def test_parse_streamed_response(self):
+        u"""Test that records are parsed one by one and trailing messages are added afterwards."""
+        # FMS sends dataInfo before data and messages after the response
+        raw = (b'{"response": {"dataInfo": {"foundCount": 2}, "data": ['
+               b'{"fieldData": {"price": 1.5}, "portalData": {"notes": [{"id": 1}]}}, '
+               b'{"fieldData": {"price": 2}, "portalData": {}}]}, '
+               b'"messages": [{"code": "0"}]}')
+        body = json.loads(raw)
+        response = mock.Mock()
+        response.raw = io.BytesIO(raw)
+
+        parsed = parse_streamed_response(response)
+        self.assertEqual(parsed[u'response'][u'dataInfo'], {u'foundCount': 2})
+        self.assertNotIn(u'messages', parsed)
+
+        records = parsed[u'response'][u'data']
+        first = next(records)
+        self.assertEqual(first, body[u'response'][u'data'][0])
+        self.assertIsInstance(first[u'fieldData'][u'price'], float)
+        self.assertEqual(list(records), body[u'response'][u'data'][1:])
+        self.assertEqual(parsed[u'messages'], body[u'messages'])
+        response.close.assert_called_once_with()
+
+    @unittest.skipIf(not _has_ijson, u'ijson not installed')
+    def test_parse_streamed_error_response(self):
+        u"""Test that a response without data array is parsed completely."""
+        raw = b'{"messages": [{"code": "401"}], "response": {}}'
+        response = mock.Mock()
+        response.raw = io.BytesIO(raw)
+
+        self.assertEqual(parse_streamed_response(response), json.loads(raw))
+
+    def test_set_json_codec(self):
+        u"""Test that the module-wide codec can be replaced and restored."""
+        previous = get_json_codec()
+        codec = JSONCodec(u'test', json.dumps, json.loads)
+
+        try:
+            set_json_codec(codec)
+            self.assertIs(get_json_codec(), codec)
+
+            set_json_codec(None)
+            self.assertIn(get_json_codec().name, [u'orjson', u'ujson', u'json'])
+        finally:
+            set_json_codec(previous)
+
+    def test_imprecise_ujson_skipped(self):
+        u"""Test that a ujson losing float precision is not picked, while a precise one is."""
+        def ujson_module(loads):
+            module = mock.Mock(spec=[u'dumps', u'loads'])
+            module.dumps = json.dumps
+            module.loads = loads
+            return module
+
+        def imprecise_loads(value):
+            return json.loads(value, parse_float=lambda number: round(float(number), 10))
+
+        with mock.patch.dict(u'sys.modules', {u'orjson': None,
+                                              u'ujson': ujson_module(imprecise_loads)}):
+            self.assertIs(_detect_json_codec(), STDLIB_JSON)
+        with mock.patch.dict(u'sys.modules', {u'orjson': None,
+                                              u'ujson': ujson_module(json.loads)}):
+            self.assertEqual(_detect_json_codec().name, u'ujson')
+
     def test_filename_from_url(self):
         u"""Test that we can extract the file name from a FM RC URL."""
 